@@ -1,20 +1,51 @@
 # app.py
 import os
 import uuid
+import atexit
 import csv
+import hmac
+import json
+import logging
+import logging.handlers
+import math
+import mmap
+import struct
+import sys
+import tempfile
+import zlib
 import qrcode
 import razorpay
 import random
-
+import queue
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import click
 import pandas as pd
 from dotenv import load_dotenv
 from flask import (
-    Flask, render_template, jsonify, request, redirect,
-    url_for, flash, session, send_file
+    Flask, Response, g, has_request_context, render_template, jsonify, request, redirect,
+    url_for, flash, session, send_file, stream_template
 )
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from werkzeug.middleware.proxy_fix import ProxyFix
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta, timezone
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import (
+    case, create_engine, delete, event, func, inspect as sa_inspect, literal, or_, union_all, update
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import CreateIndex
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet
 from twilio.rest import Client
@@ -26,6 +57,10 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 from flask import jsonify
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: rate-limit buckets stay per-process
+    fcntl = None
 # ---------------- Load env ----------------
 load_dotenv()
 
@@ -43,15 +78,291 @@ app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 
+# ---------------- Attendance batching config ----------------
+# When enabled, /verify marks arriving within ATTENDANCE_BATCH_WAIT_MS of each
+# other are written in one transaction (run gunicorn with --threads for this).
+app.config['ATTENDANCE_BATCHING'] = os.getenv('ATTENDANCE_BATCHING', 'False') == 'True'
+app.config['ATTENDANCE_BATCH_MAX'] = int(os.getenv('ATTENDANCE_BATCH_MAX', 64))
+app.config['ATTENDANCE_BATCH_WAIT_MS'] = float(os.getenv('ATTENDANCE_BATCH_WAIT_MS', 5))
+
+# ---------------- Background task config ----------------
+app.config['BACKGROUND_TASKS'] = os.getenv('BACKGROUND_TASKS', 'True') == 'True'
+
+# ---------------- Pending registration config ----------------
+# Registrations waiting on payment live server-side for this many seconds;
+# the session cookie only carries a short lookup token.
+app.config['PENDING_REGISTRATION_TTL'] = int(os.getenv('PENDING_REGISTRATION_TTL', 7200))
+app.config['PENDING_SWEEP_INTERVAL'] = int(os.getenv('PENDING_SWEEP_INTERVAL', 60))
+
+# ---------------- Seat capacity config ----------------
+# EVENT_CAPACITY counts people (student + family members); 0 means unlimited.
+# A seat hold is taken before the Razorpay order is created and lasts SEAT_HOLD_TTL seconds;
+# the pending registration expires with it.
+app.config['EVENT_CAPACITY'] = int(os.getenv('EVENT_CAPACITY', 0))
+app.config['SEAT_HOLD_TTL'] = int(os.getenv('SEAT_HOLD_TTL', 600))
+app.config['SEAT_HOLD_SWEEP_INTERVAL'] = int(os.getenv('SEAT_HOLD_SWEEP_INTERVAL', 15))
+
+# ---------------- Waitlist config ----------------
+# Once sold out, registrants queue FIFO. Freed seats are offered at most
+# WAITLIST_PROMOTION_BATCH at a time, and an offer is held for WAITLIST_OFFER_TTL seconds.
+app.config['WAITLIST_PROMOTION_BATCH'] = int(os.getenv('WAITLIST_PROMOTION_BATCH', 20))
+app.config['WAITLIST_PROMOTE_INTERVAL'] = int(os.getenv('WAITLIST_PROMOTE_INTERVAL', 30))
+app.config['WAITLIST_OFFER_TTL'] = int(os.getenv('WAITLIST_OFFER_TTL', 3600))
+app.config['PUBLIC_BASE_URL'] = os.getenv('PUBLIC_BASE_URL', 'http://localhost:5000')
+
+# ---------------- /pay rate limit config ----------------
+# Token buckets (tokens/second + burst) shared by all workers on the host through
+# RATE_LIMIT_FILE; a rate of 0 disables that bucket. PAY_MAX_IN_FLIGHT caps
+# concurrent /pay requests per worker process (meaningful with gunicorn --threads).
+# Per-IP budgets are sized for a whole campus registering from behind one NAT.
+app.config['PAY_GLOBAL_RATE'] = float(os.getenv('PAY_GLOBAL_RATE', 20))
+app.config['PAY_GLOBAL_BURST'] = float(os.getenv('PAY_GLOBAL_BURST', 40))
+app.config['PAY_IP_RATE'] = float(os.getenv('PAY_IP_RATE', 1))
+app.config['PAY_IP_BURST'] = float(os.getenv('PAY_IP_BURST', 50))
+app.config['PAY_MAX_IN_FLIGHT'] = int(os.getenv('PAY_MAX_IN_FLIGHT', 8))
+app.config['PAY_SHED_RETRY_AFTER'] = int(os.getenv('PAY_SHED_RETRY_AFTER', 2))
+app.config['AVAILABILITY_IP_RATE'] = float(os.getenv('AVAILABILITY_IP_RATE', 10))
+app.config['AVAILABILITY_IP_BURST'] = float(os.getenv('AVAILABILITY_IP_BURST', 100))
+# Reverse proxies in front of the app (1 on Render). Only that many
+# X-Forwarded-For hops are believed; with 0 the header is ignored, since
+# anyone can send it and per-IP limits would be bypassed by rotating it.
+app.config['TRUSTED_PROXY_HOPS'] = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+if app.config['TRUSTED_PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'])
+app.config['AVAILABILITY_CACHE_TTL'] = int(os.getenv('AVAILABILITY_CACHE_TTL', 30))
+# Country code assumed for mobile numbers entered without one (E.164 normalization)
+app.config['DEFAULT_COUNTRY_CODE'] = os.getenv('DEFAULT_COUNTRY_CODE', '91')
+
+# Read-model streaming: rows fetched from the cursor per round trip
+app.config['READ_MODEL_CHUNK'] = int(os.getenv('READ_MODEL_CHUNK', 1000))
+# Streamed admin tables: characters of rendered HTML buffered per write
+app.config['TEMPLATE_STREAM_BUFFER'] = int(os.getenv('TEMPLATE_STREAM_BUFFER', 16384))
+
+# Dashboard time series
+app.config['TIMESERIES_MAX_BUCKETS'] = int(os.getenv('TIMESERIES_MAX_BUCKETS', 2000))
+
+# Gate throughput analytics
+app.config['GATE_WINDOW_MINUTES'] = int(os.getenv('GATE_WINDOW_MINUTES', 30))
+app.config['GATE_ROLLING_MINUTES'] = int(os.getenv('GATE_ROLLING_MINUTES', 5))
+
+# Analytics snapshot: dashboards, exports and charts read a copy of the SQLite
+# database refreshed every ANALYTICS_SNAPSHOT_INTERVAL seconds, and fall back to
+# the primary while the copy is older than ANALYTICS_MAX_STALENESS. The path
+# defaults to the primary's file plus "-analytics".
+app.config['ANALYTICS_SNAPSHOT'] = os.getenv('ANALYTICS_SNAPSHOT', 'False') == 'True'
+app.config['ANALYTICS_SNAPSHOT_PATH'] = os.getenv('ANALYTICS_SNAPSHOT_PATH')
+app.config['ANALYTICS_SNAPSHOT_INTERVAL'] = int(os.getenv('ANALYTICS_SNAPSHOT_INTERVAL', 30))
+app.config['ANALYTICS_MAX_STALENESS'] = int(os.getenv('ANALYTICS_MAX_STALENESS', 120))
+# WAL journal on the primary SQLite file: readers, including the snapshot copy,
+# never block the gates' commits. Turn off only where WAL can't work (network filesystems).
+app.config['SQLITE_WAL'] = os.getenv('SQLITE_WAL', 'True') == 'True'
+# How long a SQLite write waits for another connection's lock before failing
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+# Razorpay reconciliation (flask reconcile-razorpay): concurrent list calls,
+# each paging through one RAZORPAY_RECONCILE_SLICE-second slice of the range
+app.config['RAZORPAY_RECONCILE_WORKERS'] = int(os.getenv('RAZORPAY_RECONCILE_WORKERS', 8))
+app.config['RAZORPAY_RECONCILE_SLICE'] = int(os.getenv('RAZORPAY_RECONCILE_SLICE', 6 * 3600))
+
+# /metrics: every worker writes its own file in METRICS_DIR and a scrape sums
+# them (empty the directory on deploy). Set METRICS_TOKEN to require
+# "Authorization: Bearer <token>".
+app.config['METRICS_DIR'] = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'campusconnect-metrics'))
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+
+# SQL diagnostics: statements slower than SLOW_QUERY_MS are logged with their
+# route. QUERY_DEBUG (on with FLASK_DEBUG) adds an X-Query-Summary header (a
+# db.query_summary log line for streamed pages) and warns when one request
+# runs the same statement NPLUSONE_THRESHOLD+ times.
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))
+app.config['QUERY_DEBUG'] = os.getenv('QUERY_DEBUG', os.getenv('FLASK_DEBUG', 'False')) in ('True', '1')
+app.config['NPLUSONE_THRESHOLD'] = int(os.getenv('NPLUSONE_THRESHOLD', 5))
+
+# On-demand profiler (/admin/profiles): samples the request thread's stack every
+# PROFILE_INTERVAL_MS and keeps the newest PROFILE_KEEP collapsed-stack files
+app.config['PROFILE_DIR'] = os.getenv(
+    'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'campusconnect-profiles'))
+app.config['PROFILE_INTERVAL_MS'] = float(os.getenv('PROFILE_INTERVAL_MS', 2))
+app.config['PROFILE_KEEP'] = int(os.getenv('PROFILE_KEEP', 50))
+app.config['PROFILE_MAX_REQUESTS'] = int(os.getenv('PROFILE_MAX_REQUESTS', 20))
+
+# Logging: JSON lines on stdout, written by a background listener thread.
+# LOG_SAMPLE_RATES keeps only a fraction of high-volume INFO events, keyed by
+# event name or "request:<endpoint>" for the per-request access line.
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')
+app.config['LOG_QUEUE_SIZE'] = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+app.config['LOG_SAMPLE_RATES'] = os.getenv('LOG_SAMPLE_RATES', 'attendance.scan=0.1,request:verify=0.1')
+
+# Admin search (FTS5 autocomplete)
+app.config['ADMIN_SEARCH_LIMIT'] = int(os.getenv('ADMIN_SEARCH_LIMIT', 10))
+app.config['ADMIN_SEARCH_MAX_LIMIT'] = int(os.getenv('ADMIN_SEARCH_MAX_LIMIT', 100))
+app.config['RATE_LIMIT_FILE'] = os.getenv(
+    'RATE_LIMIT_FILE', os.path.join(tempfile.gettempdir(), 'campusconnect-ratelimit.bin'))
+
+# ---------------- Logging ----------------
+# Request threads only build a LogRecord and put it on a bounded queue; a
+# QueueListener thread per worker formats it as one JSON line and writes it.
+# When the queue is full the record is dropped (and counted) instead of
+# blocking the request.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        line = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': record.getMessage(),
+        }
+        line.update((k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exc'] = record.exc_text
+        return json.dumps(line, default=str, ensure_ascii=False)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request id / route / UID and applies sampling, in the calling thread."""
+
+    def __init__(self, sample_rates):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    def filter(self, record):
+        route = None
+        if has_request_context():
+            route = request.endpoint
+            record.request_id = g.get('request_id')
+            record.route = route
+            uid = (request.view_args or {}).get('uid')
+            if uid and not hasattr(record, 'uid'):
+                record.uid = uid
+        if record.levelno < logging.WARNING and self.sample_rates:
+            rate = self.sample_rates.get(f"{record.msg}:{route}", self.sample_rates.get(record.msg))
+            if rate is not None:
+                if random.random() >= rate:
+                    return False
+                record.sample_rate = rate
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops on a full queue and starts its listener once per process (after fork)."""
+
+    def __init__(self, queue_, target):
+        super().__init__(queue_)
+        self.target = target
+        self.dropped = 0
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid != os.getpid():
+                listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+                listener.start()
+                self.listener, self._listener_pid = listener, os.getpid()
+
+    def prepare(self, record):
+        # Unlike the stock prepare(), keep the traceback out of the message: the
+        # formatter puts it in its own "exc" field
+        record = logging.makeLogRecord(vars(record))
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Block until everything queued so far has been written (tests, shutdown)."""
+        if self._listener_pid == os.getpid():
+            self.listener.stop()
+            self._listener_pid = None
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        key, _, rate = item.partition('=')
+        rates[key.strip()] = float(rate)
+    return rates
+
+
+def configure_logging():
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    handler = NonBlockingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']), stream)
+    logger = logging.getLogger('campusconnect')
+    logger.filters[:] = [RequestContextFilter(parse_sample_rates(app.config['LOG_SAMPLE_RATES']))]
+    logger.handlers[:] = [handler]
+    logger.setLevel(app.config['LOG_LEVEL'])
+    logger.propagate = False
+    atexit.register(handler.flush)
+    return logger
+
+
+log = configure_logging()
+
 # ---------------- DB ----------------
-db = SQLAlchemy(app)
+class RoutingSession(FlaskSession):
+    """
+    Sends SELECTs to the analytics snapshot while a reads_snapshot view is
+    running; flushes, writes and raw connections always use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and getattr(clause, 'is_select', False)
+                and has_request_context() and g.get('analytics_engine') is not None):
+            return g.analytics_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    dbapi_connection.execute(f"PRAGMA busy_timeout = {app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    if app.config['SQLITE_WAL'] and db.engine.url.database not in (None, '', ':memory:'):
+        # persistent in the file; on later connections this is just a read
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+
+with app.app_context():
+    if db.engine.url.get_backend_name() == 'sqlite':
+        event.listen(db.engine, 'connect', _sqlite_pragmas)
+
+
+def begin_write():
+    """
+    Take SQLite's write lock at the start of the session's transaction. A
+    deferred transaction that reads before it writes (the student FTS triggers
+    do) can't wait out busy_timeout if another commit lands in between; SQLite
+    fails it at once with "database is locked".
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
 
 # ---------------- Razorpay client (test or live via env) ----------------
 RAZORPAY_KEY_ID = os.getenv('RAZORPAY_KEY_ID')
 RAZORPAY_KEY_SECRET = os.getenv('RAZORPAY_KEY_SECRET')
 if not (RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET):
     raise RuntimeError("Set RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET in .env")
-razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
+# RAZORPAY_BASE_URL points the client at a stand-in server (loadtest/fakes.py)
+razorpay_client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
+                                  base_url=os.getenv('RAZORPAY_BASE_URL', razorpay.constants.URL.BASE_URL))
+RAZORPAY_WEBHOOK_SECRET = os.getenv('RAZORPAY_WEBHOOK_SECRET')
 
 # ---------------- Twilio (WhatsApp) ----------------
 TWILIO_SID = os.getenv('TWILIO_SID')
@@ -59,11 +370,18 @@ TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_WHATSAPP = os.getenv('TWILIO_WHATSAPP', 'whatsapp:+14155238886')
 if TWILIO_SID and TWILIO_AUTH_TOKEN:
     twilio_client = Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
+    if os.getenv('TWILIO_API_BASE_URL'):
+        twilio_client.api.base_url = os.getenv('TWILIO_API_BASE_URL')
 else:
     twilio_client = None
 
 # ---------------- Models ----------------
 class Student(db.Model):
+    # Covering indexes for the polled counts: the dashboard's GROUP BY semester,
+    # attended and paid / refunded totals, and the gate panel's expected arrivals
+    __table_args__ = (db.Index('ix_student_semester_attended', 'semester', 'attended'),
+                      db.Index('ix_student_refunded_payment_status', 'refunded', 'payment_status'),
+                      db.Index('ix_student_payment_status_attended', 'payment_status', 'attended'))
     id = db.Column(db.Integer, primary_key=True)
     unique_id = db.Column(db.String(100), unique=True)
     name = db.Column(db.String(100))
@@ -73,11 +391,152 @@ class Student(db.Model):
     family_members = db.Column(db.Integer, default=0)  # NEW FIELD ✅
     attended = db.Column(db.Boolean, default=False)
     upi_id = db.Column(db.String(100))
-    transaction_id = db.Column(db.String(100))
-    razorpay_order_id = db.Column(db.String(100))
+    # Unique so a replayed payment callback can never create a second registration
+    transaction_id = db.Column(db.String(100), unique=True, index=True)
+    razorpay_order_id = db.Column(db.String(100), unique=True, index=True)
     payment_status = db.Column(db.String(50))
     refund_id = db.Column(db.String(100))
     refunded = db.Column(db.Boolean, default=False)
+    # Filled from email / mobile_number whenever they're written (see _normalize_contacts)
+    email_normalized = db.Column(db.String(100), unique=True, index=True)
+    mobile_e164 = db.Column(db.String(20), unique=True, index=True)
+    # When things happened (UTC), for the dashboard time series. Rows from
+    # before these columns existed keep NULLs and are left out of it.
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    attended_at = db.Column(db.DateTime, index=True)
+    refunded_at = db.Column(db.DateTime, index=True)
+
+
+# Contact normalization, used both when storing and when looking up, so
+# duplicate checks are unique-index point lookups.
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+def normalize_mobile(mobile_number):
+    """E.164 form of a mobile number: '+91 98765-43210', '098765 43210' -> '+919876543210'."""
+    raw = (mobile_number or '').strip()
+    digits = ''.join(ch for ch in raw if ch.isdigit())
+    if not digits:
+        return ''
+    if raw.startswith('+'):
+        return '+' + digits
+    if raw.startswith('00'):
+        return '+' + digits[2:]
+    country = app.config['DEFAULT_COUNTRY_CODE']
+    digits = digits.lstrip('0')  # national trunk prefix
+    if len(digits) > 10 and digits.startswith(country):
+        return '+' + digits
+    return f'+{country}{digits}'
+
+@event.listens_for(Student, 'before_insert')
+def _normalize_contacts(mapper, connection, student):
+    student.email_normalized = normalize_email(student.email) or None
+    student.mobile_e164 = normalize_mobile(student.mobile_number) or None
+
+@event.listens_for(Student, 'before_update')
+def _renormalize_changed_contacts(mapper, connection, student):
+    # Only fields that changed: old duplicates the backfill left NULL must stay
+    # NULL, or marking one attended would trip the unique index
+    attrs = sa_inspect(student).attrs
+    if attrs.email.history.has_changes():
+        student.email_normalized = normalize_email(student.email) or None
+    if attrs.mobile_number.history.has_changes():
+        student.mobile_e164 = normalize_mobile(student.mobile_number) or None
+
+
+class PendingRegistration(db.Model):
+    """Registration details held between Razorpay order creation and payment."""
+    __tablename__ = 'pending_registration'
+    order_id = db.Column(db.String(100), primary_key=True)
+    token = db.Column(db.String(32), unique=True, index=True, nullable=False)
+    unique_id = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100))
+    email = db.Column(db.String(100))
+    semester = db.Column(db.Integer)
+    mobile_number = db.Column(db.String(15))
+    family_members = db.Column(db.Integer, default=0)
+    total_amount = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True, nullable=False)
+
+
+class EventCapacity(db.Model):
+    """Single-row seat counters, only ever changed with conditional UPDATEs."""
+    __tablename__ = 'event_capacity'
+    id = db.Column(db.Integer, primary_key=True)
+    capacity = db.Column(db.Integer, nullable=False, default=0)
+    held = db.Column(db.Integer, nullable=False, default=0)
+    confirmed = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SeatHold(db.Model):
+    """Seats reserved for a checkout in progress."""
+    __tablename__ = 'seat_hold'
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.String(100), unique=True, index=True)
+    seats = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, index=True, nullable=False)
+
+
+class WaitlistEntry(db.Model):
+    """A registrant queued for a sold-out event; id order is queue order."""
+    __tablename__ = 'waitlist_entry'
+    __table_args__ = (
+        db.Index('ix_waitlist_entry_status_id', 'status', 'id'),
+        # one place in the queue per person
+        db.Index('ix_waitlist_entry_waiting_email', 'email_normalized',
+                 unique=True, sqlite_where=db.text("status = 'waiting'")),
+        db.Index('ix_waitlist_entry_waiting_mobile', 'mobile_e164',
+                 unique=True, sqlite_where=db.text("status = 'waiting'")),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), unique=True, index=True, nullable=False)
+    name = db.Column(db.String(100))
+    email = db.Column(db.String(100))
+    semester = db.Column(db.Integer)
+    mobile_number = db.Column(db.String(15))
+    family_members = db.Column(db.Integer, default=0)
+    # Set from email / mobile_number by join_waitlist, like Student's
+    email_normalized = db.Column(db.String(100))
+    mobile_e164 = db.Column(db.String(20))
+    status = db.Column(db.String(20), nullable=False, default='waiting')  # waiting / offered / lapsed
+    hold_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    offered_at = db.Column(db.DateTime)
+
+
+class AttendanceLog(db.Model):
+    """One row per successful check-in: who, at which gate, when. Append-only."""
+    __tablename__ = 'attendance_log'
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, index=True)
+    gate = db.Column(db.String(50), nullable=False, default='unknown')
+    marked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class LedgerAccount(db.Model):
+    """Running balance per ledger account, in paise; debits positive, credits negative."""
+    __tablename__ = 'ledger_account'
+    name = db.Column(db.String(30), primary_key=True)
+    balance = db.Column(db.BigInteger, nullable=False, default=0)
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LedgerEntry(db.Model):
+    """
+    One leg of a double-entry posting. Every charge / refund is two legs that
+    sum to zero, sharing the Razorpay payment / refund id as their reference.
+    """
+    __tablename__ = 'ledger_entry'
+    __table_args__ = (db.UniqueConstraint('reference', 'account', name='uq_ledger_entry_reference_account'),)
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(100), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # charge / refund
+    account = db.Column(db.String(30), nullable=False)
+    amount = db.Column(db.BigInteger, nullable=False)
+    balance_after = db.Column(db.BigInteger, nullable=False)
+    student_id = db.Column(db.Integer, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
 # ---------------- CSV paths & helpers ----------------
 CSV_PATH = os.path.join('static', 'csv_exports', 'registrations.csv')
@@ -107,15 +566,16 @@ def append_to_csv(name, email, semester, unique_id, mobile_number, family_member
         ])
 
 
-def update_attendance_in_csv(uid):
+def update_attendance_in_csv(*uids):
     if not os.path.isfile(CSV_PATH):
         return
+    uids = set(uids)
     rows = []
     with open(CSV_PATH, 'r', newline='', encoding='utf-8') as f:
         reader = csv.reader(f)
         headers = next(reader)
         for row in reader:
-            if row[4] == uid:
+            if row[4] in uids:
                 row[-1] = 'Present'
             rows.append(row)
     with open(CSV_PATH, 'w', newline='', encoding='utf-8') as f:
@@ -145,14 +605,29 @@ def admin_required():
     return session.get("admin_logged_in") is True
 
 # ---------------- WhatsApp confirmation ----------------
+def send_whatsapp_message(mobile_number, message_body):
+    if not twilio_client:
+        log.info('whatsapp.skipped', extra={'reason': 'twilio not configured'})
+        return
+    try:
+        with external_call('twilio', 'messages.create'):
+            msg = twilio_client.messages.create(
+                from_=TWILIO_WHATSAPP,
+                body=message_body,
+                to=f'whatsapp:{normalize_mobile(mobile_number)}'
+            )
+        log.info('whatsapp.sent', extra={'sid': msg.sid})
+    except Exception:
+        log.exception('whatsapp.failed')
+
 def send_whatsapp_confirmation(mobile_number, name, event_id):
     if not twilio_client:
-        print("Twilio not configured; skipping WhatsApp message.")
+        log.info('whatsapp.skipped', extra={'reason': 'twilio not configured', 'uid': event_id})
         return
     try:
         student = Student.query.filter_by(unique_id=event_id).first()
         if not student:
-            print(f"No student found for Event ID: {event_id}")
+            log.warning('whatsapp.unknown_student', extra={'uid': event_id})
             return
 
         payment_info = ""
@@ -168,15 +643,17 @@ def send_whatsapp_confirmation(mobile_number, name, event_id):
         message_body = (f"🎉 Hi {name}! Your spot is confirmed ✅\n"
                         f"Event ID: {event_id}."
                         f"{payment_info}\n\nSee you there! 🎯")
+    except Exception:
+        log.exception('whatsapp.failed', extra={'uid': event_id})
+        return
+    send_whatsapp_message(mobile_number, message_body)
 
-        msg = twilio_client.messages.create(
-            from_=TWILIO_WHATSAPP,
-            body=message_body,
-            to=f'whatsapp:+91{mobile_number}'
-        )
-        print("WhatsApp SID:", msg.sid)
-    except Exception as e:
-        print("Error sending WhatsApp:", e)
+def send_whatsapp_waitlist_offer(entry):
+    claim_url = f"{app.config['PUBLIC_BASE_URL'].rstrip('/')}/waitlist/claim/{entry.token}"
+    hours = max(app.config['WAITLIST_OFFER_TTL'] // 3600, 1)
+    send_whatsapp_message(entry.mobile_number,
+                          f"🎟️ Hi {entry.name}! A seat just opened up for you.\n"
+                          f"Complete your registration within {hours}h: {claim_url}")
 
 # ---------------- QR / PDF helpers ----------------
 def generate_qr_code(uid):
@@ -218,13 +695,1886 @@ def generate_pdf(name, email, semester, unique_id, family_members, total_amount,
     c.save()
     return pdf_path
 
+# ---------------- Attendance write coalescing ----------------
+def normalize_gate(gate):
+    """Scanner-supplied gate / device name, trimmed to fit the log column."""
+    return (gate or '').strip()[:50] or 'unknown'
+
+def mark_attendance_batch(uids, gates=None):
+    """
+    Mark a batch of UIDs present in a single transaction.
+    Returns one (status, message) tuple per input UID, in order, matching
+    what the one-scan-at-a-time /verify path would have answered. `gates`
+    (parallel to uids) is recorded in attendance_log for each row flipped.
+    """
+    wanted = set(uids)
+    now = datetime.utcnow()
+    # UPDATE ... RETURNING tells us atomically which rows *we* flipped, so two
+    # gates scanning the same pass can't both get "success".
+    marked = {
+        row.unique_id: row
+        for row in db.session.execute(
+            update(Student)
+            .where(Student.unique_id.in_(wanted), Student.attended == False)
+            .values(attended=True, attended_at=now)
+            .returning(Student.id, Student.unique_id, Student.name, Student.semester)
+        )
+    }
+    if marked:
+        gate_of = {}
+        for uid, gate in zip(uids, gates or [None] * len(uids)):
+            gate_of.setdefault(uid, normalize_gate(gate))
+        db.session.execute(AttendanceLog.__table__.insert(), [
+            {'student_id': row.id, 'gate': gate_of[uid], 'marked_at': now} for uid, row in marked.items()
+        ])
+    known = dict(marked)
+    missing = wanted - known.keys()
+    if missing:
+        for row in db.session.query(Student.unique_id, Student.name).filter(Student.unique_id.in_(missing)):
+            known[row.unique_id] = row
+    db.session.commit()
+
+    if marked:
+        update_attendance_in_csv(*marked)
+
+    results = []
+    answered = set()
+    for uid in uids:
+        row = known.get(uid)
+        if row is None:
+            results.append(("error", "Invalid QR or student not registered."))
+        elif uid in marked and uid not in answered:
+            answered.add(uid)
+            results.append(("success", f"Attendance marked for {row.name} (Sem {row.semester})."))
+        else:
+            results.append(("warning", f"{row.name} has already attended."))
+    return results
+
+
+class _PendingMark:
+    __slots__ = ("uid", "gate", "done", "result")
+
+    def __init__(self, uid, gate=None):
+        self.uid = uid
+        self.gate = gate
+        self.done = threading.Event()
+        self.result = None
+
+
+class AttendanceBatcher:
+    """
+    Collects /verify marks from request threads and commits them in groups.
+    A batch is flushed when it reaches max_batch marks or max_wait_ms after
+    its first mark arrived, whichever comes first.
+    """
+
+    def __init__(self, max_batch=64, max_wait_ms=5.0):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Started lazily (and restarted after a fork) so each gunicorn worker
+        # gets its own writer thread.
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name="attendance-batcher", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, uid, gate=None, timeout=10):
+        """Queue one mark and block until its batch is committed."""
+        self._ensure_started()
+        pending = _PendingMark(uid, gate)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError("attendance batch did not complete in time")
+        if isinstance(pending.result, BaseException):
+            raise pending.result
+        return pending.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with app.app_context():
+            while True:
+                batch = self._collect()
+                try:
+                    results = mark_attendance_batch([p.uid for p in batch], [p.gate for p in batch])
+                except Exception as e:
+                    db.session.rollback()
+                    results = [e] * len(batch)
+                finally:
+                    db.session.remove()
+                for pending, result in zip(batch, results):
+                    pending.result = result
+                    pending.done.set()
+
+
+attendance_batcher = AttendanceBatcher(
+    max_batch=app.config['ATTENDANCE_BATCH_MAX'],
+    max_wait_ms=app.config['ATTENDANCE_BATCH_WAIT_MS'],
+)
+
+# ---------------- Background tasks ----------------
+class PeriodicTask:
+    """
+    Runs fn() inside an app context every `interval` seconds on a daemon thread.
+    Like the attendance batcher, the thread is started lazily per process.
+    """
+
+    def __init__(self, name, interval, fn):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        """Run the task now instead of waiting for the next interval."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    self.fn()
+                except Exception:
+                    db.session.rollback()
+                    log.exception('background_task.failed', extra={'task': self.name})
+                finally:
+                    db.session.remove()
+
+
+background_tasks = []
+
+
+def background_task(name, interval):
+    """Register fn to run periodically in every worker process."""
+    def decorator(fn):
+        fn.task = PeriodicTask(name, interval, fn)
+        background_tasks.append(fn.task)
+        return fn
+    return decorator
+
+
+@app.before_request
+def _start_background_tasks():
+    if not app.config['BACKGROUND_TASKS']:
+        return
+    for task in background_tasks:
+        task.ensure_started()
+
+# ---------------- Pending registrations ----------------
+def save_pending_registration(order_id, data, hold=None):
+    """
+    Persist a registration awaiting payment. Returns the short session token.
+    With a seat hold it expires no later than the hold, so a late payment
+    can't complete a registration whose seats have gone back to the pool.
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=app.config['PENDING_REGISTRATION_TTL'])
+    if hold is not None:
+        expires_at = min(expires_at, hold.expires_at)
+    pending = PendingRegistration(
+        order_id=order_id,
+        token=secrets.token_urlsafe(12),
+        unique_id=data['unique_id'],
+        name=data['name'],
+        email=data['email'],
+        semester=data['semester'],
+        mobile_number=data['mobile_number'],
+        family_members=data['family_members'],
+        total_amount=data['total_amount'],
+        created_at=now,
+        expires_at=expires_at,
+    )
+    db.session.add(pending)
+    db.session.commit()
+    return pending.token
+
+
+def find_pending_registration(order_id=None, token=None):
+    """Look a pending registration up by Razorpay order id, falling back to the session token."""
+    if order_id:
+        pending = db.session.get(PendingRegistration, order_id)
+        if pending:
+            return pending
+    if token:
+        return PendingRegistration.query.filter_by(token=token).first()
+    return None
+
+
+@background_task('pending-registration-sweeper', app.config['PENDING_SWEEP_INTERVAL'])
+def sweep_pending_registrations(now=None):
+    """Delete pending registrations whose TTL has passed. Returns the number removed."""
+    removed = PendingRegistration.query \
+        .filter(PendingRegistration.expires_at < (now or datetime.utcnow())) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+# ---------------- Seat capacity ----------------
+# All counter changes are single conditional UPDATEs on the one event_capacity
+# row, and hold rows are removed with DELETE ... RETURNING, so whichever of
+# confirm / expire / release deletes a hold is the only one that moves its seats.
+EVENT_CAPACITY_ID = 1
+
+def seats_enabled():
+    return app.config['EVENT_CAPACITY'] > 0
+
+def sync_event_capacity():
+    """
+    Create the counter row if missing, set the capacity from config and
+    recount confirmed seats from Paid registrations: nothing maintains the
+    counter while capacity is 0 (unlimited), so it is stale after turning
+    capacity on. One UPDATE, so a seat another worker confirms meanwhile
+    is either counted by it or lands after it, never lost.
+    """
+    paid_seats = db.select(func.coalesce(func.sum(func.coalesce(Student.family_members, 0) + 1), 0)) \
+        .where(Student.payment_status == "Paid").scalar_subquery()
+    # OR IGNORE: a worker that lost the race to create the row leaves it be
+    db.session.execute(db.insert(EventCapacity).prefix_with('OR IGNORE').values(
+        id=EVENT_CAPACITY_ID, capacity=app.config['EVENT_CAPACITY'], held=0, confirmed=0))
+    db.session.execute(
+        update(EventCapacity)
+        .where(EventCapacity.id == EVENT_CAPACITY_ID)
+        .values(capacity=app.config['EVENT_CAPACITY'], confirmed=paid_seats)
+    )
+    db.session.commit()
+
+def seats_remaining():
+    """Free seats right now (a primary-key read), or None when capacity is unlimited."""
+    if not seats_enabled():
+        return None
+    row = db.session.get(EventCapacity, EVENT_CAPACITY_ID, populate_existing=True)
+    return max(row.capacity - row.confirmed - row.held, 0)
+
+def hold_seats(seats, ttl=None):
+    """Atomically reserve `seats`. Returns the SeatHold, or None if there isn't room."""
+    taken = db.session.execute(
+        update(EventCapacity)
+        .where(EventCapacity.id == EVENT_CAPACITY_ID,
+               EventCapacity.confirmed + EventCapacity.held + seats <= EventCapacity.capacity)
+        .values(held=EventCapacity.held + seats)
+    ).rowcount
+    if taken != 1:
+        db.session.rollback()
+        return None
+    hold = SeatHold(seats=seats,
+                    expires_at=datetime.utcnow() + timedelta(seconds=ttl or app.config['SEAT_HOLD_TTL']))
+    db.session.add(hold)
+    db.session.commit()
+    return hold
+
+def _adjust_seats(held=0, confirmed=0):
+    db.session.execute(
+        update(EventCapacity)
+        .where(EventCapacity.id == EVENT_CAPACITY_ID)
+        .values(held=EventCapacity.held + held, confirmed=EventCapacity.confirmed + confirmed)
+    )
+
+def release_seat_hold(hold_id):
+    """Give a hold's seats back (e.g. Razorpay order creation failed)."""
+    seats = db.session.execute(
+        delete(SeatHold).where(SeatHold.id == hold_id).returning(SeatHold.seats)
+    ).scalar()
+    if seats:
+        _adjust_seats(held=-seats)
+    db.session.commit()
+
+def confirm_seat_hold(order_id, seats):
+    """
+    Turn an order's hold into confirmed seats. Does not commit: call it inside
+    the transaction that creates the Student so both succeed or fail together.
+    Returns False if the hold had expired and its seats are no longer free.
+    """
+    if not seats_enabled():
+        return True
+    held = db.session.execute(
+        delete(SeatHold).where(SeatHold.order_id == order_id).returning(SeatHold.seats)
+    ).scalar()
+    if held:
+        _adjust_seats(held=-held, confirmed=held)
+        return True
+    # Hold already expired: take the seats again if they're still free, with
+    # the same conditional UPDATE as hold_seats
+    return db.session.execute(
+        update(EventCapacity)
+        .where(EventCapacity.id == EVENT_CAPACITY_ID,
+               EventCapacity.confirmed + EventCapacity.held + seats <= EventCapacity.capacity)
+        .values(confirmed=EventCapacity.confirmed + seats)
+    ).rowcount == 1
+
+def release_confirmed_seats(seats):
+    """Return seats of a registration that was refunded or deleted. Does not commit."""
+    if seats_enabled():
+        _adjust_seats(confirmed=-seats)
+
+@background_task('seat-hold-sweeper', app.config['SEAT_HOLD_SWEEP_INTERVAL'])
+def expire_seat_holds(now=None):
+    """Release every hold past its expiry. Returns the number of seats freed."""
+    freed = sum(db.session.execute(
+        delete(SeatHold).where(SeatHold.expires_at < (now or datetime.utcnow())).returning(SeatHold.seats)
+    ).scalars())
+    if freed:
+        _adjust_seats(held=-freed)
+    db.session.commit()
+    if freed:
+        promote_waitlist.task.wake()
+    return freed
+
+# ---------------- Waitlist ----------------
+def find_waiting_entry(email=None, mobile_number=None):
+    """Return the waiting WaitlistEntry for this email or mobile (normalized), if any."""
+    conditions = []
+    if email:
+        conditions.append(WaitlistEntry.email_normalized == normalize_email(email))
+    if mobile_number:
+        conditions.append(WaitlistEntry.mobile_e164 == normalize_mobile(mobile_number))
+    if not conditions:
+        return None
+    return WaitlistEntry.query.filter(WaitlistEntry.status == 'waiting', or_(*conditions)).first()
+
+def join_waitlist(registration):
+    """Queue a registrant (once per email/mobile). Returns (entry, position)."""
+    entry = find_waiting_entry(registration['email'], registration['mobile_number'])
+    if entry is None:
+        entry = WaitlistEntry(
+            token=secrets.token_urlsafe(12),
+            name=registration['name'],
+            email=registration['email'],
+            semester=registration['semester'],
+            mobile_number=registration['mobile_number'],
+            family_members=registration['family_members'],
+            email_normalized=normalize_email(registration['email']) or None,
+            mobile_e164=normalize_mobile(registration['mobile_number']) or None,
+        )
+        db.session.add(entry)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # the same person queued from another tab meanwhile
+            db.session.rollback()
+            entry = find_waiting_entry(registration['email'], registration['mobile_number'])
+    position = WaitlistEntry.query.filter(WaitlistEntry.status == 'waiting', WaitlistEntry.id <= entry.id).count()
+    return entry, position
+
+@background_task('waitlist-promoter', app.config['WAITLIST_PROMOTE_INTERVAL'])
+def promote_waitlist(batch_size=None, now=None):
+    """
+    Offer free seats to the head of the queue, at most batch_size people per
+    run, so a mass refund turns into a steady trickle of offers. Strictly FIFO:
+    stops at the first entry whose party doesn't fit. Returns the number offered.
+    """
+    if not seats_enabled():
+        return 0
+    now = now or datetime.utcnow()
+    # Offers nobody claimed: their holds have expired, drop them from the queue
+    WaitlistEntry.query.filter(
+        WaitlistEntry.status == 'offered',
+        WaitlistEntry.offered_at < now - timedelta(seconds=app.config['WAITLIST_OFFER_TTL'])
+    ).update({WaitlistEntry.status: 'lapsed'}, synchronize_session=False)
+    db.session.commit()
+
+    offered = []
+    queue_head = db.session.scalars(
+        db.select(WaitlistEntry.id).where(WaitlistEntry.status == 'waiting')
+        .order_by(WaitlistEntry.id).limit(batch_size or app.config['WAITLIST_PROMOTION_BATCH'])
+    ).all()
+    for entry_id in queue_head:
+        # Claim first: with two promoters running (another worker, or a refund
+        # waking this task) only one UPDATE matches, so an entry is offered once
+        entry = db.session.execute(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.id == entry_id, WaitlistEntry.status == 'waiting')
+            .values(status='offered', offered_at=now)
+            .returning(WaitlistEntry)
+        ).scalar()
+        if entry is None:
+            continue
+        # same transaction as the claim: no room rolls the claim back too
+        hold = hold_seats(1 + entry.family_members, ttl=app.config['WAITLIST_OFFER_TTL'])
+        if hold is None:
+            break
+        entry.hold_id = hold.id
+        db.session.commit()
+        offered.append(entry)
+
+    for entry in offered:
+        send_whatsapp_waitlist_offer(entry)
+    return len(offered)
+
+# ---------------- Metrics ----------------
+class MetricsFile:
+    """
+    One worker's metric values, in an append-only mmap'd file. Only the owning
+    process writes it, so updates need a thread lock but no file lock; a scrape
+    in any worker reads every file. Layout: 8-byte used length, then entries of
+    [4-byte key length, key padded to 8 bytes, 8-byte double].
+    """
+    HEADER = struct.Struct('Q')
+    KEY_LEN = struct.Struct('I')
+    VALUE = struct.Struct('d')
+
+    def __init__(self, path, size=64 * 1024):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+        self._offsets = {key: offset for key, offset, _ in self.entries(self._map)}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def entries(cls, data):
+        """(key, value offset, value) for every entry in a file's bytes."""
+        used = cls.HEADER.unpack_from(data, 0)[0]
+        pos = cls.HEADER.size
+        while pos < used:
+            length = cls.KEY_LEN.unpack_from(data, pos)[0]
+            key = bytes(data[pos + cls.KEY_LEN.size:pos + cls.KEY_LEN.size + length]).decode()
+            offset = pos + cls._padded(cls.KEY_LEN.size + length)
+            yield key, offset, cls.VALUE.unpack_from(data, offset)[0]
+            pos = offset + cls.VALUE.size
+
+    @staticmethod
+    def _padded(n):
+        return (n + 7) & ~7
+
+    def _append(self, key):
+        encoded = key.encode()
+        pos = self.HEADER.unpack_from(self._map, 0)[0] or self.HEADER.size
+        offset = pos + self._padded(self.KEY_LEN.size + len(encoded))
+        end = offset + self.VALUE.size
+        if end > len(self._map):
+            self._map.close()
+            os.ftruncate(self._fd, max(2 * end, 2 * os.fstat(self._fd).st_size))
+            self._map = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+        self.KEY_LEN.pack_into(self._map, pos, len(encoded))
+        self._map[pos + self.KEY_LEN.size:pos + self.KEY_LEN.size + len(encoded)] = encoded
+        self.VALUE.pack_into(self._map, offset, 0.0)
+        # Publish the entry last so a concurrent reader never sees half of it
+        self.HEADER.pack_into(self._map, 0, end)
+        self._offsets[key] = offset
+        return offset
+
+    def add(self, key, amount):
+        with self._lock:
+            offset = self._offsets.get(key) or self._append(key)
+            self.VALUE.pack_into(self._map, offset, self.VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms in Prometheus text format, aggregated
+    across gunicorn workers: each process lazily opens worker_<pid>.db in the
+    metrics directory, and render() sums all of them. Counters and histograms
+    of exited workers are kept so totals never go backwards; their gauges are
+    dropped. As in Prometheus' multiprocess mode, a starting worker folds the
+    exited workers' files into merged.db and deletes them, so restarts don't
+    pile up files (or, with a reused pid, inherit a dead worker's gauges).
+    """
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    MERGED = 'merged.db'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.types = {}
+        self._file = None
+        self._pid = None
+
+    def declare(self, name, kind, help_text):
+        self.types[name] = (kind, help_text)
+
+    def _mine(self):
+        # Opened after fork so every worker gets its own file
+        if self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._merge_exited_workers()
+            self._file = MetricsFile(os.path.join(self.directory, f'worker_{os.getpid()}.db'))
+            self._pid = os.getpid()
+        return self._file
+
+    @contextmanager
+    def _locked(self, exclusive):
+        # Merging takes it exclusively, scrapes shared: a scrape never sees a
+        # dead worker's values both in its own file and in merged.db
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _gauges(self):
+        return {name for name, (kind, _) in self.types.items() if kind == 'gauge'}
+
+    def _worker_files(self):
+        """(pid, path) of every worker's file."""
+        for filename in os.listdir(self.directory):
+            if filename.startswith('worker_') and filename.endswith('.db'):
+                yield int(filename[len('worker_'):-len('.db')]), os.path.join(self.directory, filename)
+
+    def _merge_exited_workers(self):
+        """Fold exited workers' counters and histograms into merged.db and delete their files."""
+        gauges = self._gauges()
+        with self._locked(exclusive=True):
+            # a file under our own pid was left by an earlier process that had it
+            exited = [path for pid, path in self._worker_files() if pid == os.getpid() or not _pid_alive(pid)]
+            if not exited:
+                return
+            merged = MetricsFile(os.path.join(self.directory, self.MERGED))
+            try:
+                for path in exited:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    for key, _, value in MetricsFile.entries(data):
+                        if key.split('{', 1)[0] not in gauges:
+                            merged.add(key, value)
+                    os.remove(path)
+            finally:
+                merged.close()
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _key(name, labels):
+        if not labels:
+            return name
+        escape = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        return name + '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+    def inc(self, name, labels=(), amount=1):
+        self._mine().add(self._key(name, labels), amount)
+
+    def observe(self, name, labels, value):
+        i = bisect_left(self.LATENCY_BUCKETS, value)
+        le = repr(float(self.LATENCY_BUCKETS[i])) if i < len(self.LATENCY_BUCKETS) else '+Inf'
+        metrics_file = self._mine()
+        metrics_file.add(self._key(name + '_bucket', labels + (('le', le),)), 1)
+        metrics_file.add(self._key(name + '_sum', labels), value)
+        metrics_file.add(self._key(name + '_count', labels), 1)
+
+    def collect(self):
+        """{key: value} summed over every worker's file."""
+        totals = {}
+        if not os.path.isdir(self.directory):
+            return totals
+        gauges = self._gauges()
+        with self._locked(exclusive=False):
+            files = [(_pid_alive(pid), path) for pid, path in self._worker_files()]
+            files.append((False, os.path.join(self.directory, self.MERGED)))
+            for alive, path in files:
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    continue
+                for key, _, value in MetricsFile.entries(data):
+                    if alive or key.split('{', 1)[0] not in gauges:
+                        totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        lines = []
+        for name, (kind, help_text) in sorted(self.types.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind != 'histogram':
+                lines += [f"{key} {value:g}" for key, value in sorted(totals.items())
+                          if key.split('{', 1)[0] == name]
+                continue
+            # Buckets are stored per bucket; the exposition format wants them cumulative
+            buckets = {}
+            for key, value in totals.items():
+                if key.startswith(name + '_bucket{'):
+                    series, le = key[:-2].rsplit('le="', 1)
+                    buckets.setdefault(series, []).append((float(le), le, value))
+            for series, points in sorted(buckets.items()):
+                labels = series[len(name + '_bucket{'):].rstrip(',')
+                running = 0
+                seen = {le for _, le, _ in points}
+                points += [(b, repr(float(b)), 0) for b in self.LATENCY_BUCKETS if repr(float(b)) not in seen]
+                if '+Inf' not in seen:
+                    points.append((math.inf, '+Inf', 0))
+                for _, le, value in sorted(points):
+                    running += value
+                    lines.append(f'{series}le="{le}"}} {running:g}')
+                suffix = '{' + labels + '}' if labels else ''
+                lines.append(f"{name}_sum{suffix} {totals.get(name + '_sum' + suffix, 0):g}")
+                lines.append(f"{name}_count{suffix} {totals.get(name + '_count' + suffix, 0):g}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(app.config['METRICS_DIR'])
+metrics.declare('campusconnect_http_requests_total', 'counter', 'Requests by endpoint, method and status.')
+metrics.declare('campusconnect_http_request_duration_seconds', 'histogram', 'Time to return a response, by endpoint.')
+metrics.declare('campusconnect_http_requests_in_flight', 'gauge', 'Requests currently being handled.')
+metrics.declare('campusconnect_db_queries_total', 'counter', 'SQL statements executed, by endpoint.')
+metrics.declare('campusconnect_db_query_seconds_total', 'counter', 'Time spent in SQL statements, by endpoint.')
+metrics.declare('campusconnect_external_call_duration_seconds', 'histogram',
+                'Razorpay / Twilio API call latency, by service, operation and outcome.')
+
+@contextmanager
+def external_call(service, operation):
+    """Time a Razorpay / Twilio API call into the external call histogram."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        metrics.observe('campusconnect_external_call_duration_seconds',
+                        (('service', service), ('operation', operation), ('outcome', outcome)),
+                        time.perf_counter() - start)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, not the connection: a failed
+    # statement never reaches after_cursor_execute, and its start goes with it
+    context.query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_started
+    in_request = has_request_context() and 'db_queries' in g
+    if in_request:
+        g.db_queries += 1
+        g.db_time += elapsed
+        if g.query_statements is not None:
+            g.query_statements[statement] += 1
+            g.slowest_query = max(g.slowest_query, elapsed)
+    if elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        log.warning('db.slow_query', extra={
+            'duration_ms': round(elapsed * 1000, 1), 'path': request.path if in_request else None,
+            'statement': ' '.join(statement.split()),
+            # only how many: the values are students' emails, mobiles and UPI ids
+            'param_count': len((parameters[0] if executemany else parameters) or ())})
+
+REQUEST_ID = re.compile(r'^[\w.-]{1,64}$')
+
+@app.before_request
+def _start_request_metrics():
+    g.request_started = time.perf_counter()
+    # Keep the proxy's id (Render / nginx X-Request-ID) so lines can be joined up
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if REQUEST_ID.match(incoming) else uuid.uuid4().hex[:16]
+    g.db_queries, g.db_time = 0, 0.0
+    g.query_statements = Counter() if app.config['QUERY_DEBUG'] else None
+    g.slowest_query = 0.0
+    metrics.inc('campusconnect_http_requests_in_flight')
+
+@app.after_request
+def _record_response_status(response):
+    g.response_status = response.status_code
+    response.headers['X-Request-ID'] = g.request_id
+    if g.get('query_statements') is not None:
+        if response.is_streamed:
+            # A streamed page (stream_page) runs most of its queries after the
+            # headers are sent: summarized in the log once it has finished
+            g.summarize_at_teardown = True
+        else:
+            response.headers['X-Query-Summary'] = _query_summary(g)
+    return response
+
+def _query_summary(state):
+    """Log statements repeated N+1-style and return the X-Query-Summary value."""
+    repeated = {sql: n for sql, n in state.query_statements.items() if n >= app.config['NPLUSONE_THRESHOLD']}
+    for sql, n in repeated.items():
+        log.warning('db.repeated_statement', extra={
+            'path': request.path, 'count': n, 'statement': ' '.join(sql.split())})
+    return (f"count={state.db_queries}; time_ms={state.db_time * 1000:.2f}; "
+            f"slowest_ms={state.slowest_query * 1000:.2f}; repeated={len(repeated)}")
+
+@app.teardown_request
+def _finish_request_metrics(exc):
+    state = g._get_current_object()
+    if 'request_started' not in state or state.pop('stream_pending', False):
+        return
+    elapsed = time.perf_counter() - state.request_started
+    endpoint = (('endpoint', request.endpoint or 'none'),)
+    status = 500 if exc is not None else state.get('response_status', 500)
+    metrics.inc('campusconnect_http_requests_in_flight', amount=-1)
+    metrics.inc('campusconnect_http_requests_total', endpoint + (('method', request.method), ('status', status)))
+    metrics.observe('campusconnect_http_request_duration_seconds', endpoint, elapsed)
+    if state.db_queries:
+        metrics.inc('campusconnect_db_queries_total', endpoint, state.db_queries)
+        metrics.inc('campusconnect_db_query_seconds_total', endpoint, state.db_time)
+    log.info('request', extra={'method': request.method, 'path': request.path, 'status': status,
+                               'latency_ms': round(elapsed * 1000, 2), 'db_queries': state.db_queries})
+    if state.get('summarize_at_teardown'):
+        log.info('db.query_summary', extra={'path': request.path, 'summary': _query_summary(state)})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ---------------- On-demand profiling ----------------
+class StackSampler:
+    """
+    Samples one thread's Python stack from a helper thread and counts each
+    distinct stack, root first, in the collapsed format flamegraph.pl and
+    speedscope read ("frame;frame;frame count").
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileArm:
+    """
+    Which endpoint to profile and for how many more requests, in a JSON file
+    so an admin arming it on one gunicorn worker arms them all. While nothing
+    is armed, claim() is a clock comparison plus a stat() once a second.
+    """
+    RECHECK = 1.0
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'armed.json')
+        self._lock = threading.Lock()
+        self._armed = False
+        self._checked = 0.0
+
+    def _locked(self, fn):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(self.path + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                return fn()
+            finally:
+                if fcntl:
+                    fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def state(self):
+        """{'endpoint', 'remaining'} or None."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, state):
+        if state and state['remaining'] > 0:
+            tmp = f"{self.path}.{os.getpid()}"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def arm(self, endpoint, count):
+        self._locked(lambda: self._write({'endpoint': endpoint, 'remaining': count}))
+        self._armed, self._checked = True, time.monotonic()
+
+    def disarm(self):
+        self._locked(lambda: self._write(None))
+
+    def claim(self, endpoint):
+        """True if this request should be profiled (and counts it against the budget)."""
+        now = time.monotonic()
+        if now - self._checked >= self.RECHECK:
+            self._armed, self._checked = os.path.exists(self.path), now
+        if not self._armed:
+            return False
+
+        def take():
+            state = self.state()
+            if not state or state['endpoint'] != endpoint:
+                self._armed = state is not None
+                return False
+            state['remaining'] -= 1
+            self._write(state)
+            return True
+        return self._locked(take)
+
+
+PROFILE_NAME = re.compile(r'^(\d{8}T\d{6}\.\d{6})-([\w.]+)-(\d+)-(\d+)ms\.collapsed$')
+profile_arm = ProfileArm(app.config['PROFILE_DIR'])
+
+def save_profile(endpoint, sampler):
+    """Write a finished sample as <utc time>-<endpoint>-<pid>-<ms>ms.collapsed and prune old ones."""
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    name = f"{datetime.utcnow():%Y%m%dT%H%M%S.%f}-{endpoint}-{os.getpid()}-{sampler.elapsed * 1000:.0f}ms.collapsed"
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        f.write(sampler.collapsed())
+    for old in list_profiles()[app.config['PROFILE_KEEP']:]:
+        try:
+            os.remove(os.path.join(directory, old['name']))
+        except FileNotFoundError:
+            pass
+    return name
+
+def list_profiles():
+    """Saved profiles, newest first."""
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        match = PROFILE_NAME.match(name)
+        if match:
+            stamp, endpoint, pid, ms = match.groups()
+            profiles.append({'name': name, 'endpoint': endpoint, 'pid': int(pid), 'duration_ms': int(ms),
+                             'created': datetime.strptime(stamp, '%Y%m%dT%H%M%S.%f')})
+    return sorted(profiles, key=lambda p: p['created'], reverse=True)
+
+@app.before_request
+def _start_profiler():
+    if profile_arm.claim(request.endpoint):
+        g.profiler = StackSampler(threading.get_ident(), app.config['PROFILE_INTERVAL_MS'] / 1000).start()
+
+@app.teardown_request
+def _finish_profiler(exc):
+    # Runs after a streamed body is fully sent, so streaming pages are covered
+    sampler = g.pop('profiler', None)
+    if sampler is not None:
+        sampler.stop()
+        save_profile(request.endpoint, sampler)
+
+# ---------------- Rate limiting & load shedding ----------------
+class SharedTokenBuckets:
+    """
+    Token buckets stored in a small mmap'd file so every gunicorn worker on the
+    host draws from the same budget. Slot 0 is the global bucket; per-IP buckets
+    are hashed into the remaining slots (IPs that collide share a bucket).
+    Each take() is an fcntl byte-range lock plus a 16-byte read/write.
+    """
+    SLOT = struct.Struct('dd')  # tokens, last refill (epoch seconds)
+
+    def __init__(self, path, slots=4096):
+        self.slots = slots
+        size = self.SLOT.size * (slots + 1)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # fcntl locks are per-process, so threads inside a worker need their own lock
+        self._lock = threading.Lock()
+
+    def slot_for(self, key):
+        return 1 + zlib.crc32(key.encode()) % self.slots
+
+    def take(self, slot, rate, burst, now=None):
+        """Take one token. Returns 0 on success, else seconds until one is available."""
+        if rate <= 0:
+            return 0
+        now = now or time.time()
+        size = self.SLOT.size
+        offset = slot * size
+        with self._lock:
+            if fcntl:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, size, offset)
+            try:
+                tokens, last = self.SLOT.unpack_from(self._map, offset)
+                tokens = burst if last == 0 else min(burst, tokens + (now - last) * rate)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / rate
+                self.SLOT.pack_into(self._map, offset, tokens, now)
+            finally:
+                if fcntl:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, size, offset)
+        return wait
+
+
+class InFlightLimiter:
+    """Counts requests currently inside a view, per worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def try_enter(self, limit):
+        with self._lock:
+            if limit and self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.count -= 1
+
+
+_pay_buckets = None
+pay_in_flight = InFlightLimiter()
+
+def pay_buckets():
+    # Opened lazily so a forked worker maps the file itself
+    global _pay_buckets
+    if _pay_buckets is None:
+        _pay_buckets = SharedTokenBuckets(app.config['RATE_LIMIT_FILE'])
+    return _pay_buckets
+
+def client_ip():
+    # ProxyFix has already swapped in the forwarded address when behind trusted proxies
+    return request.remote_addr or ''
+
+def _shed(status, retry_after, message):
+    # Plain-text response: no template, no session write, no DB
+    return Response(message, status=status, mimetype='text/plain',
+                    headers={'Retry-After': str(max(int(math.ceil(retry_after)), 1))})
+
+def pay_rate_limited(view):
+    """
+    Reject /pay before it does any work: 503 when this worker already has
+    PAY_MAX_IN_FLIGHT requests in progress, 429 when the caller's IP or the
+    whole site is over its token budget.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cfg = app.config
+        if not pay_in_flight.try_enter(cfg['PAY_MAX_IN_FLIGHT']):
+            return _shed(503, cfg['PAY_SHED_RETRY_AFTER'], "Registration is busy, please retry shortly.")
+        try:
+            buckets = pay_buckets()
+            now = time.time()
+            wait = buckets.take(buckets.slot_for(client_ip()), cfg['PAY_IP_RATE'], cfg['PAY_IP_BURST'], now)
+            if not wait:
+                wait = buckets.take(0, cfg['PAY_GLOBAL_RATE'], cfg['PAY_GLOBAL_BURST'], now)
+            if wait:
+                return _shed(429, wait, "Too many registration attempts, please retry shortly.")
+            return view(*args, **kwargs)
+        finally:
+            pay_in_flight.leave()
+    return wrapper
+
+# ---------------- Contact availability ----------------
+class AvailabilityCache:
+    """
+    Per-process TTL cache of "is this email / mobile registered?" answers, so a
+    form being typed into doesn't re-query for every debounced keystroke.
+    Mostly holds negative ("not registered") results; new registrations in this
+    worker overwrite their entries straight away.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key, now=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < (now or time.monotonic()):
+            return None
+        return entry[0]
+
+    def put(self, key, taken, now=None):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (taken, (now or time.monotonic()) + self.ttl)
+
+
+availability_cache = AvailabilityCache(app.config['AVAILABILITY_CACHE_TTL'])
+
+def find_registered_contact(email=None, mobile_number=None):
+    """Return a Student registered with this email or mobile (normalized), if any."""
+    conditions = []
+    if email:
+        conditions.append(Student.email_normalized == normalize_email(email))
+    if mobile_number:
+        conditions.append(Student.mobile_e164 == normalize_mobile(mobile_number))
+    if not conditions:
+        return None
+    return Student.query.filter(or_(*conditions)).first()
+
+def lookup_students(term):
+    """Exact admin lookup by email, mobile or unique ID, each an indexed point lookup."""
+    term = (term or '').strip()
+    if not term:
+        return []
+    if '@' in term:
+        condition = Student.email_normalized == normalize_email(term)
+    elif term.lstrip('+').replace(' ', '').replace('-', '').isdigit():
+        condition = Student.mobile_e164 == normalize_mobile(term)
+    else:
+        condition = Student.unique_id == term
+    return Student.query.filter(condition).all()
+
+def is_contact_taken(kind, value):
+    key = (kind, normalize_email(value) if kind == 'email' else normalize_mobile(value))
+    taken = availability_cache.get(key)
+    if taken is None:
+        lookup = {'email': value} if kind == 'email' else {'mobile_number': value}
+        taken = find_registered_contact(**lookup) is not None
+        availability_cache.put(key, taken)
+    return taken
+
+def remember_registered_contact(student):
+    availability_cache.put(('email', normalize_email(student.email)), True)
+    availability_cache.put(('mobile', normalize_mobile(student.mobile_number)), True)
+
+# ---------------- Admin search ----------------
+# Contentless FTS5 index over the fields an admin types: unique ID, name,
+# normalized email and mobile (full E.164 digits plus the 10-digit national
+# number, so both "9198.." and "98765.." prefix-match). Triggers keep it in
+# step with the student table; rows are joined back by rowid = student.id.
+STUDENT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS student_fts USING fts5(
+        unique_id, name, email, mobile, content='', prefix='2 3 4')""",
+    """CREATE TRIGGER IF NOT EXISTS student_fts_ai AFTER INSERT ON student BEGIN
+        INSERT INTO student_fts(rowid, unique_id, name, email, mobile)
+        VALUES (new.id, new.unique_id, new.name, new.email_normalized,
+                ltrim(new.mobile_e164, '+') || ' ' || substr(new.mobile_e164, -10));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS student_fts_ad AFTER DELETE ON student BEGIN
+        INSERT INTO student_fts(student_fts, rowid, unique_id, name, email, mobile)
+        VALUES ('delete', old.id, old.unique_id, old.name, old.email_normalized,
+                ltrim(old.mobile_e164, '+') || ' ' || substr(old.mobile_e164, -10));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS student_fts_au
+    AFTER UPDATE OF unique_id, name, email_normalized, mobile_e164 ON student BEGIN
+        INSERT INTO student_fts(student_fts, rowid, unique_id, name, email, mobile)
+        VALUES ('delete', old.id, old.unique_id, old.name, old.email_normalized,
+                ltrim(old.mobile_e164, '+') || ' ' || substr(old.mobile_e164, -10));
+        INSERT INTO student_fts(rowid, unique_id, name, email, mobile)
+        VALUES (new.id, new.unique_id, new.name, new.email_normalized,
+                ltrim(new.mobile_e164, '+') || ' ' || substr(new.mobile_e164, -10));
+    END""",
+]
+STUDENT_FTS_TRIGGERS = ('student_fts_ai', 'student_fts_ad', 'student_fts_au')
+
+def student_fts_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+def sync_student_fts():
+    """
+    Create the FTS table and triggers if missing. When any of them had to be
+    (re)created, e.g. first run or the student table was rebuilt, repopulate
+    the index from scratch so it can't hold rows for ids that no longer exist.
+    """
+    if not student_fts_enabled():
+        return
+    existing = set(db.session.scalars(db.text(
+        "SELECT name FROM sqlite_master WHERE name = 'student_fts' OR type = 'trigger'")))
+    with db.engine.begin() as conn:
+        for ddl in STUDENT_FTS_DDL:
+            conn.execute(db.text(ddl))
+        if not {'student_fts', *STUDENT_FTS_TRIGGERS} <= existing:
+            conn.execute(db.text("INSERT INTO student_fts(student_fts) VALUES ('delete-all')"))
+            conn.execute(db.text(
+                """INSERT INTO student_fts(rowid, unique_id, name, email, mobile)
+                   SELECT id, unique_id, name, email_normalized,
+                          ltrim(mobile_e164, '+') || ' ' || substr(mobile_e164, -10)
+                   FROM student"""))
+
+def fts_prefix_query(term):
+    """
+    Turn what an admin typed into an FTS5 query: every word must match as a
+    prefix. Phone-looking input is collapsed to one digit run first, so
+    "98765 43210" matches the stored number rather than two separate words.
+    """
+    term = (term or '').strip().lower()
+    if term.lstrip('+').replace(' ', '').replace('-', '').isdigit():
+        term = ''.join(ch for ch in term if ch.isdigit())
+    words = [w for w in ''.join(ch if ch.isalnum() else ' ' for ch in term).split() if w]
+    return ' '.join(f'"{w}"*' for w in words)
+
+def search_students(term, limit=None, semester=None):
+    """
+    Admin search, best hit first. An exact email / mobile / unique ID is a
+    point lookup on its unique index; anything else is an FTS5 prefix match
+    ranked by bm25, with name and unique ID weighted above contact fields.
+    """
+    limit = limit or app.config['ADMIN_SEARCH_LIMIT']
+    exact = [s for s in lookup_students(term) if semester is None or s.semester == semester]
+    if exact:
+        return exact[:limit]
+
+    match = fts_prefix_query(term)
+    if not match:
+        return []
+    query = Student.query
+    if semester is not None:
+        query = query.filter(Student.semester == semester)
+    if not student_fts_enabled():
+        like = f"%{term.strip()}%"
+        return query.filter(or_(Student.name.ilike(like), Student.email.ilike(like),
+                                Student.mobile_number.like(like), Student.unique_id.ilike(like))) \
+            .order_by(Student.id.desc()).limit(limit).all()
+
+    hits = db.text("""SELECT rowid AS id, bm25(student_fts, 4.0, 4.0, 2.0, 1.0) AS rank
+                      FROM student_fts WHERE student_fts MATCH :match""") \
+        .columns(id=db.Integer, rank=db.Float).subquery()
+    return query.join(hits, hits.c.id == Student.id).params(match=match) \
+        .order_by(hits.c.rank, Student.id.desc()).limit(limit).all()
+
+def search_result(student):
+    return {
+        'id': student.id,
+        'unique_id': student.unique_id,
+        'name': student.name,
+        'email': student.email,
+        'mobile_number': student.mobile_number,
+        'semester': student.semester,
+        'payment_status': student.payment_status,
+        'attended': bool(student.attended),
+        'refunded': bool(student.refunded),
+    }
+
+# ---------------- Analytics snapshot ----------------
+# Exports and dashboard queries would otherwise hold read transactions on the
+# file the gates are committing to. Instead a background task copies it with
+# SQLite's backup API and reads_snapshot views run their SELECTs on the copy.
+def analytics_snapshot_path():
+    """The snapshot file, or None when snapshots are off or the primary isn't a SQLite file."""
+    url = db.engine.url
+    if (not app.config['ANALYTICS_SNAPSHOT'] or url.get_backend_name() != 'sqlite'
+            or url.database in (None, '', ':memory:')):
+        return None
+    return app.config['ANALYTICS_SNAPSHOT_PATH'] or url.database + '-analytics'
+
+def snapshot_age(path):
+    """Seconds since the data in the snapshot was current, or None if there is none."""
+    try:
+        return time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+@lru_cache(maxsize=None)
+def snapshot_engine(path):
+    # immutable: no locking or journal checks, nothing writes the file in place.
+    # NullPool: every checkout opens the path again, so it sees the latest copy.
+    return create_engine(f"sqlite:///file:{path}?mode=ro&immutable=1&uri=true", poolclass=NullPool)
+
+@background_task('analytics-snapshot', app.config['ANALYTICS_SNAPSHOT_INTERVAL'])
+def refresh_analytics_snapshot(force=False):
+    """
+    Copy the primary into a temporary file and rename it over the snapshot,
+    stamped with the time the copy started. Workers take turns through a lock
+    file and skip a snapshot less than half an interval old unless forced.
+    Returns True if a new snapshot was written.
+    """
+    path = analytics_snapshot_path()
+    if not path:
+        return False
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        if fcntl:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False  # another worker is copying
+        age = snapshot_age(path)
+        if not force and age is not None and age < app.config['ANALYTICS_SNAPSHOT_INTERVAL'] / 2:
+            return False
+        started = time.time()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        source = db.engine.raw_connection()
+        try:
+            target = sqlite3.connect(tmp)
+            try:
+                # All pages in one step, one read transaction: a stepped copy starts
+                # over whenever a gate commits in between, which at peak is always.
+                # With the primary in WAL mode that read doesn't hold up the commits.
+                source.driver_connection.backup(target)
+                # the copy is opened immutable, which wants a self-contained file
+                target.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                target.close()
+            os.utime(tmp, (started, started))
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            source.close()
+    log.info('analytics.snapshot', extra={
+        'duration_ms': round((time.time() - started) * 1000, 1), 'bytes': os.path.getsize(path)})
+    return True
+
+def reads_snapshot(view):
+    """
+    Run the view's SELECTs against the analytics snapshot when it is at most
+    ANALYTICS_MAX_STALENESS seconds old (its age goes out as X-Snapshot-Age).
+    A missing or stale snapshot means the primary, plus a refresh request.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        path = analytics_snapshot_path()
+        if not path:
+            return view(*args, **kwargs)
+        age = snapshot_age(path)
+        if age is None or age > app.config['ANALYTICS_MAX_STALENESS']:
+            refresh_analytics_snapshot.task.wake()
+            return view(*args, **kwargs)
+        g.analytics_engine = snapshot_engine(path)
+        g.snapshot_taken_at = datetime.utcnow() - timedelta(seconds=age)
+        try:
+            resp = app.make_response(view(*args, **kwargs))
+        finally:
+            # let go of the (possibly replaced) snapshot file now, not at teardown
+            db.session.close()
+            g.pop('analytics_engine')
+            g.pop('snapshot_taken_at')
+        resp.headers['X-Snapshot-Age'] = str(int(age))
+        return resp
+    return wrapper
+
+def data_as_of():
+    """When the rows this request reads were current: the snapshot's time, else now."""
+    taken_at = g.get('snapshot_taken_at') if has_request_context() else None
+    return taken_at or datetime.utcnow()
+
+# ---------------- Read models ----------------
+# List pages and exports only read a handful of columns. Selecting just those
+# into plain named tuples skips ORM hydration and identity-map tracking, and
+# yield_per streams them from the cursor instead of materializing the table.
+StudentListRow = namedtuple('StudentListRow', [
+    'id', 'unique_id', 'name', 'email', 'mobile_number', 'semester', 'attended',
+    'upi_id', 'transaction_id', 'payment_status', 'refunded'])
+StudentExportRow = namedtuple('StudentExportRow', [
+    'id', 'name', 'semester', 'family_members', 'payment_status', 'amount_paise'])
+
+def iter_read_rows(row_type, *criteria, order_by=None, chunk_size=None):
+    """Yield row_type tuples for the matching students, chunk_size rows per fetch."""
+    stmt = db.select(*(getattr(Student, name) for name in row_type._fields)).where(*criteria)
+    if order_by is not None:
+        stmt = stmt.order_by(order_by)
+    return stream_rows(row_type, stmt, chunk_size)
+
+def iter_export_rows(chunk_size=None):
+    """Export rows; amount_paise is what the student net paid, from the ledger."""
+    net = student_ledger_net()
+    stmt = db.select(Student.id, Student.name, Student.semester, Student.family_members,
+                     Student.payment_status, func.coalesce(net.c.net, 0)) \
+        .outerjoin(net, net.c.student_id == Student.id).order_by(Student.id)
+    return stream_rows(StudentExportRow, stmt, chunk_size)
+
+def stream_rows(row_type, stmt, chunk_size=None):
+    chunk_size = chunk_size or app.config['READ_MODEL_CHUNK']
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    try:
+        for row in result:
+            yield row_type._make(row)
+    finally:
+        result.close()
+
+def _buffered(parts, size):
+    buf, length = [], 0
+    for part in parts:
+        buf.append(part)
+        length += len(part)
+        if length >= size:
+            yield ''.join(buf)
+            buf, length = [], 0
+    if buf:
+        yield ''.join(buf)
+
+def stream_page(template_name, **context):
+    """
+    Render a template as a streamed response. Jinja's tiny fragments are joined
+    into TEMPLATE_STREAM_BUFFER-sized writes, so the header goes out as soon as
+    the first buffer fills and memory stays bounded by the buffer plus one
+    read-model chunk, whatever the table size. stream_template keeps the
+    request context (and the DB cursor behind a row generator) open until the
+    last chunk is sent.
+    """
+    body = _buffered(stream_template(template_name, **context), app.config['TEMPLATE_STREAM_BUFFER'])
+    # Flask tears the request down twice for a stream_with_context body: when
+    # the view returns and again after the last chunk. Request metrics wait
+    # for the second, so they include the queries the body runs.
+    g.stream_pending = True
+    # ask proxies (nginx, Render) not to buffer the whole response
+    return Response(body, mimetype='text/html', headers={'X-Accel-Buffering': 'no'})
+
+# ---------------- Time series ----------------
+# bucket name -> (pandas resample rule, bucket width, default window in buckets)
+TIMESERIES_BUCKETS = {
+    'hour': ('h', timedelta(hours=1), 48),
+    'day': ('D', timedelta(days=1), 30),
+}
+TIMESERIES_METRICS = ('registrations', 'revenue', 'refunds', 'refunded_amount', 'checkins')
+
+
+class BucketCache:
+    """
+    Per-process cache of finished time-series buckets. A bucket whose end is
+    in the past only ever gets new events stamped "now", so once closed its
+    numbers are final and never recomputed.
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, values):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = values
+
+
+timeseries_cache = BucketCache()
+
+def parse_utc(value):
+    """ISO 8601 timestamp -> naive UTC datetime, the form the columns store."""
+    ts = datetime.fromisoformat(value)
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+def bucket_floor(ts, bucket):
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if bucket == 'day' else ts
+
+def _timeseries_events(start, end):
+    """
+    One statement over the timestamp columns (each branch a range scan on its
+    own index): (ts, kind, amount) for every registration, charge, refund and
+    check-in in [start, end). Amounts are rupees as posted to the ledger.
+    """
+    gateway = LedgerEntry.account == 'razorpay'
+    events = union_all(
+        db.select(Student.created_at.label('ts'), literal('registration').label('kind'),
+                  literal(0).label('amount'))
+        .where(Student.created_at >= start, Student.created_at < end),
+        db.select(LedgerEntry.created_at, LedgerEntry.kind, func.abs(LedgerEntry.amount) // 100)
+        .where(LedgerEntry.created_at >= start, LedgerEntry.created_at < end, gateway),
+        db.select(Student.attended_at, literal('checkin'), literal(0))
+        .where(Student.attended_at >= start, Student.attended_at < end),
+    )
+    return db.session.execute(events).all()
+
+def _resample_events(rows, rule):
+    """Column-wise resample of (ts, kind, amount) rows into per-bucket metric sums."""
+    df = pd.DataFrame.from_records(rows, columns=['ts', 'kind', 'amount'])
+    kind, amount = df['kind'], df['amount'].astype('int64')
+    frame = pd.DataFrame({
+        'registrations': (kind == 'registration').astype('int64'),
+        'revenue': amount.where(kind == 'charge', 0),
+        'refunds': (kind == 'refund').astype('int64'),
+        'refunded_amount': amount.where(kind == 'refund', 0),
+        'checkins': (kind == 'checkin').astype('int64'),
+    })
+    frame.index = pd.DatetimeIndex(pd.to_datetime(df['ts']))
+    return frame.resample(rule).sum()
+
+def timeseries(bucket, start, end, now=None):
+    """
+    Per-bucket registrations, revenue, refunds, refunded amount and check-ins
+    for buckets starting in [start, end), oldest first. Closed buckets come
+    from timeseries_cache; the rest are computed in one query from the oldest
+    uncached bucket onwards.
+    """
+    rule, width, _ = TIMESERIES_BUCKETS[bucket]
+    # a bucket that closed after the snapshot was taken isn't final in it yet
+    now = now or data_as_of()
+    starts = []
+    current = bucket_floor(start, bucket)
+    while current < end and len(starts) < app.config['TIMESERIES_MAX_BUCKETS']:
+        starts.append(current)
+        current += width
+
+    values = {b: timeseries_cache.get((bucket, b)) for b in starts}
+    missing = [b for b, v in values.items() if v is None]
+    if missing:
+        rows = _timeseries_events(missing[0], starts[-1] + width)
+        sums = _resample_events(rows, rule) if rows else None
+        for b in missing:
+            stamp = pd.Timestamp(b)
+            if sums is not None and stamp in sums.index:
+                values[b] = {m: int(sums.at[stamp, m]) for m in TIMESERIES_METRICS}
+            else:
+                values[b] = dict.fromkeys(TIMESERIES_METRICS, 0)
+            if b + width <= now:
+                timeseries_cache.put((bucket, b), values[b])
+
+    series = {'labels': [b.isoformat() for b in starts]}
+    for metric in TIMESERIES_METRICS:
+        series[metric] = [values[b][metric] for b in starts]
+    return series
+
+# ---------------- Gate throughput ----------------
+class GateStats:
+    """
+    Per-process per-minute, per-gate check-in counts, folded in incrementally
+    from attendance_log: each refresh only reads log rows with an id above the
+    last one seen, so polling the dashboard every few seconds stays cheap.
+    Minutes older than the window are dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.last_id = 0
+        self.counts = {}  # (minute, gate) -> check-ins
+
+    def refresh(self, window_start):
+        with self._lock:
+            rows = db.session.execute(
+                db.select(AttendanceLog.id, AttendanceLog.gate, AttendanceLog.marked_at)
+                .where(AttendanceLog.id > self.last_id,
+                       AttendanceLog.marked_at >= window_start)
+                .order_by(AttendanceLog.id)
+            ).all()
+            if rows:
+                self.last_id = rows[-1].id
+            for row in rows:
+                key = (row.marked_at.replace(second=0, microsecond=0), row.gate)
+                self.counts[key] = self.counts.get(key, 0) + 1
+            for key in [k for k in self.counts if k[0] < window_start]:
+                del self.counts[key]
+            return dict(self.counts)
+
+
+gate_stats = GateStats()
+
+def gate_throughput(now=None, window_minutes=None, rolling_minutes=None):
+    """
+    Check-ins per minute per gate over the last window_minutes, each gate's
+    rolling rate over the last rolling_minutes, and how long the registrants
+    not yet checked in would take at the combined rolling rate.
+    """
+    now = now or datetime.utcnow()
+    window_minutes = window_minutes or app.config['GATE_WINDOW_MINUTES']
+    rolling_minutes = rolling_minutes or app.config['GATE_ROLLING_MINUTES']
+    current = now.replace(second=0, microsecond=0)
+    minutes = [current - timedelta(minutes=i) for i in range(window_minutes - 1, -1, -1)]
+    # the shared cache always covers the full configured window
+    counts = gate_stats.refresh(current - timedelta(minutes=app.config['GATE_WINDOW_MINUTES'] - 1))
+    counts = {k: c for k, c in counts.items() if k[0] >= minutes[0]}
+
+    gates = sorted({gate for _, gate in counts})
+    rolling_from = current - timedelta(minutes=rolling_minutes - 1)
+    per_minute = {gate: [counts.get((m, gate), 0) for m in minutes] for gate in gates}
+    rate = {
+        gate: round(sum(c for (m, g), c in counts.items() if g == gate and m >= rolling_from) / rolling_minutes, 2)
+        for gate in gates
+    }
+    total_rate = round(sum(rate.values()), 2)
+    remaining = db.session.query(func.count(Student.id)) \
+        .filter(Student.attended == False, Student.payment_status == 'Paid').scalar() or 0
+    return {
+        'minutes': [m.isoformat() for m in minutes],
+        'per_minute': per_minute,
+        'rate_per_minute': rate,
+        'total_rate_per_minute': total_rate,
+        'remaining': remaining,
+        'minutes_to_clear': round(remaining / total_rate, 1) if total_rate else None,
+    }
+
+# ---------------- Payment ledger ----------------
+# Accounts (paise, debit positive):
+#   razorpay        money held at the gateway: + charges, - refunds
+#   ticket_revenue  gross ticket sales (credit, so negative)
+#   refunds         money given back (contra-revenue, debit)
+# Every posting keeps sum(balances) == 0, and each account's running balance
+# is a single-row read, so reports never re-derive totals from Student rows.
+LEDGER_ACCOUNTS = ('razorpay', 'ticket_revenue', 'refunds')
+TICKET_PRICE_PAISE = 100 * 100
+
+def sync_ledger_accounts():
+    """Create missing account rows. Returns True on the first run (no accounts yet)."""
+    existing = set(db.session.scalars(db.select(LedgerAccount.name)))
+    created = 0
+    for name in LEDGER_ACCOUNTS:
+        if name not in existing:
+            # OR IGNORE: a worker that lost the race to create the row leaves it be
+            created += db.session.execute(db.insert(LedgerAccount).prefix_with('OR IGNORE')
+                                          .values(name=name, balance=0, entry_count=0)).rowcount
+    db.session.commit()
+    # only the run that actually created every account backfills
+    return not existing and created == len(LEDGER_ACCOUNTS)
+
+def _post_ledger(reference, kind, student_id, legs, created_at=None):
+    """
+    Add one balanced transaction to the session (the caller commits, so it
+    lands atomically with whatever it pays for). legs: [(account, amount)].
+    A reference already posted raises IntegrityError on flush.
+    """
+    if sum(amount for _, amount in legs) != 0:
+        raise ValueError(f"unbalanced ledger posting {reference}: {legs}")
+    for account, amount in legs:
+        balance = db.session.execute(
+            update(LedgerAccount).where(LedgerAccount.name == account)
+            .values(balance=LedgerAccount.balance + amount, entry_count=LedgerAccount.entry_count + 1)
+            .returning(LedgerAccount.balance)
+        ).scalar_one()
+        db.session.add(LedgerEntry(reference=reference, kind=kind, account=account, amount=amount,
+                                   balance_after=balance, student_id=student_id,
+                                   created_at=created_at or datetime.utcnow()))
+
+def record_charge(student_id, amount, payment_id, created_at=None):
+    """Captured payment of `amount` paise."""
+    _post_ledger(payment_id, 'charge', student_id,
+                 [('razorpay', amount), ('ticket_revenue', -amount)], created_at)
+
+def record_refund(student_id, amount, refund_id, created_at=None):
+    """Refund of `amount` paise back to the payer."""
+    _post_ledger(refund_id, 'refund', student_id,
+                 [('refunds', amount), ('razorpay', -amount)], created_at)
+
+def apply_refund(student, refund_id, amount, refunded_at=None):
+    """Mark a student refunded, post the refund and free their seats. Does not commit."""
+    student.refunded = True
+    student.refunded_at = refunded_at or datetime.utcnow()
+    student.refund_id = refund_id
+    student.payment_status = "Refunded"
+    record_refund(student.id, amount, refund_id or f"refund:{student.id}", student.refunded_at)
+    release_confirmed_seats(1 + student.family_members)
+
+def ledger_totals():
+    """Rupee totals straight from the account rows: gross, refunded and net collected."""
+    balances = dict(db.session.execute(db.select(LedgerAccount.name, LedgerAccount.balance)).all())
+    return {
+        'gross': -balances.get('ticket_revenue', 0) / 100,
+        'refunded': balances.get('refunds', 0) / 100,
+        'collected': balances.get('razorpay', 0) / 100,
+    }
+
+def student_ledger_net():
+    """Subquery: net paise each student has paid (charges minus refunds)."""
+    return db.select(LedgerEntry.student_id, func.sum(LedgerEntry.amount).label('net')) \
+        .where(LedgerEntry.account == 'razorpay') \
+        .group_by(LedgerEntry.student_id).subquery()
+
+def backfill_ledger(batch_size=1000):
+    """
+    Post charges / refunds for students registered before the ledger existed,
+    at the ticket price of the time, in id-ordered batches. Safe to re-run:
+    only students with no charge posted are picked up.
+    """
+    charged = db.select(LedgerEntry.student_id).where(LedgerEntry.kind == 'charge')
+    paid = Student.payment_status.in_(('Paid', 'Refunded')) | (Student.refunded == True)
+    posted, last_id = 0, 0
+    while True:
+        students = Student.query.filter(Student.id > last_id, paid, Student.id.not_in(charged)) \
+            .order_by(Student.id).limit(batch_size).all()
+        if not students:
+            return posted
+        for student in students:
+            amount = (1 + (student.family_members or 0)) * TICKET_PRICE_PAISE
+            record_charge(student.id, amount, student.transaction_id or f"backfill:{student.id}:charge",
+                          created_at=student.created_at)
+            if student.refunded:
+                record_refund(student.id, amount, student.refund_id or f"backfill:{student.id}:refund",
+                              created_at=student.refunded_at)
+        db.session.commit()
+        posted += len(students)
+        last_id = students[-1].id
+
+def reconcile_ledger():
+    """
+    Cross-check the ledger against itself and against Student rows. Returns
+    a list of {'check', 'detail'} dicts; empty means everything agrees.
+    """
+    issues = []
+    sums = dict(db.session.execute(
+        db.select(LedgerEntry.account, func.sum(LedgerEntry.amount)).group_by(LedgerEntry.account)).all())
+    for account in db.session.scalars(db.select(LedgerAccount)):
+        if account.balance != (sums.get(account.name) or 0):
+            issues.append({'check': 'balance_drift',
+                           'detail': f"{account.name}: balance {account.balance} != entries {sums.get(account.name) or 0}"})
+    for reference, total in db.session.execute(
+            db.select(LedgerEntry.reference, func.sum(LedgerEntry.amount))
+            .group_by(LedgerEntry.reference).having(func.sum(LedgerEntry.amount) != 0)):
+        issues.append({'check': 'unbalanced', 'detail': f"{reference}: legs sum to {total}"})
+
+    per_student = db.select(
+        LedgerEntry.student_id,
+        func.sum(case((LedgerEntry.kind == 'charge', LedgerEntry.amount), else_=0)).label('charged_paise'),
+        func.sum(case((LedgerEntry.kind == 'refund', -LedgerEntry.amount), else_=0)).label('refunded_paise'),
+    ).where(LedgerEntry.account == 'razorpay').group_by(LedgerEntry.student_id).subquery()
+    rows = db.session.execute(
+        db.select(Student.id, Student.unique_id, Student.payment_status, Student.refunded,
+                  Student.family_members, per_student.c.charged_paise, per_student.c.refunded_paise)
+        .outerjoin(per_student, per_student.c.student_id == Student.id)
+    )
+    for row in rows:
+        charged, refunded = row.charged_paise or 0, row.refunded_paise or 0
+        expected = (1 + (row.family_members or 0)) * TICKET_PRICE_PAISE
+        paid = row.payment_status in ('Paid', 'Refunded') or row.refunded
+        if paid and not charged:
+            issues.append({'check': 'missing_charge', 'detail': f"{row.unique_id}: {row.payment_status} but no charge"})
+        elif charged and charged != expected:
+            issues.append({'check': 'amount_mismatch',
+                           'detail': f"{row.unique_id}: charged {charged} paise, ticket price {expected}"})
+        if row.refunded and not refunded:
+            issues.append({'check': 'missing_refund', 'detail': f"{row.unique_id}: refunded but no refund posted"})
+        elif refunded and not row.refunded:
+            issues.append({'check': 'unexpected_refund', 'detail': f"{row.unique_id}: refund posted but not marked refunded"})
+    return issues
+
+# ---------------- Razorpay reconciliation ----------------
+# Razorpay list calls return at most 100 items per page for a [from, to]
+# unix-time range. The range is cut into slices that a bounded thread pool
+# pages through concurrently; the ids are then matched against the indexed
+# transaction_id / razorpay_order_id columns a chunk at a time.
+RAZORPAY_PAGE_SIZE = 100
+RECONCILE_MATCH_CHUNK = 500
+
+def _razorpay_list(kind, start, end):
+    """Every Razorpay `kind` entity created in [start, end] (unix seconds)."""
+    collection = getattr(razorpay_client, kind)
+    items, skip = [], 0
+    while True:
+        with external_call('razorpay', f'{kind}.all'):
+            page = collection.all({'from': start, 'to': end, 'count': RAZORPAY_PAGE_SIZE, 'skip': skip})
+        batch = page.get('items', [])
+        items.extend(batch)
+        if len(batch) < RAZORPAY_PAGE_SIZE:
+            return items
+        skip += len(batch)
+
+def fetch_razorpay(kind, start, end, workers=None, slice_seconds=None):
+    """
+    All Razorpay `kind` ('payment' / 'refund') entities created between the
+    datetimes start and end, fetched slice by slice on a bounded pool.
+    """
+    workers = workers or app.config['RAZORPAY_RECONCILE_WORKERS']
+    width = slice_seconds or app.config['RAZORPAY_RECONCILE_SLICE']
+    lo = int(start.replace(tzinfo=timezone.utc).timestamp())
+    hi = int(end.replace(tzinfo=timezone.utc).timestamp())
+    slices = [(t, min(t + width - 1, hi)) for t in range(lo, hi + 1, width)]
+    items = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'razorpay-{kind}') as pool:
+        for batch in pool.map(lambda bounds: _razorpay_list(kind, *bounds), slices):
+            items.update((item['id'], item) for item in batch)
+    return list(items.values())
+
+def _students_by(column, values):
+    """{value: Student} for the students whose `column` is one of `values`."""
+    values, found = [v for v in set(values) if v], {}
+    for i in range(0, len(values), RECONCILE_MATCH_CHUNK):
+        for student in Student.query.filter(column.in_(values[i:i + RECONCILE_MATCH_CHUNK])):
+            found[getattr(student, column.key)] = student
+    return found
+
+def reconcile_razorpay(start, end, repair=False, workers=None):
+    """
+    Diff Razorpay payments / refunds created in [start, end] against Student
+    rows. Returns a report of lists:
+      missing_student      captured payment that never became a registration
+      refunded_at_razorpay refund issued outside the app for a student still Paid
+      partial_refund       refunds outside the app adding up to less than the
+                           payment; never repaired
+      not_captured         Paid student whose payment isn't captured
+      double_capture       a second captured payment on a registered order
+      unknown_payment      Paid student created in the range with no such payment
+      repaired             differences fixed when repair=True (missing students
+                           with a pending registration, out-of-band refunds)
+    """
+    # Registrations complete up to PENDING_REGISTRATION_TTL after paying
+    lookback = start - timedelta(seconds=app.config['PENDING_REGISTRATION_TTL'])
+    payments = fetch_razorpay('payment', lookback, end, workers)
+    refunds = [r for r in fetch_razorpay('refund', start, end, workers) if r.get('status') != 'failed']
+    by_payment = _students_by(Student.transaction_id,
+                              [p['id'] for p in payments] + [r['payment_id'] for r in refunds])
+    by_order = _students_by(Student.razorpay_order_id, [p.get('order_id') for p in payments])
+    report = {'missing_student': [], 'refunded_at_razorpay': [], 'partial_refund': [], 'not_captured': [],
+              'double_capture': [], 'unknown_payment': [], 'repaired': []}
+
+    for payment in payments:
+        student = by_payment.get(payment['id'])
+        on_order = by_order.get(payment.get('order_id')) if student is None else None
+        if on_order is not None and on_order.transaction_id in (None, payment['id']):
+            student, on_order = on_order, None
+        if on_order is not None:
+            # Another attempt on an order some other payment completed: failed or
+            # abandoned attempts are expected, only a second capture needs action
+            if payment.get('status') == 'captured':
+                report['double_capture'].append({'unique_id': on_order.unique_id, 'payment_id': payment['id'],
+                                                 'registered_payment_id': on_order.transaction_id,
+                                                 'amount': payment.get('amount')})
+            continue
+        captured = payment.get('status') in ('captured', 'refunded')
+        # a payment refunded in full without a registration (duplicate contact, sold out) is settled
+        if student is None and payment.get('status') == 'captured' and datetime.utcfromtimestamp(payment['created_at']) >= start:
+            entry = {'payment_id': payment['id'], 'order_id': payment.get('order_id'),
+                     'amount': payment.get('amount')}
+            pending = find_pending_registration(order_id=payment.get('order_id'))
+            if repair and pending:
+                student, created = complete_registration(pending, payment['id'], payment.get('vpa'),
+                                                         payment.get('amount'))
+                if student is None:  # refunded, and `created` says why
+                    report['repaired'].append(dict(entry, check=f'{created}_refunded'))
+                else:
+                    report['repaired'].append(dict(entry, check='missing_student', unique_id=student.unique_id))
+            else:
+                report['missing_student'].append(entry)
+        elif student is not None and not captured and student.payment_status == 'Paid':
+            report['not_captured'].append({'unique_id': student.unique_id, 'payment_id': payment['id'],
+                                           'status': payment.get('status')})
+
+    # A payment can be refunded in several parts; only the full amount makes
+    # the registration Refunded
+    refunds_by_payment = {}
+    for refund in refunds:
+        refunds_by_payment.setdefault(refund['payment_id'], []).append(refund)
+    paid_amounts = {p['id']: p.get('amount') for p in payments}
+    for payment_id, issued in refunds_by_payment.items():
+        student = by_payment.get(payment_id)
+        if student is None or student.refunded:
+            continue
+        latest = max(issued, key=lambda r: r['created_at'])
+        refunded = sum(r.get('amount') or 0 for r in issued)
+        paid = paid_amounts.get(payment_id) or (1 + (student.family_members or 0)) * TICKET_PRICE_PAISE
+        entry = {'unique_id': student.unique_id, 'payment_id': payment_id,
+                 'refund_id': latest['id'], 'amount': refunded,
+                 'refunded_at': datetime.utcfromtimestamp(latest['created_at']).isoformat()}
+        if refunded < paid:
+            # the registration still stands; left for a person to look at
+            report['partial_refund'].append(dict(entry, paid=paid))
+        elif repair:
+            # Stamped now, not with Razorpay's time: the workers' time-series
+            # caches treat past buckets as final, so a backdated refund would
+            # never show up there. The report keeps the original time.
+            apply_refund(student, latest['id'], refunded)
+            db.session.commit()
+            report['repaired'].append(dict(entry, check='refunded_at_razorpay'))
+        else:
+            report['refunded_at_razorpay'].append(entry)
+
+    seen = {p['id'] for p in payments}
+    unmatched = Student.query.filter(Student.created_at >= start, Student.created_at <= end,
+                                     Student.payment_status == 'Paid', Student.transaction_id.isnot(None))
+    for student in unmatched.yield_per(app.config['READ_MODEL_CHUNK']):
+        if student.transaction_id not in seen:
+            report['unknown_payment'].append({'unique_id': student.unique_id,
+                                              'payment_id': student.transaction_id})
+    if repair:
+        promote_waitlist.task.wake()
+    return report
+
+@app.cli.command('reconcile-razorpay')
+@click.option('--days', default=7, show_default=True, help='Check the last N days (ignored with --since).')
+@click.option('--since', type=click.DateTime(), help='Start of the range (UTC).')
+@click.option('--until', type=click.DateTime(), help='End of the range (UTC), default now.')
+@click.option('--workers', type=int, help='Concurrent Razorpay list calls.')
+@click.option('--repair', is_flag=True, help='Create missing registrations and apply out-of-band refunds.')
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), help='Write the full diff as JSON.')
+def reconcile_razorpay_command(days, since, until, workers, repair, report_path):
+    """Compare Razorpay payments and refunds with local registrations."""
+    end = until or datetime.utcnow()
+    start = since or end - timedelta(days=days)
+    report = reconcile_razorpay(start, end, repair=repair, workers=workers)
+    for check, entries in report.items():
+        click.echo(f"{check:<22}{len(entries):>8}")
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(report, start=start.isoformat(), end=end.isoformat()), f, indent=2)
+    if any(entries for check, entries in report.items() if check != 'repaired'):
+        raise SystemExit(1)
+
 # ---------------- Routes ----------------
 @app.route('/')
 def home():
-    return render_template('register.html')
+    return render_template('register.html', seats_left=seats_remaining())
+
+# Live duplicate check for the registration form (debounced client-side)
+@app.route('/check-availability')
+def check_availability():
+    buckets = pay_buckets()
+    wait = buckets.take(buckets.slot_for('availability:' + client_ip()),
+                        app.config['AVAILABILITY_IP_RATE'], app.config['AVAILABILITY_IP_BURST'])
+    if wait:
+        return _shed(429, wait, "Too many checks, slow down.")
+
+    result = {}
+    email = request.args.get('email', '').strip()
+    mobile_number = request.args.get('mobile_number', '').strip()
+    if email:
+        result['email_available'] = not is_contact_taken('email', email)
+    if mobile_number:
+        result['mobile_available'] = not is_contact_taken('mobile', mobile_number)
+    return jsonify(result)
 
 # Registration + payment start
 @app.route('/pay', methods=['POST'])
+@pay_rate_limited
 def pay():
     name = request.form.get('name')
     email = request.form.get('email')
@@ -239,7 +2589,7 @@ def pay():
         return redirect(url_for('home'))
 
     # Duplicate check
-    existing = Student.query.filter((Student.email == email) | (Student.mobile_number == mobile_number)).first()
+    existing = find_registered_contact(email, mobile_number)
     if existing:
         flash("This email or mobile number is already registered.", "danger")
         return redirect(url_for('home'))
@@ -248,8 +2598,7 @@ def pay():
     total_people = 1 + family_members
     total_amount = total_people * 100  # ₹100 per person
 
-    # Save registration temporarily in session
-    session['registration'] = {
+    registration = {
         'name': name,
         'email': email,
         'semester': semester,
@@ -259,44 +2608,110 @@ def pay():
         'total_amount': total_amount
     }
 
-    # Create Razorpay order
-    order = razorpay_client.order.create(dict(amount=total_amount * 100, currency='INR', payment_capture='1'))
-    session['registration']['razorpay_order_id'] = order['id']
+    # Reserve seats before talking to Razorpay so a sold-out event never creates orders
+    hold = None
+    if seats_enabled():
+        # While anyone is queued, seats that free up go to the head of the queue
+        # (promote_waitlist), not to whoever reaches /pay first
+        queued = db.session.query(WaitlistEntry.id).filter_by(status='waiting').first() is not None
+        hold = None if queued else hold_seats(total_people)
+        if hold is None:
+            entry, position = join_waitlist(registration)
+            flash(f"The event is full. You are #{position} on the waitlist; "
+                  f"we'll WhatsApp you if a seat opens up.", "info")
+            return redirect(url_for('home'))
+
+    # Create Razorpay order and keep the registration server-side until it's paid
+    try:
+        with external_call('razorpay', 'order.create'):
+            order = razorpay_client.order.create(dict(amount=total_amount * 100, currency='INR', payment_capture='1'))
+    except Exception:
+        if hold:
+            release_seat_hold(hold.id)
+        raise
+    if hold:
+        hold.order_id = order['id']  # committed together with the pending registration
+    session['pending_registration'] = save_pending_registration(order['id'], registration, hold)
 
     return render_template('payment.html',
                            order_id=order['id'],
                            amount=total_amount,
                            razorpay_key=RAZORPAY_KEY_ID,
+                           checkout_timeout=max(app.config['SEAT_HOLD_TTL'] - 60, 60) if hold else None,
                            name=name,
                            email=email)
 
-# Payment success (called by frontend after razorpay)
-@app.route('/payment-success', methods=['POST'])
-def payment_success():
-    data = session.get('registration')
-    if not data:
-        flash("Session expired. Please register again.", "danger")
-        return redirect(url_for('home'))
-
-    razorpay_payment_id = request.form.get('razorpay_payment_id')
-    upi_id = request.form.get('upi_id')  # optional
-
+def find_registered_student(order_id=None, payment_id=None):
+    """Return the Student already created for this order / payment, if any."""
+    if order_id:
+        student = Student.query.filter_by(razorpay_order_id=order_id).first()
+        if student:
+            return student
+    if payment_id:
+        return Student.query.filter_by(transaction_id=payment_id).first()
+    return None
+
+def complete_registration(pending, razorpay_payment_id, upi_id=None, amount=None):
+    """
+    Turn a paid pending registration into a Student, post its charge to the
+    ledger and generate its QR / PDF / CSV row / WhatsApp confirmation.
+    `amount` is the captured amount in paise when Razorpay told us; otherwise
+    the order amount. A captured amount that differs from the order is logged. Returns (student, created). If another request
+    already completed the same order, returns the existing Student with
+    created=False and redoes nothing. If the payment can't be registered it is
+    refunded and (None, reason) is returned: 'duplicate_contact' when a
+    different checkout registered the same email / mobile first, 'sold_out'
+    when the seat hold expired and the seats went to someone else.
+    """
+    order_id = pending.order_id
+    contact = (pending.email, pending.mobile_number)
+    order_amount = (pending.total_amount or 0) * 100
     student = Student(
-        name=data['name'],
-        email=data['email'],
-        semester=data['semester'],
-        mobile_number=data['mobile_number'],
-        family_members=data['family_members'],
-        unique_id=data['unique_id'],
+        name=pending.name,
+        email=pending.email,
+        semester=pending.semester,
+        mobile_number=pending.mobile_number,
+        family_members=pending.family_members,
+        unique_id=pending.unique_id,
         upi_id=upi_id if upi_id else "N/A",
         transaction_id=razorpay_payment_id,
-        razorpay_order_id=data.get('razorpay_order_id'),
+        razorpay_order_id=order_id,
         payment_status="Paid",
         refunded=False
     )
+    seats = 1 + pending.family_members
+    if amount is not None and amount != order_amount:
+        log.warning('registration.amount_mismatch', extra={
+            'order_id': order_id, 'payment_id': razorpay_payment_id, 'captured': amount, 'ordered': order_amount})
     db.session.add(student)
-    db.session.commit()
-    session.pop('registration', None)
+    db.session.delete(pending)
+    try:
+        begin_write()
+        seated = confirm_seat_hold(order_id, seats)
+        if seated:
+            db.session.flush()
+            record_charge(student.id, amount or order_amount, razorpay_payment_id)
+            db.session.commit()
+    except (IntegrityError, OperationalError) as exc:
+        # Lost the race against a duplicate callback / the webhook. The lock
+        # wait is SQLite's busy_timeout; "database is locked" past it means
+        # the winner may not have landed either, and the caller answers with
+        # a retryable error (the pending row is still there for the retry).
+        db.session.rollback()
+        existing = find_registered_student(order_id, razorpay_payment_id)
+        if existing is None and isinstance(exc, IntegrityError) and find_registered_contact(*contact):
+            # Two checkouts for one contact both passed /pay; the other paid first
+            refund_unregistered_payment(order_id, razorpay_payment_id, amount or order_amount, 'duplicate_contact')
+            return None, 'duplicate_contact'
+        if existing is None:
+            raise
+        return existing, False
+    if not seated:
+        db.session.rollback()
+        refund_unregistered_payment(order_id, razorpay_payment_id, amount or order_amount, 'sold_out')
+        return None, 'sold_out'
+
+    remember_registered_contact(student)
 
     # Generate QR, PDF, CSV, WhatsApp
     generate_qr_code(student.unique_id)
@@ -326,10 +2741,168 @@ def payment_success():
     )
 
     send_whatsapp_confirmation(student.mobile_number, student.name, student.unique_id)
+    return student, True
+
+def refund_unregistered_payment(order_id, razorpay_payment_id, amount, reason):
+    """
+    Drop a paid pending registration that can't become a Student (`reason`:
+    'duplicate_contact' or 'sold_out'), free any seats it still holds and
+    refund the payment. Only the request that
+    deletes the pending row refunds, so a racing webhook can't refund twice.
+    A failed refund is logged and left to reconcile-razorpay, which reports
+    the captured payment as missing_student. Returns the refund id or None.
+    """
+    claimed = db.session.execute(
+        delete(PendingRegistration).where(PendingRegistration.order_id == order_id)).rowcount
+    seats = db.session.execute(
+        delete(SeatHold).where(SeatHold.order_id == order_id).returning(SeatHold.seats)).scalar()
+    if seats:
+        _adjust_seats(held=-seats)
+    db.session.commit()
+    if not claimed:
+        return None
+    if seats:
+        promote_waitlist.task.wake()
+    details = {'order_id': order_id, 'payment_id': razorpay_payment_id, 'amount': amount}
+    try:
+        with external_call('razorpay', 'payment.refund'):
+            refund = razorpay_client.payment.refund(razorpay_payment_id, {'amount': amount})
+    except Exception:
+        log.exception('registration.refund_failed', extra=dict(details, reason=reason))
+        return None
+    log.warning(f'registration.{reason}', extra=dict(details, refund_id=refund.get('id')))
+    return refund.get('id')
 
-    flash("Payment successful! Download QR & PDF from the next page.", "success")
+# Payment success (called by frontend after razorpay)
+@app.route('/payment-success', methods=['POST'])
+def payment_success():
+    order_id = request.form.get('razorpay_order_id')
+    razorpay_payment_id = request.form.get('razorpay_payment_id')
+    upi_id = request.form.get('upi_id')  # optional
+
+    pending = find_pending_registration(order_id=order_id, token=session.get('pending_registration'))
+    if not pending:
+        # The pending row is deleted in the same commit that creates the Student,
+        # so a resubmitted form / browser retry lands here: show the existing
+        # registration and redo nothing.
+        existing = find_registered_student(order_id, razorpay_payment_id)
+        if existing:
+            session.pop('pending_registration', None)
+            return redirect(url_for('download_all', uid=existing.unique_id))
+        flash("Session expired. Please register again.", "danger")
+        return redirect(url_for('home'))
+
+    # Post the charge with what Razorpay captured, as the webhook does, so a
+    # mismatch with the order shows up in reconcile-ledger
+    try:
+        with external_call('razorpay', 'payment.fetch'):
+            captured = razorpay_client.payment.fetch(razorpay_payment_id).get('amount')
+    except Exception:
+        log.warning('registration.payment_fetch_failed',
+                    extra={'order_id': pending.order_id, 'payment_id': razorpay_payment_id})
+        captured = None  # falls back to the order amount
+
+    try:
+        student, created = complete_registration(pending, razorpay_payment_id, upi_id, amount=captured)
+    except OperationalError:
+        log.warning('registration.busy', extra={'order_id': order_id})
+        return _shed(503, app.config['PAY_SHED_RETRY_AFTER'], "Still confirming your payment, please retry shortly.")
+    session.pop('pending_registration', None)
+    if student is None:  # refunded, and `created` says why
+        if created == 'sold_out':
+            flash("Your seat reservation ran out before the payment arrived and the event is now full. "
+                  "Your payment has been refunded.", "danger")
+        else:
+            flash("This email or mobile number was registered by another checkout while you were paying. "
+                  "Your payment has been refunded.", "danger")
+        return redirect(url_for('home'))
+
+    if created:
+        flash("Payment successful! Download QR & PDF from the next page.", "success")
     return redirect(url_for('download_all', uid=student.unique_id))
 
+# Razorpay webhook: completes registrations whose browser never came back
+@app.route('/razorpay-webhook', methods=['POST'])
+def razorpay_webhook():
+    if not RAZORPAY_WEBHOOK_SECRET:
+        return jsonify({"error": "webhook not configured"}), 503
+
+    body = request.get_data(as_text=True)
+    try:
+        razorpay_client.utility.verify_webhook_signature(
+            body, request.headers.get('X-Razorpay-Signature', ''), RAZORPAY_WEBHOOK_SECRET)
+    except razorpay.errors.SignatureVerificationError:
+        return jsonify({"error": "invalid signature"}), 400
+
+    event = request.get_json(silent=True) or {}
+    if event.get('event') not in ('payment.captured', 'order.paid'):
+        return jsonify({"status": "ignored"})
+
+    payment = event.get('payload', {}).get('payment', {}).get('entity', {})
+    pending = find_pending_registration(order_id=payment.get('order_id'))
+    if not pending:
+        # Already completed by /payment-success, or expired
+        return jsonify({"status": "no pending registration"})
+
+    try:
+        student, created = complete_registration(pending, payment.get('id'), payment.get('vpa'),
+                                                 amount=payment.get('amount'))
+    except OperationalError:
+        # Razorpay redelivers webhooks that don't get a 2xx
+        log.warning('registration.busy', extra={'order_id': pending.order_id})
+        return jsonify({"error": "busy, retry"}), 503
+    if student is None:  # refunded, and `created` says why
+        return jsonify({"status": f"{created.replace('_', ' ')}, refunded"})
+    return jsonify({"status": "registered" if created else "already registered",
+                    "unique_id": student.unique_id})
+
+# Waitlist offer link sent over WhatsApp
+@app.route('/waitlist/claim/<token>', methods=['GET', 'POST'])
+def claim_waitlist_offer(token):
+    entry = WaitlistEntry.query.filter_by(token=token).first_or_404()
+    hold = db.session.get(SeatHold, entry.hold_id) if entry.hold_id else None
+    if entry.status != 'offered' or hold is None:
+        flash("This waitlist offer has expired.", "danger")
+        return redirect(url_for('home'))
+
+    total_amount = (1 + entry.family_members) * 100
+    if request.method == 'GET':
+        # Opening the link only shows the offer: link previews and mail
+        # scanners fetch it too, and must not create an order
+        return render_template('waitlist_claim.html', entry=entry, seats=hold.seats,
+                               amount=total_amount, expires_at=hold.expires_at)
+
+    if hold.order_id:
+        # Link opened again: reuse the order that's already waiting for payment
+        pending = find_pending_registration(order_id=hold.order_id)
+        if pending is None:
+            flash("This waitlist offer has already been used.", "info")
+            return redirect(url_for('home'))
+        order_id = pending.order_id
+        session['pending_registration'] = pending.token
+    else:
+        with external_call('razorpay', 'order.create'):
+            order = razorpay_client.order.create(dict(amount=total_amount * 100, currency='INR', payment_capture='1'))
+        order_id = order['id']
+        hold.order_id = order_id  # committed together with the pending registration
+        session['pending_registration'] = save_pending_registration(order_id, {
+            'name': entry.name,
+            'email': entry.email,
+            'semester': entry.semester,
+            'mobile_number': entry.mobile_number,
+            'unique_id': f"MSCCAIT2025-{str(uuid.uuid4())[:8]}",
+            'family_members': entry.family_members,
+            'total_amount': total_amount
+        }, hold)
+
+    return render_template('payment.html',
+                           order_id=order_id,
+                           amount=total_amount,
+                           razorpay_key=RAZORPAY_KEY_ID,
+                           checkout_timeout=max(int((hold.expires_at - datetime.utcnow()).total_seconds()) - 60, 60),
+                           name=entry.name,
+                           email=entry.email)
+
 # downloads
 @app.route('/download-all/<uid>')
 def download_all(uid):
@@ -346,33 +2919,55 @@ def get_pdf(uid):
     return send_file(path, as_attachment=True)
 
 # verify QR attendance
+def _scan_result(status, message, gate):
+    log.info('attendance.scan', extra={'result': status, 'gate': normalize_gate(gate)})
+    return render_template('verify.html', status=status, message=message)
+
 @app.route('/verify/<uid>')
 def verify(uid):
+    gate = request.args.get('gate') or request.cookies.get(GATE_COOKIE)
+    if app.config['ATTENDANCE_BATCHING']:
+        status, message = attendance_batcher.submit(uid, gate)
+        return _scan_result(status, message, gate)
+
     student = Student.query.filter_by(unique_id=uid).first()
     if not student:
-        return render_template('verify.html', status="error", message="Invalid QR or student not registered.")
+        return _scan_result("error", "Invalid QR or student not registered.", gate)
 
     if student.attended:
-        return render_template('verify.html', status="warning", message=f"{student.name} has already attended.")
+        return _scan_result("warning", f"{student.name} has already attended.", gate)
 
     student.attended = True
+    student.attended_at = datetime.utcnow()
+    db.session.add(AttendanceLog(student_id=student.id, gate=normalize_gate(gate), marked_at=student.attended_at))
     db.session.commit()
     update_attendance_in_csv(uid)
-    return render_template('verify.html', status="success", message=f"Attendance marked for {student.name} (Sem {student.semester}).")
+    return _scan_result("success", f"Attendance marked for {student.name} (Sem {student.semester}).", gate)
 
 @app.route('/verify')
 def verify_redirect():
     uid = request.args.get('uid')
-    return redirect(url_for('verify', uid=uid))
+    return redirect(url_for('verify', uid=uid, gate=request.args.get('gate')))
 
 # scanner pages
+# Open a scanner as /scanner?gate=North once per device; the gate is kept in a
+# cookie so every /verify from that device is logged against it.
+GATE_COOKIE = 'scanner_gate'
+
+def _scanner_page(template):
+    gate = request.args.get('gate')
+    resp = app.make_response(render_template(template, gate=normalize_gate(gate or request.cookies.get(GATE_COOKIE))))
+    if gate:
+        resp.set_cookie(GATE_COOKIE, normalize_gate(gate), max_age=7 * 24 * 3600, samesite='Lax')
+    return resp
+
 @app.route('/scanner')
 def scanner():
-    return render_template('scanner.html')
+    return _scanner_page('scanner.html')
 
 @app.route('/scan')
 def scan_qr_page():
-    return render_template('scan.html')
+    return _scanner_page('scan.html')
 
 # ---------------- Admin / Management ----------------
 ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', '@291104AMANNAYAK')
@@ -395,22 +2990,44 @@ def admin_login():
 def admin_panel():
     if not admin_required():
         return redirect(url_for('admin_login'))
-    students = Student.query.order_by(Student.id.desc()).all()
-    return render_template('admin_panel.html', students=students)
+    q = request.args.get('q', '').strip()
+    if q:
+        students = search_students(q, limit=app.config['ADMIN_SEARCH_MAX_LIMIT'])
+    else:
+        students = iter_read_rows(StudentListRow, order_by=Student.id.desc())
+    return stream_page('admin_panel.html', students=students, q=q)
+
+# Autocomplete for the admin search boxes: top N prefix matches as JSON
+@app.route('/admin/search')
+def admin_search():
+    if not admin_required():
+        return jsonify({"error": "login required"}), 401
+    q = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', app.config['ADMIN_SEARCH_LIMIT'], type=int) or 1,
+                app.config['ADMIN_SEARCH_MAX_LIMIT'])
+    semester = request.args.get('semester', type=int)
+    students = search_students(q, limit=limit, semester=semester) if q else []
+    return jsonify({"query": q, "results": [search_result(s) for s in students]})
 
 @app.route('/admin-dashboard')
+@reads_snapshot
 def admin_dashboard():
     if not admin_required():
         return redirect(url_for('admin_login'))
-    students = Student.query.all()
-    total_present = sum(1 for s in students if s.attended)
-    total_absent = sum(1 for s in students if not s.attended)
-    total_students = len(students)
+    rows = db.session.query(Student.semester, Student.attended, func.count(Student.id)) \
+        .group_by(Student.semester, Student.attended).all()
+    total_present = total_absent = 0
     sem_stats = {}
-    for sem in range(1, 7):
-        sem_present = sum(1 for s in students if s.semester == sem and s.attended)
-        sem_absent = sum(1 for s in students if s.semester == sem and not s.attended)
-        sem_stats[sem] = {"present": sem_present, "absent": sem_absent}
+    for sem, attended, count in rows:
+        if attended:
+            total_present += count
+        else:
+            total_absent += count
+        if sem is not None:
+            stats = sem_stats.setdefault(sem, {"present": 0, "absent": 0})
+            stats["present" if attended else "absent"] += count
+    total_students = total_present + total_absent
+    sem_stats = dict(sorted(sem_stats.items()))
     return render_template('admin_dashboard.html', total_present=total_present, total_absent=total_absent, total_students=total_students, sem_stats=sem_stats)
 
 @app.route('/logout')
@@ -426,6 +3043,8 @@ def delete_student(student_id):
         return redirect(url_for('admin_login'))
     student = Student.query.get_or_404(student_id)
     try:
+        if student.payment_status == "Paid":
+            release_confirmed_seats(1 + (student.family_members or 0))
         db.session.delete(student)
         db.session.commit()
         flash("Student deleted successfully.", "success")
@@ -441,6 +3060,8 @@ def delete_student_refund(student_id):
         return redirect(url_for('admin_login'))
     student = Student.query.get_or_404(student_id)
     try:
+        if student.payment_status == "Paid":
+            release_confirmed_seats(1 + (student.family_members or 0))
         db.session.delete(student)
         db.session.commit()
         flash("Student deleted from refunds list.", "success")
@@ -454,8 +3075,12 @@ def delete_student_refund(student_id):
 def sem1_refunds():
     if not admin_required():
         return redirect(url_for('admin_login'))
-    sem1_students = Student.query.filter_by(semester=1).all()
-    return render_template('sem1_refunds.html', students=sem1_students)
+    q = request.args.get('q', '').strip()
+    if q:
+        sem1_students = search_students(q, limit=app.config['ADMIN_SEARCH_MAX_LIMIT'], semester=1)
+    else:
+        sem1_students = iter_read_rows(StudentListRow, Student.semester == 1)
+    return stream_page('sem1_refunds.html', students=sem1_students, q=q)
 
 @app.route('/process_refund/<int:student_id>', methods=['POST'])
 def process_refund(student_id):
@@ -465,26 +3090,29 @@ def process_refund(student_id):
     # Check if student has already been refunded
     if student.refunded:
         flash(f"Refund already processed for {student.name}!", "info")
-        return redirect(url_for('student_info'))
+        return redirect(url_for('sem1_refunds'))
 
     # Check if student has paid
     if student.payment_status != "Paid":
         flash("Refund cannot be processed. Payment not completed!", "danger")
-        return redirect(url_for('student_info'))
+        return redirect(url_for('sem1_refunds'))
 
     try:
         # Razorpay Refund API Call
-        refund = razorpay_client.payment.refund(student.transaction_id, {
-            "amount": (1 + student.family_members) * 10000  # Refund student + family ✅
-        })
+        amount = (1 + student.family_members) * 10000  # Refund student + family ✅
+        with external_call('razorpay', 'payment.refund'):
+            refund = razorpay_client.payment.refund(student.transaction_id, {
+                "amount": amount
+            })
 
         # Update student record after refund success
-        student.refunded = True
-        student.payment_status = "Refunded"
+        apply_refund(student, refund.get('id'), refund.get('amount', amount))
         db.session.commit()
+        promote_waitlist.task.wake()
 
         flash(f"Refund processed for {student.name} (Sem 1) ✅", "success")
     except Exception as e:
+        db.session.rollback()
         flash(f"Refund failed: {str(e)}", "danger")
 
     return redirect(url_for('sem1_refunds'))
@@ -527,31 +3155,30 @@ def _clean_csv(file_path):
 # 1. Export PDF + CSV (With Family Members + Total Amount)
 # --------------------------------------
 @app.route('/export/pdf')
+@reads_snapshot
 def export_pdf():
     file_path = os.path.join(app.root_path, 'static', 'pdf_exports', 'students_report.pdf')
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-    students = Student.query.all()
+    students = iter_export_rows()
 
     data = [["ID", "Name", "Semester", "Family Members", "Payment Status", "Amount"]]
-    total_amount = 0
     total_family_members = 0
 
     for s in students:
-        amount = 100 if s.payment_status == "Paid" else 0
-        total_amount += amount
-        total_family_members += s.family_members
+        total_family_members += s.family_members or 0
         data.append([
             s.id,
             s.name,
             s.semester,
             s.family_members,
             s.payment_status,
-            f"₹{amount}"
+            f"₹{s.amount_paise / 100:g}"
         ])
 
-    # Add totals at the end
-    data.append(["", "", "", f"Total Family: {total_family_members}", "Total Collected:", f"₹{total_amount}"])
+    # Add totals at the end (the ledger balance, same figure as the dashboard)
+    data.append(["", "", "", f"Total Family: {total_family_members}", "Total Collected:",
+                 f"₹{ledger_totals()['collected']:g}"])
 
     pdf = SimpleDocTemplate(file_path, pagesize=A4)
     style = getSampleStyleSheet()
@@ -568,17 +3195,17 @@ def export_pdf():
     return send_file(file_path, as_attachment=True)
 
 @app.route('/export/csv')
+@reads_snapshot
 def export_csv():
     file_path = os.path.join(app.root_path, 'static', 'csv_exports', 'registrations.csv')
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-    students = Student.query.all()
+    students = iter_export_rows()
     with open(file_path, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["ID", "Name", "Semester", "Family Members", "Payment Status", "Amount"])
         for s in students:
-            amount = 100 if s.payment_status == "Paid" else 0
-            writer.writerow([s.id, s.name, s.semester, s.family_members, s.payment_status, amount])
+            writer.writerow([s.id, s.name, s.semester, s.family_members, s.payment_status, f"{s.amount_paise / 100:g}"])
 
     return send_file(file_path, as_attachment=True)
 
@@ -586,6 +3213,7 @@ def export_csv():
 # 2. Update Dashboard Data API
 # --------------------------------------
 @app.route('/dashboard_data')
+@reads_snapshot
 def dashboard_data():
     # Count total students (registrations)
     total_students = db.session.query(func.count(Student.id)).scalar() or 0
@@ -600,15 +3228,10 @@ def dashboard_data():
         .filter(Student.refunded == True) \
         .scalar() or 0
 
-    # ✅ Calculate total collected based on family members + student
-    total_amount_collected = db.session.query(
-        func.sum((Student.family_members + 1) * 100)
-    ).filter(Student.payment_status == "Paid", Student.refunded == False).scalar() or 0
-
-    # ✅ Calculate refunded amount based on family members + student
-    total_amount_refunded = db.session.query(
-        func.sum((Student.family_members + 1) * 100)
-    ).filter(Student.refunded == True).scalar() or 0
+    # ✅ Money totals are the ledger's running balances (net collected / refunded)
+    totals = ledger_totals()
+    total_amount_collected = totals['collected']
+    total_amount_refunded = totals['refunded']
 
     # Semester-wise counts
     sem_counts = {}
@@ -617,12 +3240,18 @@ def dashboard_data():
             .filter(Student.semester == sem).scalar() or 0
         sem_counts[f"Sem{sem}"] = count
 
-    # ✅ Data for charts (flat arrays)
-    total_students_values = [total_students] * 7
-    paid_not_refunded_values = [paid_not_refunded] * 7
-    total_amount_collected_values = [total_amount_collected] * 7
-    refunded_count_values = [refunded_count] * 7
-    total_amount_refunded_values = [total_amount_refunded] * 7
+    # ✅ Data for charts: per-day values for the last 7 days
+    today = bucket_floor(datetime.utcnow(), 'day')
+    week = timeseries('day', today - timedelta(days=6), today + timedelta(days=1))
+    total_students_values = week['registrations']
+    # Paid, not-refunded students at the end of each day, like the card above
+    # it: walk back from today's count by each day's registrations minus refunds
+    paid_not_refunded_values = [paid_not_refunded]
+    for registered, refunded in zip(week['registrations'][:0:-1], week['refunds'][:0:-1]):
+        paid_not_refunded_values.insert(0, paid_not_refunded_values[0] - registered + refunded)
+    total_amount_collected_values = week['revenue']
+    refunded_count_values = week['refunds']
+    total_amount_refunded_values = week['refunded_amount']
 
     return jsonify({
         "total_students": total_students,
@@ -639,10 +3268,74 @@ def dashboard_data():
     })
 
 
+# Registrations / revenue / refunds / check-ins per hour or day
+@app.route('/timeseries')
+@reads_snapshot
+def timeseries_data():
+    if not admin_required():
+        return jsonify({"error": "login required"}), 401
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in TIMESERIES_BUCKETS:
+        return jsonify({"error": "bucket must be hour or day"}), 400
+    _, width, window = TIMESERIES_BUCKETS[bucket]
+    # unparseable start/end fall back to the default window
+    end = request.args.get('end', type=parse_utc) or bucket_floor(datetime.utcnow(), bucket) + width
+    start = request.args.get('start', type=parse_utc) or end - window * width
+    return jsonify({"bucket": bucket, **timeseries(bucket, start, end)})
+
+# Event-day gate load: check-ins per minute per gate and time to clear
+@app.route('/admin/gates')
+def gate_analytics():
+    if not admin_required():
+        return jsonify({"error": "login required"}), 401
+    window = request.args.get('window', type=int)
+    if window is not None:
+        window = max(1, min(window, app.config['GATE_WINDOW_MINUTES']))
+    return jsonify(gate_throughput(window_minutes=window))
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+def admin_profiles():
+    if not admin_required():
+        return redirect(url_for('admin_login'))
+    endpoints = sorted(e for e in app.view_functions if e != 'static')
+    if request.method == 'POST':
+        if request.form.get('action') == 'disarm':
+            profile_arm.disarm()
+            flash("Profiling disarmed.", "info")
+        elif request.form.get('endpoint') not in endpoints:
+            flash("Unknown route.", "danger")
+        else:
+            count = max(1, min(request.form.get('count', 1, type=int), app.config['PROFILE_MAX_REQUESTS']))
+            profile_arm.arm(request.form['endpoint'], count)
+            flash(f"Profiling the next {count} request(s) to {request.form['endpoint']}.", "success")
+        return redirect(url_for('admin_profiles'))
+    return render_template('admin_profiles.html', endpoints=endpoints, armed=profile_arm.state(),
+                           profiles=list_profiles(), max_requests=app.config['PROFILE_MAX_REQUESTS'])
+
+@app.route('/admin/profiles/<name>')
+def download_profile(name):
+    if not admin_required():
+        return redirect(url_for('admin_login'))
+    if not PROFILE_NAME.match(name):
+        return "Not found", 404
+    path = os.path.join(app.config['PROFILE_DIR'], name)
+    if not os.path.exists(path):
+        return "Not found", 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
+@app.route('/admin/ledger')
+def ledger_report():
+    """Ledger totals plus the reconciliation findings (empty when it all agrees)."""
+    if not admin_required():
+        return jsonify({"error": "login required"}), 401
+    issues = reconcile_ledger()
+    return jsonify({"totals": ledger_totals(), "issues": issues, "ok": not issues})
+
 # --------------------------------------
 # 3. Chart Data API (Semester-wise Students)
 # --------------------------------------
 @app.route('/chart_data')
+@reads_snapshot
 def chart_data():
     try:
         # Semester-wise students & family members
@@ -681,8 +3374,8 @@ def chart_data():
             "legend_family": "Family Members per Semester"
         })
 
-    except Exception as e:
-        print("Chart data error:", e)
+    except Exception:
+        log.exception('chart_data.failed')
         return jsonify({
             "labels": [],
             "students": [],
@@ -693,9 +3386,145 @@ def chart_data():
         })
 
 # ---------------- Init & Run ----------------
+def _add_missing_columns():
+    """ALTER TABLE ... ADD COLUMN for model columns an older database doesn't have yet."""
+    with db.engine.begin() as conn:
+        # inspect on the same connection that alters, so it sees the live schema
+        inspector = sa_inspect(conn)
+        for table in db.metadata.sorted_tables:
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+def backfill_normalized_contacts(batch_size=1000):
+    """
+    Fill email_normalized / mobile_e164 on rows written before those columns
+    existed, in id-ordered batches. If two old rows normalize to the same value
+    the older one keeps it and the newer one is left NULL (and reported), so the
+    unique indexes can still be built. Returns the number of rows updated.
+    """
+    missing = (Student.email_normalized.is_(None) & (func.coalesce(Student.email, '') != '')) | \
+              (Student.mobile_e164.is_(None) & (func.coalesce(Student.mobile_number, '') != ''))
+    if not db.session.query(Student.id).filter(missing).first():
+        return 0
+
+    seen_emails = set(db.session.scalars(
+        db.select(Student.email_normalized).where(Student.email_normalized.is_not(None))))
+    seen_mobiles = set(db.session.scalars(
+        db.select(Student.mobile_e164).where(Student.mobile_e164.is_not(None))))
+    updated, last_id = 0, 0
+    while True:
+        rows = db.session.execute(
+            db.select(Student.id, Student.email, Student.mobile_number, Student.email_normalized, Student.mobile_e164)
+            .where(Student.id > last_id, missing).order_by(Student.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        changes = []
+        for row in rows:
+            email = row.email_normalized or normalize_email(row.email) or None
+            mobile = row.mobile_e164 or normalize_mobile(row.mobile_number) or None
+            if not row.email_normalized and email:
+                if email in seen_emails:
+                    log.warning('contacts.duplicate_email', extra={'student_id': row.id})
+                    email = None
+                else:
+                    seen_emails.add(email)
+            if not row.mobile_e164 and mobile:
+                if mobile in seen_mobiles:
+                    log.warning('contacts.duplicate_mobile', extra={'student_id': row.id})
+                    mobile = None
+                else:
+                    seen_mobiles.add(mobile)
+            changes.append({'id': row.id, 'email_normalized': email, 'mobile_e164': mobile})
+        db.session.execute(update(Student), changes)
+        db.session.commit()
+        updated += len(changes)
+        last_id = rows[-1].id
+    return updated
+
+def backfill_waitlist_contacts():
+    """
+    Fill email_normalized / mobile_e164 on waiting entries queued before those
+    columns existed. The queue is short, so one pass. Returns the number updated.
+    """
+    entries = WaitlistEntry.query.filter(
+        WaitlistEntry.status == 'waiting',
+        WaitlistEntry.email_normalized.is_(None) | WaitlistEntry.mobile_e164.is_(None)).all()
+    for entry in entries:
+        entry.email_normalized = normalize_email(entry.email) or None
+        entry.mobile_e164 = normalize_mobile(entry.mobile_number) or None
+    db.session.commit()
+    return len(entries)
+
+def _unique_index_conflicts(conn, index):
+    """How many values already occur on more than one row of a unique index's columns."""
+    columns = [column.name for column in index.columns]
+    conditions = [f'{column} IS NOT NULL' for column in columns]
+    partial = index.dialect_options['sqlite']['where']
+    if partial is not None:
+        conditions.append(str(partial))
+    return conn.execute(db.text(
+        f"SELECT count(*) FROM (SELECT 1 FROM {index.table.name} WHERE {' AND '.join(conditions)} "
+        f"GROUP BY {', '.join(columns)} HAVING count(*) > 1)")).scalar()
+
+@contextmanager
+def migration_lock():
+    """
+    Serialize init_db() across processes: every gunicorn worker imports the
+    app at once, and concurrent CREATE TABLE / ALTER TABLE / seed inserts on
+    one SQLite file fail in all but the first. An flock on a file next to
+    the database; a no-op for in-memory or non-SQLite databases.
+    """
+    url = db.engine.url
+    if fcntl is None or url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        yield
+        return
+    with open(url.database + '.init-lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def init_db():
+    """Create / migrate tables, columns and indexes. Safe to run on every start."""
+    db.create_all()
+    _add_missing_columns()
+    backfill_normalized_contacts()
+    backfill_waitlist_contacts()
+    for name in ('ix_student_email_key', 'ix_student_mobile_key'):
+        # expression indexes superseded by the stored normalized columns
+        db.session.execute(db.text(f'DROP INDEX IF EXISTS {name}'))
+    db.session.commit()
+    # create_all() skips indexes on tables that already exist (and reflection
+    # can't see expression indexes), so let the database do the existence check
+    with db.engine.begin() as conn:
+        existing = set(conn.execute(db.text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.unique and index.name not in existing:
+                    duplicates = _unique_index_conflicts(conn, index)
+                    if duplicates:
+                        # building it would fail (and take the app down with it);
+                        # retried on every start until the rows are cleaned up
+                        log.warning('db.unique_index_skipped', extra={
+                            'index': index.name, 'duplicate_values': duplicates})
+                        continue
+                conn.execute(CreateIndex(index, if_not_exists=True))
+    sync_student_fts()
+    sync_event_capacity()
+    if sync_ledger_accounts():
+        # first start with the ledger: post what earlier registrations paid
+        backfill_ledger()
+
+# Run at import too, so gunicorn workers get new tables without a manual step
+with app.app_context(), migration_lock():
+    init_db()
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
     app.run(debug=True)
 
         
@@ -0,0 +1,78 @@
+# benchmarks/_common.py
+"""Shared setup for the benchmark scripts: a throwaway database and the app."""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(db_path=None, **env):
+    """
+    Import app.py against a scratch SQLite file and return the module.
+    Extra keyword arguments are exported as environment variables first.
+    """
+    workdir = tempfile.mkdtemp(prefix="campusconnect-bench-")
+    db_path = db_path or os.path.join(workdir, "bench.db")
+    os.environ.setdefault("RAZORPAY_KEY_ID", "rzp_test_dummy")
+    os.environ.setdefault("RAZORPAY_KEY_SECRET", "dummy_secret")
+    os.environ["DATABASE_URI"] = "sqlite:///" + db_path
+    os.environ.pop("TWILIO_SID", None)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")  # no per-request log lines in the timings
+    for key, value in env.items():
+        os.environ[key] = str(value)
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    # Artifacts (QR codes, PDFs, CSVs) are written relative to the cwd.
+    os.chdir(workdir)
+    import app as campus
+
+    with campus.app.app_context():
+        campus.db.create_all()
+    return campus
+
+
+def seed_students(campus, count, attended=False):
+    """
+    Insert `count` paid registrants and return their unique IDs. Numbering
+    continues from the rows already present, so repeated calls don't collide
+    on the unique email / mobile columns.
+    """
+    with campus.app.app_context():
+        start = campus.db.session.query(campus.Student).count()
+    uids = [f"MSCCAIT2025-{uuid.uuid4().hex[:12]}" for _ in range(count)]
+    rows = [
+        dict(unique_id=uid, name=f"Student {i}", email=f"s{i}@example.com",
+             email_normalized=f"s{i}@example.com",
+             semester=(i % 6) + 1, mobile_number=str(9000000000 + i),
+             mobile_e164=f"+91{9000000000 + i}",
+             family_members=i % 3, attended=attended, payment_status="Paid",
+             refunded=False)
+        for i, uid in enumerate(uids, start)
+    ]
+    with campus.app.app_context():
+        campus.db.session.execute(campus.Student.__table__.insert(), rows)
+        campus.db.session.commit()
+    return uids
+
+
+def seed_synthetic(campus, count, **options):
+    """
+    Insert `count` registrants with realistic mixes (semesters, families,
+    refunds, check-ins, ledger postings) and return their unique IDs; see
+    synthetic.populate for the options.
+    """
+    from synthetic import populate
+    return populate(campus, count, **options)
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
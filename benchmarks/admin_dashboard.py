@@ -0,0 +1,61 @@
+# benchmarks/admin_dashboard.py
+"""
+Admin dashboard page time as the registrant table grows.
+
+Compares the grouped aggregate behind /admin-dashboard with the old
+load-every-Student-and-count-in-Python approach at each table size.
+
+    python benchmarks/admin_dashboard.py --sizes 1000 10000 100000 --repeat 5
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import Timer, load_app, seed_synthetic  # noqa: E402
+
+
+def python_side_counts(campus):
+    """What the dashboard used to do: hydrate every row, then 14 passes."""
+    students = campus.Student.query.all()
+    stats = {"present": sum(1 for s in students if s.attended),
+             "absent": sum(1 for s in students if not s.attended)}
+    for sem in range(1, 7):
+        stats[sem] = (sum(1 for s in students if s.semester == sem and s.attended),
+                      sum(1 for s in students if s.semester == sem and not s.attended))
+    return stats
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        with Timer() as t:
+            fn()
+        times.append(t.elapsed * 1000)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    campus = load_app()
+    client = campus.app.test_client()
+    with client.session_transaction() as sess:
+        sess["admin_logged_in"] = True
+
+    print(f"{'rows':>8}{'page ms':>12}{'python-side ms':>16}")
+    rows = 0
+    for size in sorted(args.sizes):
+        seed_synthetic(campus, size - rows, seed=size)
+        rows = size
+        page = best_of(args.repeat, lambda: client.get("/admin-dashboard"))
+        with campus.app.app_context():
+            old = best_of(args.repeat, lambda: python_side_counts(campus))
+        print(f"{rows:>8}{page:>12.2f}{old:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# benchmarks/admin_search.py
+"""
+Admin autocomplete latency: FTS5 prefix search over a large registrant table.
+
+Compares /admin/search against the LIKE '%term%' scan it replaces.
+
+    python benchmarks/admin_search.py --rows 100000 --queries 200
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import Timer, load_app, seed_students  # noqa: E402
+
+
+def like_scan(campus, term, limit):
+    like = f"%{term}%"
+    Student = campus.Student
+    return Student.query.filter(campus.or_(
+        Student.name.ilike(like), Student.email.ilike(like),
+        Student.mobile_number.like(like), Student.unique_id.ilike(like),
+    )).limit(limit).all()
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    campus = load_app()
+    with Timer() as t:
+        uids = seed_students(campus, args.rows)
+    print(f"seeded {args.rows} rows in {t.elapsed:.1f}s (FTS kept in sync by triggers)")
+
+    rng = random.Random(42)
+    terms = []
+    for _ in range(args.queries):
+        i = rng.randrange(args.rows)
+        terms.append(rng.choice([f"Student {i}"[:10], f"s{i}@"[:5], str(9000000000 + i)[:6], uids[i][12:16]]))
+
+    client = campus.app.test_client()
+    with client.session_transaction() as sess:
+        sess["admin_logged_in"] = True
+
+    results = {}
+    for label, run in (("fts5 /admin/search", lambda q: client.get("/admin/search", query_string={"q": q, "limit": args.limit})),
+                       ("LIKE scan", lambda q: like_scan(campus, q, args.limit))):
+        samples = []
+        with campus.app.app_context():
+            for q in terms:
+                with Timer() as t:
+                    run(q)
+                samples.append(t.elapsed * 1000)
+        results[label] = samples
+
+    print(f"{'mode':<22}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for label, samples in results.items():
+        print(f"{label:<22}{percentile(samples, 50):>10.2f}{percentile(samples, 95):>10.2f}{max(samples):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# benchmarks/admin_streaming.py
+"""
+Admin panel time-to-first-byte and peak memory: streamed vs fully rendered.
+
+    python benchmarks/admin_streaming.py --rows 100000
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import Timer, load_app, seed_students  # noqa: E402
+
+
+def fetch(client):
+    """Return (seconds to first chunk, total seconds, bytes, peak traced bytes)."""
+    tracemalloc.start()
+    with Timer() as total:
+        with Timer() as first:
+            resp = client.get("/admin")
+            chunks = iter(resp.response)
+            size = len(next(chunks))
+        size += sum(len(chunk) for chunk in chunks)
+        resp.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first.elapsed, total.elapsed, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    campus = load_app()
+    seed_students(campus, args.rows)
+    client = campus.app.test_client()
+    with client.session_transaction() as sess:
+        sess["admin_logged_in"] = True
+
+    streamed = fetch(client)
+    # the pre-streaming behaviour: render the whole page into one string
+    with mock.patch.object(campus, "stream_page", campus.render_template):
+        rendered = fetch(client)
+
+    print(f"{'mode':<12}{'TTFB ms':>10}{'total s':>10}{'MiB sent':>10}{'peak MiB':>10}")
+    for label, (ttfb, total, size, peak) in (("rendered", rendered), ("streamed", streamed)):
+        print(f"{label:<12}{ttfb * 1000:>10.1f}{total:>10.2f}{size / 2**20:>10.1f}{peak / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
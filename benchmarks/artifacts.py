@@ -0,0 +1,237 @@
+# benchmarks/artifacts.py
+"""
+Artifact generation and export paths at 1k / 10k / 100k registrants.
+
+Covers generate_qr_code, generate_pdf, append_to_csv (per call, --samples
+calls), update_attendance_in_csv (one scan against an N-row file, --scans
+times), _clean_csv (an N-row file) and the export_csv / export_pdf views
+(N students). Each case runs in forked children so its peak RSS is its own:
+--repeat children for wall time (the fastest counts) and RSS (which starts from the parent's resident
+set: the imported app plus the seeded uids), a second under tracemalloc for
+the peak Python allocation.
+
+export_pdf grows faster than linearly (reportlab re-splits the one big table
+for every page), so it is skipped above --pdf-max-rows.
+
+Results are compared with benchmarks/baselines/artifacts-<N>.json; the run
+exits 1 when a case is more than --threshold slower or allocates that much
+more. --update-baseline rewrites the files instead.
+
+    python benchmarks/artifacts.py --sizes 1000 10000 100000
+    python benchmarks/artifacts.py --sizes 1000 --update-baseline
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import Timer, load_app, seed_students  # noqa: E402
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS = 0.02
+MIN_ALLOC_MIB = 0.5
+
+
+def write_registrations(path, uids):
+    """An N-row registrations.csv in the layout update_attendance_in_csv reads."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Name", "Email", "Semester", "Mobile No", "Unique ID", "Payment Status", "Attendance"])
+        writer.writerows([f"Student {i}", f"s{i}@example.com", i % 6 + 1, 9000000000 + i, uid, "Paid", "Absent"]
+                         for i, uid in enumerate(uids))
+
+
+def write_appended(campus, uids):
+    """An N-row static/csv/registrations.csv as append_to_csv leaves it."""
+    path = os.path.join("static", "csv", "registrations.csv")
+    if os.path.exists(path):
+        os.remove(path)
+    campus.append_to_csv("Student 0", "s0@example.com", 1, uids[0], "9000000000", 0, 100)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([f"Student {i}", f"s{i}@example.com", i % 6 + 1, 9000000000 + i, i % 3,
+                                 100, uid, None, f"pay_{i}", "Paid"] for i, uid in enumerate(uids[1:], 1))
+    return path
+
+
+# Each case does its (untimed) setup and returns (callable to measure, operations).
+
+def case_generate_qr_code(campus, uids, args):
+    sample = uids[:args.samples]
+    return lambda: [campus.generate_qr_code(uid) for uid in sample], len(sample)
+
+
+def case_generate_pdf(campus, uids, args):
+    sample = uids[:args.samples]
+    return lambda: [campus.generate_pdf(f"Student {i}", f"s{i}@example.com", i % 6 + 1, uid, i % 3, 100,
+                                        upi_id="student@upi", transaction_id=f"pay_{i}")
+                    for i, uid in enumerate(sample)], len(sample)
+
+
+def case_append_to_csv(campus, uids, args):
+    write_appended(campus, uids)
+    sample = uids[:args.samples]
+    return lambda: [campus.append_to_csv(f"Student {i}", f"s{i}@example.com", i % 6 + 1, uid,
+                                         str(9000000000 + i), i % 3, 100, None, f"pay_{i}", "Paid")
+                    for i, uid in enumerate(sample)], len(sample)
+
+
+def case_update_attendance_in_csv(campus, uids, args):
+    write_registrations(campus.CSV_PATH, uids)
+    step = max(len(uids) // args.scans, 1)
+    sample = uids[::step][:args.scans]
+    return lambda: [campus.update_attendance_in_csv(uid) for uid in sample], len(sample)
+
+
+def case_clean_csv(campus, uids, args):
+    path = write_appended(campus, uids)
+    return lambda: campus._clean_csv(path), 1
+
+
+def _export(campus, view):
+    # The export views write under app.root_path; keep that inside the scratch dir.
+    with mock.patch.object(campus.app, "root_path", os.getcwd()), campus.app.test_request_context():
+        view().close()
+        campus.db.session.remove()
+
+
+def case_export_csv(campus, uids, args):
+    return lambda: _export(campus, campus.export_csv), 1
+
+
+def case_export_pdf(campus, uids, args):
+    return lambda: _export(campus, campus.export_pdf), 1
+
+
+CASES = {name[len("case_"):]: fn for name, fn in globals().items() if name.startswith("case_")}
+
+
+def run_in_child(fn, *args):
+    """Run fn(*args) in a forked child; return (its JSON result, child's peak RSS in MiB)."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            payload = json.dumps(fn(*args)).encode()
+        except BaseException as exc:  # report, don't unwind into the parent's code
+            payload, status = json.dumps({"error": repr(exc)}).encode(), 1
+        with os.fdopen(write_fd, "wb") as out:
+            out.write(payload)
+        os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as src:
+        result = json.loads(src.read() or b"{}")
+    _, _, usage = os.wait4(pid, 0)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = usage.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    if "error" in result:
+        raise SystemExit(f"case failed: {result['error']}")
+    return result, rss
+
+
+def _timed(campus, case, uids, args):
+    with campus.app.app_context():
+        campus.db.engine.dispose(close=False)  # don't share the parent's SQLite connections
+        fn, ops = case(campus, uids, args)
+        with Timer() as t:
+            fn()
+    return {"seconds": t.elapsed, "ops": ops}
+
+
+def _traced(campus, case, uids, args):
+    with campus.app.app_context():
+        campus.db.engine.dispose(close=False)
+        fn, _ = case(campus, uids, args)
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"alloc_peak_mib": peak / 2**20}
+
+
+def measure(campus, name, uids, args):
+    runs = [run_in_child(_timed, campus, CASES[name], uids, args) for _ in range(args.repeat)]
+    timed = min((r for r, _ in runs), key=lambda r: r["seconds"])
+    rss = max(rss for _, rss in runs)
+    traced, _ = run_in_child(_traced, campus, CASES[name], uids, args)
+    return {"seconds": round(timed["seconds"], 4), "ops": timed["ops"],
+            "us_per_op": round(timed["seconds"] / timed["ops"] * 1e6, 1),
+            "alloc_peak_mib": round(traced["alloc_peak_mib"], 2), "rss_peak_mib": round(rss, 1)}
+
+
+def regressions(baseline, results, threshold):
+    """(case, metric, old, new) for every case worse than the baseline by more than threshold."""
+    found = []
+    for name, new in results.items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            continue
+        # per-op time, so a different --samples / --scans still compares
+        if new["seconds"] - old["seconds"] > MIN_SECONDS and new["us_per_op"] > old["us_per_op"] * (1 + threshold):
+            found.append((name, "us_per_op", old["us_per_op"], new["us_per_op"]))
+        if (new["alloc_peak_mib"] - old["alloc_peak_mib"] > MIN_ALLOC_MIB
+                and new["alloc_peak_mib"] > old["alloc_peak_mib"] * (1 + threshold)):
+            found.append((name, "alloc_peak_mib", old["alloc_peak_mib"], new["alloc_peak_mib"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--samples", type=int, default=200, help="calls for the per-registrant cases")
+    parser.add_argument("--scans", type=int, default=5, help="update_attendance_in_csv calls per size")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case; the fastest is kept")
+    parser.add_argument("--pdf-max-rows", type=int, default=10000, help="largest size to run export_pdf at")
+    parser.add_argument("--threshold", type=float, default=0.3, help="allowed slowdown / growth, 0.3 = 30%%")
+    parser.add_argument("--baseline-dir", default=BASELINE_DIR)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    campus = load_app(LOG_LEVEL="ERROR")  # the bulk seeding trips the slow-query log
+    uids = []
+    failed = []
+    for size in sorted(args.sizes):
+        uids += seed_students(campus, size - len(uids))
+        print(f"\n{size} registrants")
+        print(f"{'case':<26}{'ops':>6}{'seconds':>10}{'µs/op':>12}{'alloc MiB':>11}{'RSS MiB':>9}")
+        results = {}
+        for name in args.cases:
+            if name == "export_pdf" and size > args.pdf_max_rows:
+                print(f"{name:<26}  skipped above --pdf-max-rows {args.pdf_max_rows}")
+                continue
+            r = results[name] = measure(campus, name, uids, args)
+            print(f"{name:<26}{r['ops']:>6}{r['seconds']:>10.3f}{r['us_per_op']:>12.1f}"
+                  f"{r['alloc_peak_mib']:>11.2f}{r['rss_peak_mib']:>9.1f}")
+
+        path = os.path.join(args.baseline_dir, f"artifacts-{size}.json")
+        if args.update_baseline:
+            os.makedirs(args.baseline_dir, exist_ok=True)
+            meta = {"size": size, "samples": args.samples, "scans": args.scans,
+                    "python": platform.python_version(), "machine": platform.machine(),
+                    "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+            with open(path, "w") as f:
+                json.dump({"meta": meta, "cases": results}, f, indent=2)
+                f.write("\n")
+            print(f"baseline written: {path}")
+        elif os.path.exists(path):
+            with open(path) as f:
+                baseline = json.load(f)
+            for name, metric, old, new in regressions(baseline, results, args.threshold):
+                print(f"REGRESSION {name} {metric}: {old} -> {new}")
+                failed.append((size, name))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
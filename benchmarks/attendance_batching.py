@@ -0,0 +1,65 @@
+# benchmarks/attendance_batching.py
+"""
+Gate-opening burst: many scanner threads hitting /verify at once.
+
+Compares the one-commit-per-scan path against the batched writer.
+
+    python benchmarks/attendance_batching.py --scans 2000 --threads 32
+"""
+import argparse
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import Timer, load_app, seed_students  # noqa: E402
+
+
+def run(campus, uids, threads):
+    chunks = [uids[i::threads] for i in range(threads)]
+    errors = []
+
+    def worker(chunk):
+        client = campus.app.test_client()
+        for uid in chunk:
+            resp = client.get(f"/verify/{uid}")
+            if resp.status_code != 200 or b"Attendance marked" not in resp.data:
+                errors.append(uid)
+
+    pool = [threading.Thread(target=worker, args=(c,)) for c in chunks]
+    with Timer() as t:
+        for th in pool:
+            th.start()
+        for th in pool:
+            th.join()
+    return t.elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scans", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    campus = load_app(ATTENDANCE_BATCH_MAX=args.max_batch,
+                      ATTENDANCE_BATCH_WAIT_MS=args.max_wait_ms)
+    uids = seed_students(campus, args.scans * 2)
+    baseline_uids, batched_uids = uids[:args.scans], uids[args.scans:]
+
+    campus.app.config["ATTENDANCE_BATCHING"] = False
+    base_time, base_err = run(campus, baseline_uids, args.threads)
+
+    campus.app.config["ATTENDANCE_BATCHING"] = True
+    batch_time, batch_err = run(campus, batched_uids, args.threads)
+
+    print(f"{'mode':<22}{'scans/s':>10}{'total s':>10}{'errors':>8}")
+    print(f"{'commit per scan':<22}{args.scans / base_time:>10.0f}{base_time:>10.2f}{base_err:>8}")
+    print(f"{'batched':<22}{args.scans / batch_time:>10.0f}{batch_time:>10.2f}{batch_err:>8}")
+    print(f"speed-up: {base_time / batch_time:.1f}x "
+          f"(max_batch={args.max_batch}, max_wait_ms={args.max_wait_ms})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# benchmarks/metrics_overhead.py
+"""
+Per-request cost of the /metrics instrumentation.
+
+Times the before/after/teardown hooks for one request (in-flight gauge,
+status counter, latency histogram, DB counters) and the pair of SQLAlchemy
+cursor events wrapped around every statement.
+
+    python benchmarks/metrics_overhead.py --requests 100000
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import Timer, load_app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=100000)
+    args = parser.parse_args()
+
+    campus = load_app(METRICS_DIR=os.path.join(os.getcwd(), "metrics"))
+    response = campus.app.response_class("ok")
+    conn = type("Conn", (), {"info": {}})()
+
+    with campus.app.test_request_context("/check-availability"):
+        campus.app.preprocess_request()  # warm: opens this worker's metrics file
+        campus._finish_request_metrics(None)
+        with Timer() as hooks:
+            for _ in range(args.requests):
+                campus._start_request_metrics()
+                campus._record_response_status(response)
+                campus._finish_request_metrics(None)
+        campus._start_request_metrics()
+        with Timer() as query_events:
+            for _ in range(args.requests):
+                campus._query_started(conn, None, "SELECT 1", (), None, False)
+                campus._query_finished(conn, None, "SELECT 1", (), None, False)
+
+    print(f"{'request hooks':<22}{hooks.elapsed / args.requests * 1e6:>8.2f} µs/request")
+    print(f"{'query events':<22}{query_events.elapsed / args.requests * 1e6:>8.2f} µs/statement")
+    print(f"series in this worker's file: {len(campus.metrics._mine()._offsets)}")
+
+
+if __name__ == "__main__":
+    main()
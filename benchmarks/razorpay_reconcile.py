@@ -0,0 +1,78 @@
+# benchmarks/razorpay_reconcile.py
+"""
+Razorpay reconciliation over a large range against a latency-injecting stub.
+
+Each list call sleeps --latency-ms to stand in for the round trip to
+Razorpay; the local table holds a matching Student for every payment.
+Compares one worker (sequential paging) with the bounded pool.
+
+    python benchmarks/razorpay_reconcile.py --payments 20000 --workers 1 8 16
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import Timer, load_app, seed_students  # noqa: E402
+
+
+class SlowRazorpay:
+    """Just the list endpoints, with Razorpay's from/to/count/skip paging."""
+
+    def __init__(self, payments, latency):
+        self.latency = latency
+        self.calls = 0
+        self.payments = sorted(payments, key=lambda p: p["created_at"], reverse=True)
+        self.payment = mock.Mock(all=self._list)
+        self.refund = mock.Mock(all=lambda params: self._page([], params))
+
+    def _list(self, params):
+        return self._page(self.payments, params)
+
+    def _page(self, items, params):
+        self.calls += 1
+        time.sleep(self.latency)
+        matching = [p for p in items if params["from"] <= p["created_at"] <= params["to"]]
+        page = matching[params["skip"]:params["skip"] + params["count"]]
+        return {"entity": "collection", "count": len(page), "items": page}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--payments", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--latency-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    campus = load_app()
+    uids = seed_students(campus, args.payments)
+    end = datetime.utcnow().replace(microsecond=0)
+    start = end - timedelta(days=args.days)
+    step = args.days * 86400 / args.payments
+    payments = []
+    with campus.app.app_context():
+        for i, uid in enumerate(uids):
+            created = end - timedelta(seconds=i * step)
+            campus.Student.query.filter_by(unique_id=uid).update(
+                {"transaction_id": f"pay_{i}", "razorpay_order_id": f"order_{i}", "created_at": created})
+            payments.append({"id": f"pay_{i}", "order_id": f"order_{i}", "amount": 10000,
+                             "status": "captured",
+                             "created_at": int(created.replace(tzinfo=timezone.utc).timestamp())})
+        campus.db.session.commit()
+
+    print(f"{args.payments} payments over {args.days} days, {args.latency_ms:g} ms per list call")
+    print(f"{'workers':>8}{'calls':>8}{'total s':>10}{'differences':>13}")
+    for workers in args.workers:
+        stub = SlowRazorpay(payments, args.latency_ms / 1000)
+        with campus.app.app_context(), mock.patch.object(campus, "razorpay_client", stub), Timer() as t:
+            report = campus.reconcile_razorpay(start, end, workers=workers)
+        differences = sum(len(v) for v in report.values())
+        print(f"{workers:>8}{stub.calls:>8}{t.elapsed:>10.2f}{differences:>13}")
+
+
+if __name__ == "__main__":
+    main()
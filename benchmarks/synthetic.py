@@ -0,0 +1,226 @@
+# benchmarks/synthetic.py
+"""
+Synthetic registrants for benchmarks and capacity planning.
+
+Fills a database with N registrations shaped like a real event: more
+first-years than final-years, mostly solo registrants with some families,
+registrations ramping up towards the event, semester-1 refunds, and gate
+check-ins bunched at opening. Each student gets the ledger postings and
+attendance log rows the app would have written, so dashboards, exports,
+reconciliation and search all see consistent data.
+
+Rows go in with batched executemany inside one transaction. The secondary
+indexes and search triggers are dropped for the load and rebuilt by the
+app's init_db() afterwards. --csv also writes the matching
+static/csv/registrations.csv.
+
+    python benchmarks/synthetic.py --db students.db --rows 1000000 --csv static/csv/registrations.csv
+"""
+import argparse
+import csv
+import heapq
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SEMESTER_WEIGHTS = {1: 30, 2: 20, 3: 17, 4: 14, 5: 11, 6: 8}
+FAMILY_WEIGHTS = {0: 45, 1: 30, 2: 15, 3: 7, 4: 3}
+GATE_WEIGHTS = {"North": 40, "South": 30, "East": 20, "West": 10}
+FIRST_NAMES = ("Aarav", "Aditi", "Aman", "Ananya", "Arjun", "Diya", "Ishaan", "Kavya", "Meera", "Neha",
+               "Nikhil", "Pooja", "Priya", "Rahul", "Riya", "Rohan", "Sanya", "Siddharth", "Sneha", "Vikram")
+LAST_NAMES = ("Agarwal", "Bose", "Chatterjee", "Das", "Gupta", "Iyer", "Jain", "Kumar", "Mehta", "Nair",
+              "Nayak", "Patel", "Rao", "Reddy", "Sharma", "Singh", "Verma")
+UPI_HANDLES = ("okaxis", "oksbi", "okhdfcbank", "ybl", "paytm")
+STUDENT_COLUMNS = ("id", "unique_id", "name", "email", "semester", "mobile_number", "family_members",
+                   "attended", "upi_id", "transaction_id", "razorpay_order_id", "payment_status", "refund_id",
+                   "refunded", "email_normalized", "mobile_e164", "created_at", "attended_at", "refunded_at")
+LEDGER_COLUMNS = ("reference", "kind", "account", "amount", "balance_after", "student_id", "created_at")
+LOG_COLUMNS = ("student_id", "gate", "marked_at")
+
+
+def _insert(table, columns):
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+def populate(campus, count, seed=0, days=30, end=None, attend_rate=0.8, refund_rate=0.02,
+             sem1_refund_rate=0.6, batch_size=50000, csv_path=None):
+    """
+    Insert `count` synthetic registrations into campus's database and return
+    their unique IDs. Numbering continues after the rows already there.
+    `end` is when the event's gates close (default now, UTC); registration
+    runs for `days` before the last six hours, which are the event itself.
+    """
+    rng = random.Random(seed)
+    end = end or datetime.utcnow().replace(microsecond=0)
+    event_start = end - timedelta(hours=6)
+    reg_start = event_start - timedelta(days=days)
+    reg_span = (event_start - reg_start).total_seconds()
+    price = campus.TICKET_PRICE_PAISE
+    with campus.app.app_context():
+        db_path = campus.db.engine.url.database
+        campus.db.session.remove()
+        campus.db.engine.dispose()
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-200000")
+    first_id = (conn.execute("SELECT max(id) FROM student").fetchone()[0] or 0) + 1
+    balances = dict(conn.execute("SELECT name, balance FROM ledger_account"))
+    dropped = conn.execute(
+        "SELECT name FROM sqlite_master WHERE sql IS NOT NULL AND ("
+        " (type = 'index' AND tbl_name IN ('student', 'ledger_entry', 'attendance_log'))"
+        " OR (type = 'trigger' AND tbl_name = 'student'))").fetchall()
+
+    semesters, sem_weights = zip(*SEMESTER_WEIGHTS.items())
+    families, family_weights = zip(*FAMILY_WEIGHTS.items())
+    gates, gate_weights = zip(*GATE_WEIGHTS.items())
+    csv_file = csv_writer = None
+    if csv_path:
+        os.makedirs(os.path.dirname(csv_path) or ".", exist_ok=True)
+        new_file = not os.path.exists(csv_path)
+        csv_file = open(csv_path, "a", newline="", encoding="utf-8")
+        csv_writer = csv.writer(csv_file)
+        if new_file:
+            csv_writer.writerow(["Name", "Email", "Semester", "Mobile No", "Family Members",
+                                 "Total Amount (₹)", "Unique ID", "UPI ID", "Transaction ID", "Payment Status"])
+
+    cash, revenue, refunded_total = (balances.get(name, 0) for name in ("razorpay", "ticket_revenue", "refunds"))
+    charges = refunds_posted = 0
+
+    def post_refunds(until):
+        """Post the refunds issued up to `until`: (refunds +, razorpay -) legs."""
+        nonlocal cash, refunded_total, refunds_posted
+        while refunds and refunds[0][0] <= until:
+            offset, refund_id, sid, amount = heapq.heappop(refunds)
+            at = str(reg_start + timedelta(seconds=offset))
+            refunded_total += amount
+            cash -= amount
+            refunds_posted += 1
+            ledger.append((refund_id, "refund", "refunds", amount, refunded_total, sid, at))
+            ledger.append((refund_id, "refund", "razorpay", -amount, cash, sid, at))
+
+    lower = {name: name.lower() for name in FIRST_NAMES + LAST_NAMES}
+    event_offset = reg_span
+    end_offset = (end - reg_start).total_seconds()
+    uids, refunds = [], []  # refunds: heap of (seconds after reg_start, ...) still to post
+    conn.execute("BEGIN")
+    try:
+        for name, in dropped:
+            kind = "TRIGGER" if name.startswith("student_fts_") else "INDEX"
+            conn.execute(f"DROP {kind} IF EXISTS {name}")
+        for lo in range(0, count, batch_size):
+            size = min(batch_size, count - lo)
+            students, ledger, logs = [], [], []
+            # one draw per batch and column is far cheaper than per row
+            picks = zip(range(lo, lo + size),
+                        rng.choices(semesters, sem_weights, k=size), rng.choices(families, family_weights, k=size),
+                        rng.choices(FIRST_NAMES, k=size), rng.choices(LAST_NAMES, k=size),
+                        rng.choices(gates, gate_weights, k=size), rng.choices(UPI_HANDLES, k=size))
+            random_ = rng.random
+            for i, semester, family, first, last, gate, handle in picks:
+                sid = first_id + i
+                n = sid - 1
+                # stratified, then sqrt: sorted times, denser towards the event
+                created = reg_span * ((i + random_()) / count) ** 0.5
+                created_at = str(reg_start + timedelta(seconds=created))
+                name = f"{first} {last}"
+                email = f"{lower[first]}.{lower[last]}{n}@example.com"
+                mobile = str(9000000000 + n)
+                token = sid * 0x9E3779B97F4A7C15  # odd multiplier: distinct tokens mod 2**48
+                uid = f"MSCCAIT2025-{(token + 0x5EED) % 2**48:012x}"
+                payment_id = f"pay_{(token + 1) % 2**48:012x}"
+                amount = (1 + family) * price
+                refunded = random_() < (sem1_refund_rate if semester == 1 else refund_rate)
+                attended = not refunded and random_() < attend_rate
+                refunded_at = attended_at = refund_id = None
+                if refunded:
+                    refund_id = f"rfnd_{(token + 3) % 2**48:012x}"
+                    offset = min(created + 3600 * (1 + 71 * random_()), end_offset)
+                    refunded_at = str(reg_start + timedelta(seconds=offset))
+                    heapq.heappush(refunds, (offset, refund_id, sid, amount))
+                if attended:
+                    attended_at = str(reg_start + timedelta(seconds=event_offset + 6 * 3600 * random_() ** 2))
+                    logs.append((sid, gate, attended_at))
+                upi = f"{lower[first]}{n % 1000}@{handle}" if random_() < 0.7 else "N/A"
+                students.append((
+                    sid, uid, name, email, semester, mobile, family, attended, upi,
+                    payment_id, f"order_{(token + 2) % 2**48:012x}", "Refunded" if refunded else "Paid", refund_id,
+                    refunded, email, f"+91{mobile}", created_at, attended_at, refunded_at))
+                # postings in time order: refunds issued before this charge go first
+                if refunds and refunds[0][0] <= created:
+                    post_refunds(created)
+                cash += amount
+                revenue -= amount
+                charges += 1
+                ledger.append((payment_id, "charge", "razorpay", amount, cash, sid, created_at))
+                ledger.append((payment_id, "charge", "ticket_revenue", -amount, revenue, sid, created_at))
+                uids.append(uid)
+                if csv_writer:
+                    csv_writer.writerow([name, email, semester, mobile, family, (1 + family) * 100,
+                                         uid, upi, payment_id, "Paid"])
+            if lo + size == count:
+                post_refunds(end_offset)
+            conn.executemany(_insert("student", STUDENT_COLUMNS), students)
+            conn.executemany(_insert("ledger_entry", LEDGER_COLUMNS), ledger)
+            conn.executemany(_insert("attendance_log", LOG_COLUMNS), logs)
+        conn.executemany("UPDATE ledger_account SET balance = ?, entry_count = entry_count + ? WHERE name = ?",
+                         [(cash, charges + refunds_posted, "razorpay"), (revenue, charges, "ticket_revenue"),
+                          (refunded_total, refunds_posted, "refunds")])
+        conn.execute("UPDATE event_capacity SET confirmed = (SELECT coalesce(sum(family_members + 1), 0)"
+                     " FROM student WHERE payment_status = 'Paid')")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+        if csv_file:
+            csv_file.close()
+
+    with campus.app.app_context():
+        campus.init_db()  # recreates the dropped indexes and repopulates the search index
+    return uids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", default="students.db", help="SQLite file to fill (created if missing)")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=int, default=30, help="length of the registration window")
+    parser.add_argument("--attend-rate", type=float, default=0.8)
+    parser.add_argument("--refund-rate", type=float, default=0.02, help="semesters 2-6")
+    parser.add_argument("--sem1-refund-rate", type=float, default=0.6)
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per executemany")
+    parser.add_argument("--csv", help="also append the rows to this registrations.csv")
+    args = parser.parse_args()
+
+    from _common import load_app
+    db_path = os.path.abspath(args.db)
+    csv_path = args.csv and os.path.abspath(args.csv)
+    campus = load_app(db_path, LOG_LEVEL="ERROR")
+    start = time.perf_counter()
+    populate(campus, args.rows, seed=args.seed, days=args.days, attend_rate=args.attend_rate,
+             refund_rate=args.refund_rate, sem1_refund_rate=args.sem1_refund_rate,
+             batch_size=args.batch_size, csv_path=csv_path)
+    elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(db_path)
+    total, refunded, attended = conn.execute(
+        "SELECT count(*), sum(refunded), sum(attended) FROM student").fetchone()
+    entries = conn.execute("SELECT count(*) FROM ledger_entry").fetchone()[0]
+    checkins = conn.execute("SELECT count(*) FROM attendance_log").fetchone()[0]
+    conn.close()
+    print(f"{args.rows} registrants in {elapsed:.1f} s ({args.rows / elapsed:,.0f}/s including the index "
+          f"and search-index rebuild)")
+    print(f"{db_path}: {total} students, {refunded} refunded, {attended} attended, "
+          f"{entries} ledger entries, {checkins} check-ins")
+
+
+if __name__ == "__main__":
+    main()
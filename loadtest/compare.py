@@ -0,0 +1,50 @@
+# loadtest/compare.py
+"""
+Side-by-side comparison of two loadtest/run.py result files.
+
+Prints throughput, p95/p99 and error rate per route for the baseline and
+the candidate, with the relative change.
+
+    python loadtest/compare.py loadtest/results/before.json loadtest/results/after.json
+"""
+import argparse
+import json
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return ""
+    return f"{(new - old) / old:+.0%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.candidate) as f:
+        new = json.load(f)
+    for label, run in (("baseline", old), ("candidate", new)):
+        meta = run["meta"]
+        print(f"{label:<10} {meta['mix']}, {meta['users']} users, {meta['workers']}w x {meta['threads']}t, "
+              f"rev {meta.get('git_rev')}, {' '.join(meta.get('env') or [])}")
+
+    print(f"{'route':<26}{'rps':>16}{'p95 ms':>26}{'p99 ms':>26}{'errors':>16}")
+    rows = [(route, old["routes"].get(route), new["routes"].get(route))
+            for route in sorted(set(old["routes"]) | set(new["routes"]))]
+    for route, a, b in rows + [("TOTAL", old["total"], new["total"])]:
+        a, b = a or {}, b or {}
+        cells = []
+        for key, width in (("rps", 16), ("p95_ms", 26), ("p99_ms", 26)):
+            x, y = a.get(key), b.get(key)
+            cell = f"{'-' if x is None else x} -> {'-' if y is None else y} {change(x, y)}"
+            cells.append(f"{cell:>{width}}")
+        errors = f"{a.get('error_rate', 0):.1%} -> {b.get('error_rate', 0):.1%}"
+        print(f"{route:<26}{''.join(cells)}{errors:>16}")
+
+
+if __name__ == "__main__":
+    main()
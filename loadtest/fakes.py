@@ -0,0 +1,151 @@
+# loadtest/fakes.py
+"""
+Local stand-ins for the Razorpay and Twilio HTTP APIs.
+
+Only the endpoints the app calls are implemented, with response bodies
+shaped like the real ones. Each server can add a fixed latency per call
+to model the real round trip. Point the app at them with
+RAZORPAY_BASE_URL / TWILIO_API_BASE_URL.
+
+    python loadtest/fakes.py --razorpay-port 9001 --twilio-port 9002
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    routes = ()  # (method, compiled path regex, handler method name)
+
+    def _dispatch(self, method):
+        path = urlparse(self.path).path
+        for route_method, pattern, name in self.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                time.sleep(self.server.latency)
+                status, body = getattr(self, name)(*match.groups())
+                break
+        else:
+            status, body = 404, {"error": {"code": "NOT_FOUND", "description": path}}
+        with self.server.lock:
+            self.server.calls[f"{method} {path if status == 404 else name}"] += 1
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(raw or b"{}")
+        return {k: v[-1] for k, v in parse_qs(raw.decode()).items()}
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, *args):
+        pass
+
+
+class RazorpayHandler(_FakeHandler):
+    routes = (
+        ("POST", re.compile(r"/v1/orders"), "create_order"),
+        ("POST", re.compile(r"/v1/payments/(\w+)/refund"), "refund"),
+        ("GET", re.compile(r"/v1/payments/(\w+)"), "fetch_payment"),
+        ("GET", re.compile(r"/v1/payments"), "list_payments"),
+        ("GET", re.compile(r"/v1/refunds"), "list_refunds"),
+    )
+
+    def create_order(self):
+        data = self._body()
+        order = {"id": f"order_{next(self.server.ids):014d}", "entity": "order",
+                 "amount": data.get("amount"), "currency": data.get("currency", "INR"),
+                 "status": "created", "created_at": int(time.time())}
+        return 200, order
+
+    def refund(self, payment_id):
+        data = self._body()
+        return 200, {"id": f"rfnd_{next(self.server.ids):014d}", "entity": "refund",
+                     "payment_id": payment_id, "amount": data.get("amount"),
+                     "status": "processed", "created_at": int(time.time())}
+
+    def fetch_payment(self, payment_id):
+        # Payment ids come from the load test, not from a checkout, so there's
+        # no order to take the amount from; the app then posts the order amount
+        return 200, {"id": payment_id, "entity": "payment", "status": "captured",
+                     "created_at": int(time.time())}
+
+    def list_payments(self):
+        return 200, {"entity": "collection", "count": 0, "items": []}
+
+    def list_refunds(self):
+        return 200, {"entity": "collection", "count": 0, "items": []}
+
+
+class TwilioHandler(_FakeHandler):
+    routes = (
+        ("POST", re.compile(r"/2010-04-01/Accounts/(\w+)/Messages\.json"), "create_message"),
+    )
+
+    def create_message(self, account_sid):
+        data = self._body()
+        return 201, {"sid": f"SM{next(self.server.ids):032d}", "account_sid": account_sid,
+                     "to": data.get("To"), "from": data.get("From"), "body": data.get("Body"),
+                     "status": "queued"}
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, port=0, latency_ms=0):
+        super().__init__(("127.0.0.1", port), handler)
+        self.latency = latency_ms / 1000
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+
+def start_fakes(razorpay_latency_ms=0, twilio_latency_ms=0, razorpay_port=0, twilio_port=0):
+    """Start both servers on background threads and return (razorpay, twilio)."""
+    return (FakeServer(RazorpayHandler, razorpay_port, razorpay_latency_ms).start(),
+            FakeServer(TwilioHandler, twilio_port, twilio_latency_ms).start())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--razorpay-port", type=int, default=9001)
+    parser.add_argument("--twilio-port", type=int, default=9002)
+    parser.add_argument("--razorpay-latency-ms", type=float, default=0)
+    parser.add_argument("--twilio-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    razorpay, twilio = start_fakes(args.razorpay_latency_ms, args.twilio_latency_ms,
+                                   args.razorpay_port, args.twilio_port)
+    print(f"RAZORPAY_BASE_URL={razorpay.url}\nTWILIO_API_BASE_URL={twilio.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# loadtest/run.py
+"""
+End-to-end load test: the app under gunicorn against local Razorpay / Twilio.
+
+Seeds a scratch database, starts the fake Razorpay and Twilio servers
+(loadtest/fakes.py), boots `gunicorn app:app` pointed at them, then runs
+--users virtual users for --duration seconds. Each user picks actions from
+the chosen mix:
+
+    surge      registration rush: availability check, /pay, /payment-success
+    gates      scan storm: /verify/<uid> from several gates
+    admins     dashboards being polled: /dashboard_data, /admin/gates, /timeseries
+    event-day  all of the above at once, mostly scans
+
+Prints throughput, p50/p95/p99 latency and error rate per route and saves
+them as JSON (compare two runs with loadtest/compare.py).
+
+    python loadtest/run.py --mix event-day --users 50 --duration 60 --workers 4 --threads 8
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from fakes import start_fakes  # noqa: E402
+from _common import load_app, seed_students  # noqa: E402
+
+MIXES = {
+    "surge": {"register": 1},
+    "gates": {"scan": 1},
+    "admins": {"dashboard": 5, "gate_panel": 3, "timeseries": 2},
+    "event-day": {"register": 15, "scan": 70, "dashboard": 10, "gate_panel": 5},
+}
+GATES = ("North", "South", "East", "West")
+ADMIN_USER = ADMIN_PASSWORD = "loadtest"
+ORDER_ID = re.compile(r'name="razorpay_order_id"[^>]*value="([^"]+)"')
+
+
+class Recorder:
+    """Latency samples per route, shared by every virtual user."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)   # route -> [latency seconds]
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def call(self, session, route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, allow_redirects=False, timeout=30, **kwargs)
+            status = resp.status_code
+        except requests.RequestException:
+            resp, status = None, "conn_error"
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples[route].append(elapsed)
+            self.statuses[route][status] += 1
+        return resp
+
+
+class Scenario:
+    """The actions a virtual user can take; `base` is the gunicorn URL."""
+
+    def __init__(self, base, uids, recorder):
+        self.base = base
+        self.recorder = recorder
+        self._uids = itertools.cycle(uids)
+        self._registrations = itertools.count()
+        self._lock = threading.Lock()
+
+    def _next(self, iterator):
+        with self._lock:
+            return next(iterator)
+
+    def register(self, session):
+        n = self._next(self._registrations)
+        email, mobile = f"lt{n}@example.com", str(8000000000 + n)
+        call = self.recorder.call
+        call(session, "GET /check-availability", "GET", f"{self.base}/check-availability",
+             params={"email": email, "mobile_number": mobile})
+        resp = call(session, "POST /pay", "POST", f"{self.base}/pay", data={
+            "name": f"Load {n}", "email": email, "semester": str(n % 6 + 1),
+            "mobile_number": mobile, "family_members": str(n % 3)})
+        match = resp is not None and resp.status_code == 200 and ORDER_ID.search(resp.text)
+        if match:
+            call(session, "POST /payment-success", "POST", f"{self.base}/payment-success", data={
+                "razorpay_order_id": match.group(1), "razorpay_payment_id": f"pay_lt{n}"})
+
+    def scan(self, session):
+        self.recorder.call(session, "GET /verify/<uid>", "GET",
+                           f"{self.base}/verify/{self._next(self._uids)}",
+                           params={"gate": random.choice(GATES)})
+
+    def _admin(self, session):
+        if not session.cookies.get("session"):
+            self.recorder.call(session, "POST /admin_login", "POST", f"{self.base}/admin_login",
+                               data={"username": ADMIN_USER, "password": ADMIN_PASSWORD})
+        return session
+
+    def dashboard(self, session):
+        self.recorder.call(self._admin(session), "GET /dashboard_data", "GET", f"{self.base}/dashboard_data")
+
+    def gate_panel(self, session):
+        self.recorder.call(self._admin(session), "GET /admin/gates", "GET", f"{self.base}/admin/gates")
+
+    def timeseries(self, session):
+        self.recorder.call(self._admin(session), "GET /timeseries", "GET", f"{self.base}/timeseries",
+                           params={"bucket": "hour"})
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples, statuses, elapsed):
+    def stats(latencies, codes):
+        latencies = sorted(latencies)
+        count = len(latencies)
+        errors = sum(n for code, n in codes.items() if code == "conn_error" or code >= 500 and code != 503)
+        shed = sum(n for code, n in codes.items() if code in (429, 503))
+        ms = lambda v: None if v is None else round(v * 1000, 2)  # noqa: E731
+        return {"count": count, "rps": round(count / elapsed, 1),
+                "errors": errors, "error_rate": round(errors / count, 4) if count else 0.0, "shed": shed,
+                "p50_ms": ms(percentile(latencies, 50)), "p95_ms": ms(percentile(latencies, 95)),
+                "p99_ms": ms(percentile(latencies, 99)), "max_ms": ms(latencies[-1] if latencies else None),
+                "statuses": {str(code): n for code, n in sorted(codes.items(), key=str)}}
+
+    routes = {route: stats(samples[route], statuses[route]) for route in sorted(samples)}
+    merged = defaultdict(int)
+    for codes in statuses.values():
+        for code, n in codes.items():
+            merged[code] += n
+    total = stats([v for route in samples for v in samples[route]], merged)
+    return routes, total
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(args, workdir, db_path, razorpay, twilio, port):
+    env = dict(os.environ,
+               DATABASE_URI="sqlite:///" + db_path,
+               RAZORPAY_KEY_ID="rzp_test_loadtest", RAZORPAY_KEY_SECRET="loadtest",
+               RAZORPAY_BASE_URL=razorpay.url,
+               TWILIO_SID="AC" + "0" * 32, TWILIO_AUTH_TOKEN="loadtest", TWILIO_API_BASE_URL=twilio.url,
+               ADMIN_USERNAME=ADMIN_USER, ADMIN_PASSWORD=ADMIN_PASSWORD,
+               RATE_LIMIT_FILE=os.path.join(workdir, "ratelimit.bin"),
+               METRICS_DIR=os.path.join(workdir, "metrics"),
+               PROFILE_DIR=os.path.join(workdir, "profiles"),
+               LOG_LEVEL=args.log_level)
+    # Every virtual user shares one client IP, so per-IP buckets would throttle
+    # the whole run; the site-wide /pay budget still applies.
+    env.setdefault("PAY_IP_RATE", "0")
+    env.setdefault("AVAILABILITY_IP_RATE", "0")
+    env.update(kv.split("=", 1) for kv in args.env)
+    cmd = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+           "--workers", str(args.workers), "--threads", str(args.threads),
+           "--pythonpath", ROOT, "--chdir", workdir]
+    log = open(os.path.join(workdir, "gunicorn.log"), "w")
+    proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            if requests.get(base + "/", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit(f"gunicorn did not come up; see {log.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mix", choices=sorted(MIXES), default="event-day")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between a user's actions")
+    parser.add_argument("--students", type=int, default=5000, help="pre-registered students to scan")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--razorpay-latency-ms", type=float, default=80)
+    parser.add_argument("--twilio-latency-ms", type=float, default=120)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra app setting, e.g. --env ATTENDANCE_BATCHING=True")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="results file (default loadtest/results/<time>-<mix>.json)")
+    args = parser.parse_args()
+
+    campus = load_app()
+    workdir = os.getcwd()  # load_app made a scratch directory and moved into it
+    db_path = campus.app.config["SQLALCHEMY_DATABASE_URI"][len("sqlite:///"):]
+    uids = seed_students(campus, args.students)
+    razorpay, twilio = start_fakes(args.razorpay_latency_ms, args.twilio_latency_ms)
+    proc, base = start_gunicorn(args, workdir, db_path, razorpay, twilio, free_port())
+
+    recorder = Recorder()
+    scenario = Scenario(base, uids, recorder)
+    actions, weights = zip(*MIXES[args.mix].items())
+    deadline = time.perf_counter() + args.duration
+
+    def user():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            getattr(scenario, random.choices(actions, weights)[0])(session)
+            if args.think_ms:
+                time.sleep(args.think_ms / 1000)
+
+    started = time.perf_counter()
+    try:
+        users = [threading.Thread(target=user) for _ in range(args.users)]
+        for t in users:
+            t.start()
+        for t in users:
+            t.join()
+    finally:
+        elapsed = time.perf_counter() - started
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    routes, total = summarize(recorder.samples, recorder.statuses, elapsed)
+    print(f"{args.mix}: {args.users} users, {elapsed:.1f} s, gunicorn {args.workers}w x {args.threads}t")
+    print(f"{'route':<26}{'count':>8}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'shed':>6}")
+    for route, s in list(routes.items()) + [("TOTAL", total)]:
+        print(f"{route:<26}{s['count']:>8}{s['rps']:>8}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}"
+              f"{s['error_rate']:>8.1%}{s['shed']:>6}")
+
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        rev = None
+    now = datetime.now(timezone.utc)
+    result = {
+        "meta": {"mix": args.mix, "users": args.users, "duration_s": round(elapsed, 2),
+                 "workers": args.workers, "threads": args.threads, "students": args.students,
+                 "razorpay_latency_ms": args.razorpay_latency_ms, "twilio_latency_ms": args.twilio_latency_ms,
+                 "env": args.env, "git_rev": rev, "started_at": now.isoformat(timespec="seconds")},
+        "total": total,
+        "routes": routes,
+        "external_calls": {"razorpay": dict(razorpay.calls), "twilio": dict(twilio.calls)},
+    }
+    output = args.output or os.path.join(HERE, "results", f"{now:%Y%m%dT%H%M%S}-{args.mix}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results: {output}")
+
+
+if __name__ == "__main__":
+    main()
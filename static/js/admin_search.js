@@ -0,0 +1,37 @@
+// Autocomplete for the admin search boxes. Suggestions come from /admin/search
+// (FTS5 prefix match); picking one fills in the unique ID, which the page then
+// resolves as an exact lookup.
+document.querySelectorAll("form.student-search").forEach(function (form) {
+  const input = form.querySelector("input[name=q]");
+  const list = document.getElementById(input.getAttribute("list"));
+  const semester = form.dataset.semester;
+  let timer = null;
+  let pending = null;
+
+  input.addEventListener("input", function () {
+    clearTimeout(timer);
+    const q = input.value.trim();
+    if (q.length < 2) {
+      list.innerHTML = "";
+      return;
+    }
+    timer = setTimeout(function () {
+      if (pending) pending.abort();
+      pending = new AbortController();
+      const params = new URLSearchParams({ q: q, limit: 10 });
+      if (semester) params.set("semester", semester);
+      fetch("/admin/search?" + params, { signal: pending.signal })
+        .then(function (r) { return r.ok ? r.json() : { results: [] }; })
+        .then(function (data) {
+          list.innerHTML = "";
+          data.results.forEach(function (s) {
+            const option = document.createElement("option");
+            option.value = s.unique_id;
+            option.label = s.name + " · " + s.email + " · " + s.mobile_number;
+            list.appendChild(option);
+          });
+        })
+        .catch(function () {});
+    }, 150);
+  });
+});
@@ -0,0 +1,1726 @@
+# test.py
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from functools import partial
+from unittest import mock
+
+from sqlalchemy import event
+
+# Point the app at a throwaway database and dummy credentials *before* importing it.
+_TMP_DIR = tempfile.mkdtemp(prefix="campusconnect-test-")
+os.environ["RAZORPAY_KEY_ID"] = "rzp_test_dummy"
+os.environ["RAZORPAY_KEY_SECRET"] = "dummy_secret"
+os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(_TMP_DIR, "test.db")
+os.environ["RATE_LIMIT_FILE"] = os.path.join(_TMP_DIR, "ratelimit.bin")
+os.environ["METRICS_DIR"] = os.path.join(_TMP_DIR, "metrics")
+os.environ["PROFILE_DIR"] = os.path.join(_TMP_DIR, "profiles")
+os.environ.pop("TWILIO_SID", None)
+os.environ.pop("TWILIO_AUTH_TOKEN", None)
+
+import app as campus  # noqa: E402
+
+_ORIGINAL_CWD = os.getcwd()
+
+
+def setUpModule():
+    # QR codes, PDFs and CSVs are written relative to the working directory.
+    os.chdir(_TMP_DIR)
+
+
+def tearDownModule():
+    os.chdir(_ORIGINAL_CWD)
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+
+class FakeRazorpay:
+    """Just enough of razorpay.Client for the registration and refund flows."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.orders = []
+        self.payments = []
+        self.refunds = []
+        self.list_calls = []
+        self.order = mock.Mock(create=self._create_order)
+        self.payment = mock.Mock(refund=self._refund, fetch=self._fetch_payment,
+                                 all=partial(self._list, self.payments))
+        self.refund = mock.Mock(all=partial(self._list, self.refunds))
+        self.utility = campus.razorpay.Client(auth=("k", "s")).utility
+
+    def _create_order(self, data):
+        order = dict(data, id=f"order_{next(self._ids):014d}")
+        self.orders.append(order)
+        return order
+
+    def _refund(self, payment_id, data):
+        refund = dict(data, id=f"rfnd_{next(self._ids):014d}", payment_id=payment_id,
+                      status="processed", created_at=int(datetime.utcnow().timestamp()))
+        self.refunds.append(refund)
+        return refund
+
+    def _fetch_payment(self, payment_id):
+        for payment in self.payments:
+            if payment["id"] == payment_id:
+                return payment
+        raise campus.razorpay.errors.BadRequestError("The id provided does not exist")
+
+    def _list(self, entities, params):
+        """Razorpay list semantics: inclusive from/to, newest first, count <= 100, skip."""
+        self.list_calls.append(params)
+        items = sorted((e for e in entities if params["from"] <= e["created_at"] <= params["to"]),
+                       key=lambda e: e["created_at"], reverse=True)
+        page = items[params["skip"]:params["skip"] + min(params["count"], 100)]
+        return {"entity": "collection", "count": len(page), "items": page}
+
+
+class AppTestCase(unittest.TestCase):
+    def setUp(self):
+        campus.app.config["TESTING"] = True
+        campus.app.config["BACKGROUND_TASKS"] = False  # tests drive sweepers directly
+        # Rate limits are off unless a test turns them on
+        for key, value in {"PAY_IP_RATE": 0, "PAY_GLOBAL_RATE": 0}.items():
+            self.addCleanup(campus.app.config.__setitem__, key, campus.app.config[key])
+            campus.app.config[key] = value
+        self.ctx = campus.app.app_context()
+        self.ctx.push()
+        campus.db.drop_all()
+        campus.init_db()
+        campus.availability_cache._entries.clear()
+        campus.timeseries_cache._entries.clear()
+        campus.gate_stats.reset()
+        self.client = campus.app.test_client()
+        self.razorpay = FakeRazorpay()
+        patcher = mock.patch.object(campus, "razorpay_client", self.razorpay)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        campus.db.session.remove()
+        self.ctx.pop()
+
+    def add_student(self, uid, **fields):
+        values = dict(
+            name=f"Student {uid}", email=f"{uid}@example.com", semester=2,
+            mobile_number=str(9000000000 + abs(hash(uid)) % 999999999),
+            family_members=0, payment_status="Paid", attended=False, refunded=False,
+        )
+        values.update(fields)
+        student = campus.Student(unique_id=uid, **values)
+        campus.db.session.add(student)
+        campus.db.session.commit()
+        return student
+
+    def set_capacity(self, seats):
+        campus.app.config["EVENT_CAPACITY"] = seats
+        self.addCleanup(campus.app.config.__setitem__, "EVENT_CAPACITY", 0)
+        campus.sync_event_capacity()
+
+    def register(self, client=None, **fields):
+        """POST the registration form and return the Razorpay order it created."""
+        form = dict(name="Riya", email="riya@example.com", semester="3",
+                    mobile_number="9876543210", family_members="1")
+        form.update(fields)
+        resp = (client or self.client).post("/pay", data=form)
+        self.assertEqual(resp.status_code, 200, resp.get_data(as_text=True)[:500])
+        return self.razorpay.orders[-1]
+
+
+# ---------------- Attendance batching ----------------
+class MarkAttendanceBatchTests(AppTestCase):
+    def test_each_uid_gets_its_own_answer(self):
+        self.add_student("A1", name="Asha")
+        self.add_student("B2", name="Bhavin", attended=True)
+
+        results = campus.mark_attendance_batch(["A1", "B2", "NOPE", "A1"])
+
+        self.assertEqual([r[0] for r in results], ["success", "warning", "error", "warning"])
+        self.assertIn("Asha", results[0][1])
+        self.assertTrue(campus.Student.query.filter_by(unique_id="A1").one().attended)
+
+    def test_verify_route_uses_batcher_when_enabled(self):
+        for i in range(20):
+            self.add_student(f"U{i}")
+        campus.app.config["ATTENDANCE_BATCHING"] = True
+        self.addCleanup(campus.app.config.__setitem__, "ATTENDANCE_BATCHING", False)
+
+        bodies = []
+
+        def scan(uid):
+            with campus.app.test_client() as client:
+                bodies.append(client.get(f"/verify/{uid}").get_data(as_text=True))
+
+        # Every pass scanned twice concurrently: exactly one scan may succeed.
+        threads = [threading.Thread(target=scan, args=(f"U{i}",)) for _ in range(2) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sum("Attendance marked for" in b for b in bodies), 20)
+        self.assertEqual(sum("has already attended" in b for b in bodies), 20)
+        campus.db.session.expire_all()
+        self.assertEqual(campus.Student.query.filter_by(attended=True).count(), 20)
+        self.assertEqual(campus.AttendanceLog.query.count(), 20)
+
+
+# ---------------- Pending registrations ----------------
+class PendingRegistrationTests(AppTestCase):
+    def test_pay_keeps_registration_server_side(self):
+        order = self.register()
+
+        pending = campus.db.session.get(campus.PendingRegistration, order["id"])
+        self.assertEqual(pending.email, "riya@example.com")
+        self.assertEqual(pending.total_amount, 200)
+        with self.client.session_transaction() as sess:
+            self.assertEqual(dict(sess), {"pending_registration": pending.token})
+
+    def test_payment_success_recovers_by_order_id_without_cookie(self):
+        order = self.register()
+
+        other_tab = campus.app.test_client()
+        resp = other_tab.post("/payment-success", data={
+            "razorpay_payment_id": "pay_1", "razorpay_order_id": order["id"]})
+
+        self.assertEqual(resp.status_code, 302)
+        student = campus.Student.query.filter_by(razorpay_order_id=order["id"]).one()
+        self.assertEqual(student.transaction_id, "pay_1")
+        self.assertIsNone(campus.db.session.get(campus.PendingRegistration, order["id"]))
+
+    def test_webhook_completes_registration(self):
+        order = self.register()
+        body = json.dumps({"event": "payment.captured", "payload": {"payment": {"entity": {
+            "id": "pay_hook", "order_id": order["id"], "vpa": "riya@upi"}}}})
+        signature = hmac.new(b"whsec", body.encode(), hashlib.sha256).hexdigest()
+
+        with mock.patch.object(campus, "RAZORPAY_WEBHOOK_SECRET", "whsec"):
+            bad = self.client.post("/razorpay-webhook", data=body,
+                                   headers={"X-Razorpay-Signature": "nope"},
+                                   content_type="application/json")
+            good = self.client.post("/razorpay-webhook", data=body,
+                                    headers={"X-Razorpay-Signature": signature},
+                                    content_type="application/json")
+
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(good.get_json()["status"], "registered")
+        self.assertEqual(campus.Student.query.one().upi_id, "riya@upi")
+
+    def test_sweeper_removes_expired(self):
+        self.register()
+        self.register(email="b@example.com", mobile_number="9000000001")
+
+        later = datetime.utcnow() + timedelta(seconds=campus.app.config["PENDING_REGISTRATION_TTL"] + 1)
+        self.assertEqual(campus.sweep_pending_registrations(now=later), 2)
+        self.assertEqual(campus.PendingRegistration.query.count(), 0)
+
+
+class ConcurrentInitTests(unittest.TestCase):
+    def test_workers_importing_at_once_all_boot(self):
+        # gunicorn starts every worker together and each one runs init_db() on import
+        env = dict(os.environ, DATABASE_URI="sqlite:///" + os.path.join(_TMP_DIR, "boot.db"), LOG_LEVEL="ERROR")
+        workers = [subprocess.Popen([sys.executable, "-c", "import app"], cwd=os.path.dirname(campus.__file__),
+                                    env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                   for _ in range(4)]
+        errors = [w.communicate(timeout=120)[1].decode() for w in workers]
+        self.assertEqual([w.returncode for w in workers], [0] * 4, "\n".join(errors))
+
+
+# ---------------- Idempotent payment callbacks ----------------
+class IdempotentPaymentSuccessTests(AppTestCase):
+    def test_resubmitted_form_redoes_nothing(self):
+        order = self.register()
+        form = {"razorpay_payment_id": "pay_1", "razorpay_order_id": order["id"]}
+        first = self.client.post("/payment-success", data=form)
+
+        with mock.patch.object(campus, "generate_pdf") as generate_pdf:
+            again = self.client.post("/payment-success", data=form)
+
+        self.assertEqual(again.headers["Location"], first.headers["Location"])
+        generate_pdf.assert_not_called()
+        self.assertEqual(campus.Student.query.count(), 1)
+
+    def test_parallel_duplicate_callbacks_create_one_student(self):
+        order = self.register()
+        form = {"razorpay_payment_id": "pay_dup", "razorpay_order_id": order["id"]}
+        locations, errors = [], []
+        start = threading.Barrier(8)
+
+        def callback():
+            try:
+                with campus.app.test_client() as client:
+                    start.wait()
+                    locations.append(client.post("/payment-success", data=form).headers.get("Location"))
+            except Exception as e:  # surfaced below
+                errors.append(e)
+
+        with mock.patch.object(campus, "generate_qr_code") as generate_qr_code, \
+                mock.patch.object(campus, "generate_pdf"), \
+                mock.patch.object(campus, "append_to_csv") as append_to_csv:
+            threads = [threading.Thread(target=callback) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(errors, [])
+        student = campus.Student.query.one()
+        self.assertEqual(set(locations), {f"/download-all/{student.unique_id}"})
+        self.assertEqual(generate_qr_code.call_count, 1)
+        self.assertEqual(append_to_csv.call_count, 1)
+
+    def test_second_checkout_for_the_same_contact_is_refunded(self):
+        self.set_capacity(10)
+        first = self.register()
+        second = self.register(mobile_number="9000000009")  # same email, both passed /pay
+        self.client.post("/payment-success", data={"razorpay_payment_id": "pay_1", "razorpay_order_id": first["id"]})
+
+        with self.assertLogs("campusconnect", "WARNING") as logs, \
+                mock.patch.object(campus.promote_waitlist.task, "wake"):
+            resp = self.client.post("/payment-success",
+                                    data={"razorpay_payment_id": "pay_2", "razorpay_order_id": second["id"]})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual([(r["payment_id"], r["amount"]) for r in self.razorpay.refunds], [("pay_2", 20000)])
+        self.assertIn("registration.duplicate_contact", [r.msg for r in logs.records])
+        self.assertEqual(campus.Student.query.one().transaction_id, "pay_1")
+        self.assertEqual(campus.PendingRegistration.query.count(), 0)
+        self.assertEqual(campus.seats_remaining(), 8)
+
+        # the same callback arriving again refunds nothing more
+        resp = self.client.post("/payment-success",
+                                data={"razorpay_payment_id": "pay_2", "razorpay_order_id": second["id"]})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(len(self.razorpay.refunds), 1)
+
+    def test_still_locked_after_busy_timeout_asks_for_a_retry(self):
+        order = self.register()
+        form = {"razorpay_payment_id": "pay_1", "razorpay_order_id": order["id"]}
+        locked = campus.OperationalError("BEGIN IMMEDIATE", {}, sqlite3.OperationalError("database is locked"))
+
+        with mock.patch.object(campus, "begin_write", side_effect=locked):
+            resp = self.client.post("/payment-success", data=form)
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn("Retry-After", resp.headers)
+        self.assertEqual(campus.Student.query.count(), 0)
+
+        # the pending registration survived, so the retry completes it
+        resp = self.client.post("/payment-success", data=form)
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(campus.Student.query.count(), 1)
+
+    def test_transaction_and_order_ids_are_unique(self):
+        self.add_student("A1", transaction_id="pay_x", razorpay_order_id="order_x")
+        with self.assertRaises(campus.IntegrityError):
+            self.add_student("A2", transaction_id="pay_x", razorpay_order_id="order_y")
+        campus.db.session.rollback()
+        with self.assertRaises(campus.IntegrityError):
+            self.add_student("A3", transaction_id="pay_z", razorpay_order_id="order_x")
+
+    def test_existing_duplicate_payments_skip_the_index_instead_of_crashing(self):
+        campus.db.drop_all()
+        with campus.db.engine.begin() as conn:
+            conn.execute(campus.db.text(LEGACY_STUDENT_TABLE))
+            conn.execute(campus.db.text(
+                "INSERT INTO student (id, unique_id, transaction_id, razorpay_order_id) VALUES "
+                "(1, 'U1', 'pay_dup', 'order_1'), (2, 'U2', 'pay_dup', 'order_2')"))
+
+        with self.assertLogs("campusconnect", "WARNING") as logs:
+            campus.init_db()
+        skipped = [r for r in logs.records if r.msg == "db.unique_index_skipped"]
+        self.assertEqual([(r.index, r.duplicate_values) for r in skipped], [("ix_student_transaction_id", 1)])
+
+        def indexes():
+            return set(campus.db.session.scalars(campus.db.text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'student'")))
+        self.assertIn("ix_student_razorpay_order_id", indexes())
+        self.assertNotIn("ix_student_transaction_id", indexes())
+
+        campus.db.session.execute(campus.db.text("UPDATE student SET transaction_id = 'pay_2' WHERE id = 2"))
+        campus.db.session.commit()
+        campus.init_db()
+        self.assertIn("ix_student_transaction_id", indexes())
+
+
+# ---------------- Seat capacity ----------------
+class SeatCapacityTests(AppTestCase):
+    def counters(self):
+        row = campus.db.session.get(campus.EventCapacity, campus.EVENT_CAPACITY_ID, populate_existing=True)
+        return row.held, row.confirmed
+
+    def test_hold_confirm_and_sold_out(self):
+        self.set_capacity(3)
+        order = self.register(family_members="1")  # 2 seats
+        self.assertEqual(self.counters(), (2, 0))
+
+        resp = self.client.post("/pay", data=dict(
+            name="B", email="b@example.com", semester="2", mobile_number="9000000002", family_members="1"))
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(len(self.razorpay.orders), 1, "no order may be created when sold out")
+
+        self.client.post("/payment-success", data={"razorpay_payment_id": "pay_1", "razorpay_order_id": order["id"]})
+        self.assertEqual(self.counters(), (0, 2))
+        self.assertEqual(campus.seats_remaining(), 1)
+
+    def test_expired_holds_are_released(self):
+        self.set_capacity(5)
+        self.register(family_members="2")
+        later = datetime.utcnow() + timedelta(seconds=campus.app.config["SEAT_HOLD_TTL"] + 1)
+
+        self.assertEqual(campus.expire_seat_holds(now=later), 3)
+        self.assertEqual(self.counters(), (0, 0))
+        self.assertEqual(campus.SeatHold.query.count(), 0)
+
+    def test_paying_after_the_hold_went_to_someone_else_is_refunded(self):
+        self.set_capacity(2)
+        first = self.register(family_members="1")
+        pending = campus.db.session.get(campus.PendingRegistration, first["id"])
+        self.assertLessEqual(pending.expires_at, campus.SeatHold.query.one().expires_at)
+
+        later = datetime.utcnow() + timedelta(seconds=campus.app.config["SEAT_HOLD_TTL"] + 1)
+        campus.expire_seat_holds(now=later)
+        second = self.register(name="B", email="b@example.com", mobile_number="9000000002", family_members="1")
+        self.client.post("/payment-success", data={"razorpay_payment_id": "pay_2", "razorpay_order_id": second["id"]})
+        with mock.patch.object(campus.promote_waitlist.task, "wake"):
+            resp = self.client.post("/payment-success",
+                                    data={"razorpay_payment_id": "pay_1", "razorpay_order_id": first["id"]})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.counters(), (0, 2))
+        self.assertEqual(campus.Student.query.one().transaction_id, "pay_2")
+        self.assertEqual([(r["payment_id"], r["amount"]) for r in self.razorpay.refunds], [("pay_1", 20000)])
+        self.assertEqual(campus.PendingRegistration.query.count(), 0)
+
+    def test_turning_capacity_on_counts_seats_sold_while_unlimited(self):
+        self.add_student("A1", family_members=2)
+        self.add_student("A2", payment_status="Refunded", refunded=True)
+        self.set_capacity(5)
+        self.assertEqual(self.counters(), (0, 3))
+        self.assertEqual(campus.seats_remaining(), 2)
+
+    def test_failed_order_creation_releases_hold(self):
+        self.set_capacity(5)
+        self.razorpay.order.create = mock.Mock(side_effect=RuntimeError("razorpay down"))
+        with self.assertRaises(RuntimeError):
+            self.register()
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_concurrent_holds_never_oversell(self):
+        self.set_capacity(10)
+        results = []
+        start = threading.Barrier(30)
+
+        def grab():
+            with campus.app.app_context():
+                start.wait()
+                results.append(campus.hold_seats(1) is not None)
+                campus.db.session.remove()
+
+        threads = [threading.Thread(target=grab) for _ in range(30)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results.count(True), 10)
+        self.assertEqual(self.counters(), (10, 0))
+
+
+# ---------------- Waitlist ----------------
+class WaitlistTests(AppTestCase):
+    def fill_event(self, seats):
+        self.set_capacity(seats)
+        order = self.register(family_members=str(seats - 1))
+        self.client.post("/payment-success", data={"razorpay_payment_id": "pay_full", "razorpay_order_id": order["id"]})
+        return campus.Student.query.one()
+
+    def join(self, i):
+        return self.client.post("/pay", data=dict(
+            name=f"W{i}", email=f"w{i}@example.com", semester="2",
+            mobile_number=f"90000000{i:02d}", family_members="0"))
+
+    def test_sold_out_registrants_queue_in_order(self):
+        self.fill_event(2)
+        for i in range(3):
+            self.join(i)
+        self.join(0)  # same person again is not queued twice
+
+        queue = campus.WaitlistEntry.query.order_by(campus.WaitlistEntry.id).all()
+        self.assertEqual([e.email for e in queue], ["w0@example.com", "w1@example.com", "w2@example.com"])
+        self.assertEqual(len(self.razorpay.orders), 1)
+
+    def test_same_person_written_differently_is_queued_once(self):
+        self.fill_event(1)
+        self.join(0)
+        self.client.post("/pay", data=dict(name="W0", email=" W0@Example.com", semester="2",
+                                           mobile_number="9111111111", family_members="0"))
+        self.client.post("/pay", data=dict(name="W0", email="other@example.com", semester="2",
+                                           mobile_number="+91 90000 00000", family_members="0"))
+        self.assertEqual(campus.WaitlistEntry.query.count(), 1)
+
+        # backed by the partial unique index, not just the lookup
+        duplicate = campus.WaitlistEntry(token="dup", email="w0@example.com", email_normalized="w0@example.com")
+        campus.db.session.add(duplicate)
+        with self.assertRaises(campus.IntegrityError):
+            campus.db.session.commit()
+        campus.db.session.rollback()
+
+    def test_refund_frees_seats_for_head_of_queue_in_batches(self):
+        student = self.fill_event(2)
+        for i in range(3):
+            self.join(i)
+        self.client.post("/admin_login", data={"username": campus.ADMIN_USERNAME, "password": campus.ADMIN_PASSWORD})
+
+        with mock.patch.object(campus.promote_waitlist.task, "wake") as wake:
+            self.client.post(f"/process_refund/{student.id}")
+        wake.assert_called_once()
+        self.assertEqual(campus.seats_remaining(), 2)
+
+        with mock.patch.object(campus, "send_whatsapp_message") as whatsapp:
+            self.assertEqual(campus.promote_waitlist(batch_size=1), 1)
+            self.assertEqual(campus.promote_waitlist(batch_size=5), 1)
+            self.assertEqual(campus.promote_waitlist(batch_size=5), 0)
+
+        statuses = [e.status for e in campus.WaitlistEntry.query.order_by(campus.WaitlistEntry.id)]
+        self.assertEqual(statuses, ["offered", "offered", "waiting"])
+        self.assertEqual(whatsapp.call_count, 2)
+        self.assertIn("/waitlist/claim/", whatsapp.call_args_list[0].args[1])
+
+    def test_freed_seat_goes_to_the_queue_not_the_next_registrant(self):
+        self.fill_event(1)
+        self.join(0)
+        self.set_capacity(2)  # a seat opens up before the promoter has run
+
+        self.join(1)
+        self.assertEqual(len(self.razorpay.orders), 1)
+        self.assertEqual([e.email for e in campus.WaitlistEntry.query.order_by(campus.WaitlistEntry.id)],
+                         ["w0@example.com", "w1@example.com"])
+        with mock.patch.object(campus, "send_whatsapp_message"):
+            self.assertEqual(campus.promote_waitlist(), 1)
+        self.assertEqual(campus.WaitlistEntry.query.filter_by(status="offered").one().email, "w0@example.com")
+
+    def test_concurrent_promoters_offer_each_entry_once(self):
+        self.fill_event(1)
+        for i in range(3):
+            self.join(i)
+        self.set_capacity(4)
+
+        def promote():
+            with campus.app.app_context():
+                campus.promote_waitlist()
+
+        with mock.patch.object(campus, "send_whatsapp_message") as whatsapp:
+            threads = [threading.Thread(target=promote) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(whatsapp.call_count, 3)
+        self.assertEqual(campus.SeatHold.query.count(), 3)
+        self.assertEqual(campus.seats_remaining(), 0)
+        self.assertEqual({e.status for e in campus.WaitlistEntry.query}, {"offered"})
+
+    def test_claiming_an_offer_creates_the_order_against_the_hold(self):
+        self.fill_event(1)
+        self.join(0)
+        campus.app.config["EVENT_CAPACITY"] = 2
+        campus.sync_event_capacity()
+        with mock.patch.object(campus, "send_whatsapp_message"):
+            campus.promote_waitlist()
+        entry = campus.WaitlistEntry.query.one()
+
+        resp = self.client.get(f"/waitlist/claim/{entry.token}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.razorpay.orders), 1, "opening the link must not create an order")
+        self.assertIsNone(campus.db.session.get(campus.SeatHold, entry.hold_id).order_id)
+
+        resp = self.client.post(f"/waitlist/claim/{entry.token}")
+        self.assertEqual(resp.status_code, 200)
+        order = self.razorpay.orders[-1]
+        self.assertEqual(campus.db.session.get(campus.SeatHold, entry.hold_id).order_id, order["id"])
+
+        self.client.post("/payment-success", data={"razorpay_payment_id": "pay_w", "razorpay_order_id": order["id"]})
+        self.assertEqual(campus.Student.query.count(), 2)
+        self.assertEqual(campus.seats_remaining(), 0)
+
+    def test_expired_offer_is_not_claimable(self):
+        self.fill_event(1)
+        self.join(0)
+        campus.app.config["EVENT_CAPACITY"] = 2
+        campus.sync_event_capacity()
+        with mock.patch.object(campus, "send_whatsapp_message"):
+            campus.promote_waitlist()
+        entry = campus.WaitlistEntry.query.one()
+
+        later = datetime.utcnow() + timedelta(seconds=campus.app.config["WAITLIST_OFFER_TTL"] + 1)
+        with mock.patch.object(campus.promote_waitlist.task, "wake"):
+            campus.expire_seat_holds(now=later)
+        resp = self.client.post(f"/waitlist/claim/{entry.token}")
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(len(self.razorpay.orders), 1)
+
+
+# ---------------- /pay rate limiting ----------------
+class PayRateLimitTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        path = os.path.join(_TMP_DIR, f"buckets-{self._testMethodName}.bin")
+        patcher = mock.patch.object(campus, "_pay_buckets", campus.SharedTokenBuckets(path, slots=64))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pay(self, ip="10.0.0.1", i=0):
+        return self.client.post("/pay", environ_base={"REMOTE_ADDR": ip}, data=dict(
+            name="R", email=f"r{i}@example.com", semester="2", mobile_number=f"90000001{i:02d}", family_members="0"))
+
+    def test_bucket_refills_at_rate(self):
+        buckets = campus._pay_buckets
+        self.assertEqual(buckets.take(1, rate=1, burst=2, now=100.0), 0)
+        self.assertEqual(buckets.take(1, rate=1, burst=2, now=100.0), 0)
+        self.assertAlmostEqual(buckets.take(1, rate=1, burst=2, now=100.0), 1.0)
+        self.assertEqual(buckets.take(1, rate=1, burst=2, now=101.5), 0)
+
+    def test_per_ip_limit_returns_429_without_creating_orders(self):
+        campus.app.config.update(PAY_IP_RATE=0.01, PAY_IP_BURST=2)
+        codes = [self.pay(i=i).status_code for i in range(4)]
+        other_ip = self.pay(ip="10.0.0.2", i=9)
+
+        self.assertEqual(codes, [200, 200, 429, 429])
+        self.assertEqual(other_ip.status_code, 200)
+        self.assertEqual(len(self.razorpay.orders), 3)
+
+    def test_forwarded_for_is_only_believed_behind_a_trusted_proxy(self):
+        campus.app.config.update(PAY_IP_RATE=0.01, PAY_IP_BURST=1)
+        spoofed = [self.client.post("/pay", headers={"X-Forwarded-For": f"10.9.0.{i}"}, data=dict(
+            name="R", email=f"s{i}@example.com", semester="2", mobile_number=f"90000002{i:02d}",
+            family_members="0")).status_code for i in range(3)]
+        self.assertEqual(spoofed, [200, 429, 429])
+
+        behind_proxy = campus.ProxyFix(campus.app.wsgi_app, x_for=1)
+        with mock.patch.object(campus.app, "wsgi_app", behind_proxy):
+            forwarded = [self.client.post("/pay", headers={"X-Forwarded-For": f"1.2.3.4, 10.9.1.{i}"}, data=dict(
+                name="R", email=f"p{i}@example.com", semester="2", mobile_number=f"90000003{i:02d}",
+                family_members="0")).status_code for i in range(3)]
+        self.assertEqual(forwarded, [200, 200, 200])
+
+    def test_global_limit_applies_across_ips(self):
+        campus.app.config.update(PAY_GLOBAL_RATE=0.01, PAY_GLOBAL_BURST=1)
+        self.assertEqual(self.pay(ip="10.0.0.1", i=1).status_code, 200)
+        resp = self.pay(ip="10.0.0.2", i=2)
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreaterEqual(int(resp.headers["Retry-After"]), 1)
+
+    def test_sheds_with_503_when_too_much_in_flight(self):
+        campus.app.config["PAY_MAX_IN_FLIGHT"] = 1
+        self.addCleanup(campus.app.config.__setitem__, "PAY_MAX_IN_FLIGHT", 8)
+        self.assertTrue(campus.pay_in_flight.try_enter(1))
+        self.addCleanup(campus.pay_in_flight.leave)
+
+        with mock.patch.object(campus.db, "session") as session:
+            resp = self.pay()
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "2")
+        self.assertEqual(session.mock_calls, [])
+        self.assertEqual(self.razorpay.orders, [])
+
+
+# ---------------- Availability check ----------------
+class AvailabilityCheckTests(AppTestCase):
+    def test_reports_taken_contacts_after_normalizing(self):
+        self.add_student("A1", email="Asha@Example.com", mobile_number="98765 43210")
+
+        taken = self.client.get("/check-availability", query_string={
+            "email": "  asha@example.COM ", "mobile_number": "98765-43210"}).get_json()
+        free = self.client.get("/check-availability", query_string={"email": "new@example.com"}).get_json()
+
+        self.assertEqual(taken, {"email_available": False, "mobile_available": False})
+        self.assertEqual(free, {"email_available": True})
+
+    def test_repeated_checks_are_served_from_cache(self):
+        with mock.patch.object(campus, "find_registered_contact", wraps=campus.find_registered_contact) as lookup:
+            for _ in range(5):
+                self.client.get("/check-availability", query_string={"email": "same@example.com"})
+        self.assertEqual(lookup.call_count, 1)
+
+    def test_completed_registration_updates_cache(self):
+        self.client.get("/check-availability", query_string={"email": "riya@example.com"})
+        order = self.register()
+        self.client.post("/payment-success", data={"razorpay_payment_id": "pay_1", "razorpay_order_id": order["id"]})
+
+        resp = self.client.get("/check-availability", query_string={"email": "RIYA@example.com"}).get_json()
+        self.assertEqual(resp, {"email_available": False})
+
+    def test_pay_rejects_duplicates_that_differ_only_in_formatting(self):
+        self.add_student("A1", email="riya@example.com", mobile_number="9876543210")
+        resp = self.client.post("/pay", data=dict(
+            name="Riya", email=" Riya@Example.com", semester="3", mobile_number="1111111111", family_members="0"))
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.razorpay.orders, [])
+
+    def test_lookups_are_unique_index_point_lookups(self):
+        for column in (campus.Student.email_normalized, campus.Student.mobile_e164):
+            query = campus.db.session.query(campus.Student.id).filter(column == "x")
+            sql = str(query.statement.compile(campus.db.engine, compile_kwargs={"literal_binds": True}))
+            plan = " ".join(row[-1] for row in campus.db.session.execute(campus.db.text("EXPLAIN QUERY PLAN " + sql)))
+            self.assertIn(f"USING COVERING INDEX ix_student_{column.name}", plan)
+
+
+# ---------------- Normalized contact columns ----------------
+LEGACY_STUDENT_TABLE = """
+CREATE TABLE student (
+    id INTEGER NOT NULL, unique_id VARCHAR(100), name VARCHAR(100), email VARCHAR(100),
+    semester INTEGER, mobile_number VARCHAR(15), family_members INTEGER, attended BOOLEAN,
+    upi_id VARCHAR(100), transaction_id VARCHAR(100), razorpay_order_id VARCHAR(100),
+    payment_status VARCHAR(50), refund_id VARCHAR(100), refunded BOOLEAN,
+    PRIMARY KEY (id), UNIQUE (unique_id)
+)"""
+
+
+class NormalizedContactTests(AppTestCase):
+    def test_normalize_mobile_to_e164(self):
+        for raw in ("9876543210", "+91 98765 43210", "098765-43210", "919876543210", "0091 9876543210"):
+            self.assertEqual(campus.normalize_mobile(raw), "+919876543210", raw)
+        self.assertEqual(campus.normalize_mobile("+1 (415) 555-0100"), "+14155550100")
+
+    def test_columns_are_filled_on_write(self):
+        student = self.add_student("A1", email=" Asha@Example.COM ", mobile_number="98765 43210")
+        self.assertEqual((student.email_normalized, student.mobile_e164), ("asha@example.com", "+919876543210"))
+
+        student.mobile_number = "+91 90000 00000"
+        campus.db.session.commit()
+        self.assertEqual(student.mobile_e164, "+919000000000")
+
+    def test_legacy_duplicate_left_unnormalized_can_still_be_updated(self):
+        self.add_student("A1", email="a@x.com", mobile_number="9876543210")
+        dup = self.add_student("A2", email="b@x.com", mobile_number="9000000000")
+        # as the backfill leaves an old row whose email another row already had
+        campus.db.session.execute(campus.db.text(
+            "UPDATE student SET email = 'A@x.com', email_normalized = NULL WHERE id = :id"), {"id": dup.id})
+        campus.db.session.commit()
+
+        resp = self.client.get("/verify/A2")
+        self.assertEqual(resp.status_code, 200)
+        campus.db.session.expire_all()
+        row = campus.db.session.get(campus.Student, dup.id)
+        self.assertTrue(row.attended)
+        self.assertIsNone(row.email_normalized)
+
+    def test_same_contact_in_different_formats_is_rejected(self):
+        self.add_student("A1", email="a@x.com", mobile_number="9876543210")
+        with self.assertRaises(campus.IntegrityError):
+            self.add_student("A2", email="A@X.com ", mobile_number="9000000000")
+        campus.db.session.rollback()
+
+    def test_admin_search_matches_any_format(self):
+        self.add_student("A1", name="Asha", email="asha@x.com", mobile_number="9876543210")
+        self.add_student("B2", name="Bala", email="bala@x.com", mobile_number="9000000000")
+        client = campus.app.test_client()
+        with client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+        for q in ("ASHA@x.com", "+91 98765 43210", "A1"):
+            page = client.get("/admin", query_string={"q": q}).get_data(as_text=True)
+            self.assertIn("Asha", page, q)
+            self.assertNotIn("Bala", page, q)
+
+    def test_migration_backfills_old_rows_in_batches(self):
+        campus.db.drop_all()
+        with campus.db.engine.begin() as conn:
+            conn.execute(campus.db.text(LEGACY_STUDENT_TABLE))
+            conn.execute(campus.db.text(
+                "INSERT INTO student (id, unique_id, email, mobile_number) VALUES "
+                "(1, 'U1', 'A@x.com ', '+91 98765 43210'), (2, 'U2', 'a@x.com', '9000000000'), "
+                "(3, 'U3', 'c@x.com', '98765-43210'), (4, 'U4', NULL, NULL)"))
+
+        with mock.patch.object(campus, "backfill_normalized_contacts",
+                               partial(campus.backfill_normalized_contacts, batch_size=2)), \
+                mock.patch("builtins.print"):
+            campus.init_db()
+
+        rows = campus.db.session.execute(campus.db.text(
+            "SELECT id, email_normalized, mobile_e164 FROM student ORDER BY id")).all()
+        self.assertEqual([tuple(r) for r in rows], [
+            (1, "a@x.com", "+919876543210"),
+            (2, None, "+919000000000"),   # duplicate email: older row keeps it
+            (3, "c@x.com", None),         # duplicate mobile
+            (4, None, None),
+        ])
+        index_names = {r[0] for r in campus.db.session.execute(campus.db.text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'student'"))}
+        self.assertTrue({"ix_student_email_normalized", "ix_student_mobile_e164"} <= index_names)
+
+
+# ---------------- Admin search ----------------
+class AdminSearchTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.asha = self.add_student("MSCCAIT2025-aa11", name="Asha Kumari", email="asha.k@x.com",
+                                     mobile_number="9876543210", semester=1)
+        self.ashok = self.add_student("MSCCAIT2025-bb22", name="Ashok Rao", email="rao@x.com",
+                                      mobile_number="9123456780", semester=3)
+        self.client = campus.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+    def search(self, **params):
+        resp = self.client.get("/admin/search", query_string=params)
+        self.assertEqual(resp.status_code, 200)
+        return [r["unique_id"] for r in resp.get_json()["results"]]
+
+    def test_prefix_matches_any_field(self):
+        self.assertEqual(set(self.search(q="ash")), {"MSCCAIT2025-aa11", "MSCCAIT2025-bb22"})
+        self.assertEqual(self.search(q="asha.k@"), ["MSCCAIT2025-aa11"])
+        self.assertEqual(self.search(q="98765 43"), ["MSCCAIT2025-aa11"])
+        self.assertEqual(self.search(q="+9191234"), ["MSCCAIT2025-bb22"])
+        self.assertEqual(self.search(q="bb2"), ["MSCCAIT2025-bb22"])
+        self.assertEqual(self.search(q="ashok r"), ["MSCCAIT2025-bb22"])
+        self.assertEqual(self.search(q='"; drop'), [])
+
+    def test_limit_and_semester_filter(self):
+        self.assertEqual(len(self.search(q="ash", limit=1)), 1)
+        self.assertEqual(self.search(q="ash", semester=1), ["MSCCAIT2025-aa11"])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.asha.name = "Meera"
+        campus.db.session.commit()
+        self.assertEqual(self.search(q="meer"), ["MSCCAIT2025-aa11"])
+        self.assertEqual(self.search(q="kumari"), [])
+
+        campus.db.session.delete(self.ashok)
+        campus.db.session.commit()
+        self.assertEqual(self.search(q="ashok"), [])
+
+    def test_rebuilt_student_table_reindexes(self):
+        campus.db.session.remove()
+        campus.db.drop_all()
+        campus.init_db()
+        self.assertEqual(self.search(q="ash"), [])
+        self.add_student("MSCCAIT2025-cc33", name="Ashwin")
+        self.assertEqual(self.search(q="ash"), ["MSCCAIT2025-cc33"])
+
+    def test_requires_admin(self):
+        resp = campus.app.test_client().get("/admin/search?q=ash")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_refund_page_search_is_semester_one_only(self):
+        page = self.client.get("/admin/refunds", query_string={"q": "ash"}).get_data(as_text=True)
+        self.assertIn("Asha Kumari", page)
+        self.assertNotIn("Ashok Rao", page)
+
+
+# ---------------- Admin dashboard ----------------
+class AdminDashboardTests(AppTestCase):
+    def test_counts_come_from_one_grouped_query(self):
+        for i, (semester, attended) in enumerate([(1, True), (1, False), (1, False), (3, True), (8, False), (None, True)]):
+            self.add_student(f"D{i}", semester=semester, attended=attended)
+        client = campus.app.test_client()
+        with client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+        with mock.patch.object(campus, "render_template", return_value="") as render:
+            client.get("/admin-dashboard")
+        context = render.call_args.kwargs
+        self.assertEqual((context["total_students"], context["total_present"], context["total_absent"]), (6, 3, 3))
+        self.assertEqual(context["sem_stats"], {
+            1: {"present": 1, "absent": 2},
+            3: {"present": 1, "absent": 0},
+            8: {"present": 0, "absent": 1},
+        })
+
+    def test_grouping_scans_the_covering_index(self):
+        plan = " ".join(row[-1] for row in campus.db.session.execute(campus.db.text(
+            "EXPLAIN QUERY PLAN SELECT semester, attended, count(id) FROM student "
+            "GROUP BY semester, attended")))
+        self.assertIn("COVERING INDEX ix_student_semester_attended", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+# ---------------- Read models ----------------
+class ReadModelTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            self.add_student(f"R{i}", name=f"Reader {i}", semester=1 if i % 2 else 2,
+                             family_members=i, payment_status="Paid" if i < 4 else "Pending")
+        campus.db.session.expunge_all()
+
+    def test_rows_are_plain_tuples_outside_the_session(self):
+        rows = list(campus.iter_read_rows(campus.StudentListRow, campus.Student.semester == 1,
+                                          order_by=campus.Student.id, chunk_size=1))
+        self.assertEqual([r.unique_id for r in rows], ["R1", "R3"])
+        self.assertIsInstance(rows[0], tuple)
+        self.assertEqual(len(campus.db.session.identity_map), 0)
+
+    def test_csv_export_streams_every_row(self):
+        with mock.patch.object(campus.app, "root_path", _TMP_DIR):
+            resp = campus.app.test_client().get("/export/csv")
+        lines = resp.get_data(as_text=True).splitlines()
+        resp.close()
+        self.assertEqual(lines[0], "ID,Name,Semester,Family Members,Payment Status,Amount")
+        self.assertEqual(len(lines), 6)
+        self.assertIn("5,Reader 4,2,4,Pending,0", lines)
+
+    def test_admin_panel_lists_newest_first(self):
+        client = campus.app.test_client()
+        with client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+        page = client.get("/admin").get_data(as_text=True)
+        self.assertLess(page.index("Reader 4"), page.index("Reader 0"))
+
+
+# ---------------- Streamed admin pages ----------------
+class StreamedAdminPageTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(30):
+            self.add_student(f"S{i:02d}", name=f"Streamed {i:02d}", semester=1)
+        for key, value in (("TEMPLATE_STREAM_BUFFER", 1024), ("READ_MODEL_CHUNK", 4)):
+            self.addCleanup(campus.app.config.__setitem__, key, campus.app.config[key])
+            campus.app.config[key] = value
+        self.client = campus.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+    def test_header_is_sent_before_rows_are_read(self):
+        for url in ("/admin", "/admin/refunds"):
+            fetched = []
+            real_make = campus.StudentListRow._make
+            with mock.patch.object(campus.StudentListRow, "_make",
+                                   side_effect=lambda row: fetched.append(row) or real_make(row)):
+                resp = self.client.get(url)
+                self.assertTrue(resp.is_streamed)
+                chunks = (chunk.decode() for chunk in resp.response)
+                first = next(chunks)
+                self.assertIn("<html", first)
+                self.assertEqual(fetched, [], url)
+                body = first + "".join(chunks)
+                resp.close()
+            self.assertEqual(len(fetched), 30)
+            self.assertIn("Streamed 00", body)
+            self.assertIn("Streamed 29", body)
+            self.assertTrue(body.rstrip().endswith("</html>"))
+
+
+# ---------------- Time series ----------------
+class TimeseriesTests(AppTestCase):
+    T0 = datetime(2025, 3, 1, 9, 0)
+
+    def at(self, minutes):
+        return self.T0 + timedelta(minutes=minutes)
+
+    def setUp(self):
+        super().setUp()
+        self.add_student("T1", family_members=2, created_at=self.at(5), attended_at=self.at(70))
+        self.add_student("T2", created_at=self.at(30), refunded_at=self.at(65),
+                         refunded=True, payment_status="Refunded")
+        self.add_student("T3", created_at=self.at(130), attended_at=self.at(135))
+        self.add_student("T4", created_at=self.at(140), payment_status="Pending")
+        campus.backfill_ledger()
+
+    def test_hourly_buckets(self):
+        series = campus.timeseries("hour", self.T0, self.at(180), now=self.at(600))
+        self.assertEqual(series["labels"], ["2025-03-01T09:00:00", "2025-03-01T10:00:00", "2025-03-01T11:00:00"])
+        self.assertEqual(series["registrations"], [2, 0, 2])
+        self.assertEqual(series["revenue"], [400, 0, 100])
+        self.assertEqual(series["refunds"], [0, 1, 0])
+        self.assertEqual(series["refunded_amount"], [0, 100, 0])
+        self.assertEqual(series["checkins"], [0, 1, 1])
+
+    def test_daily_buckets_floor_the_start(self):
+        series = campus.timeseries("day", self.at(300), datetime(2025, 3, 3), now=self.at(24 * 60 * 10))
+        self.assertEqual(series["labels"], ["2025-03-01T00:00:00", "2025-03-02T00:00:00"])
+        self.assertEqual(series["registrations"], [4, 0])
+        self.assertEqual(series["checkins"], [2, 0])
+
+    def test_closed_buckets_are_never_recomputed(self):
+        now = self.at(150)  # the 11:00 bucket is still open
+        with mock.patch.object(campus, "_timeseries_events", wraps=campus._timeseries_events) as events:
+            campus.timeseries("hour", self.T0, self.at(180), now=now)
+            self.add_student("T5", created_at=self.at(10))  # late write into a closed bucket
+            self.add_student("T6", created_at=self.at(145))
+            series = campus.timeseries("hour", self.T0, self.at(180), now=now)
+        self.assertEqual(series["registrations"], [2, 0, 3])
+        self.assertEqual([c.args for c in events.call_args_list],
+                         [(self.T0, self.at(180)), (self.at(120), self.at(180))])
+
+        with mock.patch.object(campus, "_timeseries_events") as events:
+            campus.timeseries("hour", self.T0, self.at(120), now=now)
+        events.assert_not_called()
+
+    def test_endpoint(self):
+        client = campus.app.test_client()
+        self.assertEqual(client.get("/timeseries").status_code, 401)
+        with client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+        data = client.get("/timeseries", query_string={
+            "bucket": "hour", "start": "2025-03-01T14:30:00+05:30", "end": "2025-03-01T12:00:00Z"}).get_json()
+        self.assertEqual(data["bucket"], "hour")
+        self.assertEqual(data["registrations"], [2, 0, 2])
+        self.assertEqual(len(client.get("/timeseries").get_json()["labels"]), 30)
+        self.assertEqual(client.get("/timeseries?bucket=week").status_code, 400)
+
+    def test_attendance_and_dashboard_sparklines(self):
+        self.add_student("T7")
+        campus.app.test_client().get("/verify/T7")
+        self.assertIsNotNone(campus.Student.query.filter_by(unique_id="T7").one().attended_at)
+
+        data = campus.app.test_client().get("/dashboard_data").get_json()
+        self.assertEqual(len(data["total_students_values"]), 7)
+        self.assertEqual(data["total_students_values"][-1], 1)
+
+    def test_paid_students_sparkline_is_a_running_count(self):
+        yesterday = datetime.utcnow() - timedelta(days=1)
+        for uid in ("R1", "R2", "R3"):
+            self.add_student(uid, created_at=yesterday)
+        refunded = campus.Student.query.filter_by(unique_id="R1").one()
+        campus.apply_refund(refunded, "rfnd_1", 10000)
+        campus.db.session.commit()
+
+        data = campus.app.test_client().get("/dashboard_data").get_json()
+        # T1 / T3 paid long before, 3 more yesterday, one refunded today: a count, not +3 / -1
+        self.assertEqual(data["paid_not_refunded_values"][-3:], [2, 5, 4])
+        self.assertEqual(data["paid_not_refunded_values"][-1], data["paid_not_refunded"])
+
+
+# ---------------- Gate throughput ----------------
+class GateThroughputTests(AppTestCase):
+    NOW = datetime(2025, 3, 1, 10, 0, 30)
+
+    def log(self, gate, minutes_ago, count=1):
+        for _ in range(count):
+            campus.db.session.add(campus.AttendanceLog(
+                student_id=0, gate=gate, marked_at=self.NOW - timedelta(minutes=minutes_ago)))
+        campus.db.session.commit()
+
+    def test_checkins_are_logged_with_their_gate(self):
+        for uid in ("G1", "G2", "G3"):
+            self.add_student(uid)
+        client = campus.app.test_client()
+        client.get("/verify/G1?gate=North")
+        client.get("/scanner?gate=%20South%20")
+        client.get("/verify/G2")
+        client.get("/verify/G2?gate=East")  # already attended: not logged again
+        campus.mark_attendance_batch(["G3", "G3"], ["West", "North"])
+
+        logs = campus.db.session.query(campus.Student.unique_id, campus.AttendanceLog.gate) \
+            .join(campus.Student, campus.Student.id == campus.AttendanceLog.student_id) \
+            .order_by(campus.AttendanceLog.id).all()
+        self.assertEqual([tuple(r) for r in logs], [("G1", "North"), ("G2", "South"), ("G3", "West")])
+
+    def test_rates_and_time_to_clear(self):
+        for i in range(30):
+            self.add_student(f"R{i}")
+        self.log("North", 0, 6)
+        self.log("North", 2, 4)
+        self.log("South", 1, 5)
+        self.log("South", 9)      # outside the 5 minute rolling window
+        self.log("South", 45)     # outside the 30 minute window
+
+        stats = campus.gate_throughput(now=self.NOW)
+        self.assertEqual(len(stats["minutes"]), 30)
+        self.assertEqual(stats["minutes"][-1], "2025-03-01T10:00:00")
+        self.assertEqual(stats["per_minute"]["North"][-3:], [4, 0, 6])
+        self.assertEqual(stats["per_minute"]["South"][-10:-8], [1, 0])
+        self.assertEqual(stats["rate_per_minute"], {"North": 2.0, "South": 1.0})
+        self.assertEqual(stats["remaining"], 30)
+        self.assertEqual(stats["minutes_to_clear"], 10.0)
+
+    def test_refresh_reads_only_new_log_rows(self):
+        self.log("North", 0, 3)
+        campus.gate_throughput(now=self.NOW)
+        self.log("North", 0, 2)
+        with mock.patch.object(campus.db.session, "execute", wraps=campus.db.session.execute) as execute:
+            stats = campus.gate_throughput(now=self.NOW)
+        self.assertEqual(stats["per_minute"]["North"][-1], 5)
+        log_read = execute.call_args_list[0].args[0]
+        self.assertIn("attendance_log.id >", str(log_read))
+        self.assertEqual(campus.gate_stats.last_id, 5)
+
+    def test_endpoint(self):
+        client = campus.app.test_client()
+        self.assertEqual(client.get("/admin/gates").status_code, 401)
+        with client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+        data = client.get("/admin/gates?window=10").get_json()
+        self.assertEqual(len(data["minutes"]), 10)
+        self.assertIsNone(data["minutes_to_clear"])
+
+
+# ---------------- Payment ledger ----------------
+class LedgerTests(AppTestCase):
+    def pay(self, payment_id, **fields):
+        order = self.register(**fields)
+        self.client.post("/payment-success", data={
+            "razorpay_payment_id": payment_id, "razorpay_order_id": order["id"]})
+        return campus.Student.query.filter_by(transaction_id=payment_id).one()
+
+    def admin_client(self):
+        client = campus.app.test_client()
+        with client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+        return client
+
+    def balances(self):
+        return dict(campus.db.session.execute(
+            campus.db.select(campus.LedgerAccount.name, campus.LedgerAccount.balance)).all())
+
+    def test_charge_and_refund_post_balanced_legs_with_running_balances(self):
+        riya = self.pay("pay_1")                                   # 1 + 1 family: 20000 paise
+        self.pay("pay_2", email="b@example.com", mobile_number="9000000001", family_members="0")
+        with mock.patch.object(campus, "admin_required", return_value=True):
+            self.client.post(f"/process_refund/{riya.id}")
+
+        self.assertEqual(self.balances(), {"razorpay": 10000, "ticket_revenue": -30000, "refunds": 20000})
+        legs = campus.LedgerEntry.query.filter_by(account="razorpay").order_by(campus.LedgerEntry.id).all()
+        self.assertEqual([(e.kind, e.amount, e.balance_after) for e in legs],
+                         [("charge", 20000, 20000), ("charge", 10000, 30000), ("refund", -20000, 10000)])
+        self.assertEqual(legs[-1].reference, self.razorpay.refunds[0]["id"])
+        self.assertEqual(campus.ledger_totals(), {"gross": 300.0, "refunded": 200.0, "collected": 100.0})
+        self.assertEqual(campus.reconcile_ledger(), [])
+
+    def test_webhook_posts_the_captured_amount(self):
+        order = self.register(family_members="0")
+        body = json.dumps({"event": "payment.captured", "payload": {"payment": {"entity": {
+            "id": "pay_hook", "order_id": order["id"], "amount": 9000}}}})
+        signature = hmac.new(b"whsec", body.encode(), hashlib.sha256).hexdigest()
+        with mock.patch.object(campus, "RAZORPAY_WEBHOOK_SECRET", "whsec"):
+            self.client.post("/razorpay-webhook", data=body, content_type="application/json",
+                             headers={"X-Razorpay-Signature": signature})
+
+        self.assertEqual(campus.ledger_totals()["collected"], 90.0)
+        self.assertEqual([i["check"] for i in campus.reconcile_ledger()], ["amount_mismatch"])
+
+    def test_payment_success_posts_the_captured_amount(self):
+        order = self.register(family_members="0")
+        self.razorpay.payments.append({"id": "pay_cb", "order_id": order["id"], "amount": 9000, "status": "captured"})
+        with self.assertLogs("campusconnect", "WARNING") as logs:
+            self.client.post("/payment-success", data={"razorpay_payment_id": "pay_cb", "razorpay_order_id": order["id"]})
+
+        self.assertIn("registration.amount_mismatch", [r.msg for r in logs.records])
+        self.assertEqual(campus.ledger_totals()["collected"], 90.0)
+        self.assertEqual([i["check"] for i in campus.reconcile_ledger()], ["amount_mismatch"])
+
+    def test_reports_agree_with_the_ledger(self):
+        self.pay("pay_1")
+        self.pay("pay_2", email="b@example.com", mobile_number="9000000001", family_members="3")
+        client = self.admin_client()
+
+        dashboard = client.get("/dashboard_data").get_json()
+        with mock.patch.object(campus.app, "root_path", _TMP_DIR):
+            resp = client.get("/export/csv")
+            csv_rows = resp.get_data(as_text=True).splitlines()[1:]
+            resp.close()
+            with mock.patch.object(campus, "Table", wraps=campus.Table) as table:
+                client.get("/export/pdf").close()
+        pdf_total = table.call_args.args[0][-1][-1]
+
+        self.assertEqual(dashboard["total_amount_collected"], 600.0)
+        self.assertEqual(sum(float(r.rsplit(",", 1)[1]) for r in csv_rows), 600.0)
+        self.assertEqual(pdf_total, "₹600")
+        self.assertEqual(client.get("/admin/ledger").get_json(),
+                         {"totals": {"gross": 600.0, "refunded": 0.0, "collected": 600.0},
+                          "issues": [], "ok": True})
+
+    def test_backfill_posts_existing_registrations_once(self):
+        self.add_student("B1", family_members=2, transaction_id="pay_b1")
+        self.add_student("B2", refunded=True, payment_status="Refunded", refund_id="rfnd_b2")
+        self.add_student("B3", payment_status="Pending")
+
+        self.assertEqual(campus.backfill_ledger(batch_size=1), 2)
+        self.assertEqual(campus.backfill_ledger(), 0)
+        self.assertEqual(self.balances(), {"razorpay": 30000, "ticket_revenue": -40000, "refunds": 10000})
+        self.assertEqual(sorted(e.reference for e in campus.LedgerEntry.query.filter_by(account="razorpay")),
+                         ["backfill:2:charge", "pay_b1", "rfnd_b2"])
+
+    def test_reconcile_flags_mismatches(self):
+        self.add_student("M1")                                     # paid, never charged
+        self.add_student("M2", refunded=True, payment_status="Refunded")
+        campus.record_charge(campus.Student.query.filter_by(unique_id="M2").one().id, 10000, "pay_m2")
+        campus.db.session.execute(campus.update(campus.LedgerAccount)
+                                  .where(campus.LedgerAccount.name == "refunds").values(balance=5))
+        campus.db.session.commit()
+
+        checks = sorted(i["check"] for i in campus.reconcile_ledger())
+        self.assertEqual(checks, ["balance_drift", "missing_charge", "missing_refund"])
+        self.assertFalse(self.admin_client().get("/admin/ledger").get_json()["ok"])
+        self.assertEqual(campus.app.test_client().get("/admin/ledger").status_code, 401)
+
+    def test_unbalanced_posting_is_rejected(self):
+        with self.assertRaises(ValueError):
+            campus._post_ledger("x", "charge", None, [("razorpay", 100), ("ticket_revenue", -90)])
+
+
+# ---------------- Razorpay reconciliation ----------------
+class RazorpayReconcileTests(AppTestCase):
+    NOW = datetime(2025, 3, 1, 12, 0)
+
+    def payment(self, payment_id, order_id, minutes_ago=30, status="captured", amount=10000):
+        self.razorpay.payments.append({
+            "id": payment_id, "entity": "payment", "order_id": order_id, "amount": amount,
+            "status": status, "vpa": "x@upi",
+            "created_at": int((self.NOW - timedelta(minutes=minutes_ago)).replace(tzinfo=campus.timezone.utc).timestamp())})
+
+    def reconcile(self, **kwargs):
+        return campus.reconcile_razorpay(self.NOW - timedelta(days=1), self.NOW, **kwargs)
+
+    def setUp(self):
+        super().setUp()
+        self.add_student("OK1", transaction_id="pay_ok", razorpay_order_id="order_ok",
+                         created_at=self.NOW - timedelta(minutes=29))
+        campus.backfill_ledger()
+        self.payment("pay_ok", "order_ok")
+
+    def test_clean_range_reports_nothing(self):
+        self.assertEqual(self.reconcile(), {"missing_student": [], "refunded_at_razorpay": [], "partial_refund": [],
+                                            "not_captured": [], "double_capture": [], "unknown_payment": [],
+                                            "repaired": []})
+
+    def test_other_attempts_on_a_registered_order(self):
+        self.payment("pay_first_try", "order_ok", minutes_ago=35, status="failed")
+        self.assertEqual(self.reconcile()["not_captured"], [])
+
+        self.payment("pay_again", "order_ok", minutes_ago=28)
+        report = self.reconcile()
+        self.assertEqual(report["not_captured"], [])
+        self.assertEqual([(e["payment_id"], e["registered_payment_id"]) for e in report["double_capture"]],
+                         [("pay_again", "pay_ok")])
+
+    def test_diff_report(self):
+        order = self.register(family_members="0")
+        self.payment("pay_lost", order["id"])                     # callback and webhook never arrived
+        self.payment("pay_orphan", "order_gone")                  # no local trace at all
+        self.payment("pay_failed", "order_failed", status="failed")
+        self.add_student("NC", transaction_id="pay_nc", razorpay_order_id="order_nc",
+                         created_at=self.NOW - timedelta(hours=2))
+        self.payment("pay_nc", "order_nc", status="failed")
+        self.add_student("GHOST", transaction_id="pay_ghost", created_at=self.NOW - timedelta(hours=3))
+        self.razorpay.refunds.append({"id": "rfnd_oob", "payment_id": "pay_ok", "amount": 10000,
+                                      "status": "processed", "created_at": self.razorpay.payments[0]["created_at"] + 60})
+
+        report = self.reconcile()
+
+        self.assertEqual(sorted(e["payment_id"] for e in report["missing_student"]), ["pay_lost", "pay_orphan"])
+        self.assertEqual([e["refund_id"] for e in report["refunded_at_razorpay"]], ["rfnd_oob"])
+        self.assertEqual([e["unique_id"] for e in report["not_captured"]], ["NC"])
+        self.assertEqual([e["unique_id"] for e in report["unknown_payment"]], ["GHOST"])
+        self.assertEqual(campus.Student.query.filter_by(refunded=True).count(), 0)
+
+    def test_repair(self):
+        order = self.register(family_members="0")
+        self.payment("pay_lost", order["id"], amount=10000)
+        self.payment("pay_orphan", "order_gone")
+        self.razorpay.refunds.append({"id": "rfnd_oob", "payment_id": "pay_ok", "amount": 10000,
+                                      "status": "processed", "created_at": self.razorpay.payments[0]["created_at"] + 60})
+
+        with mock.patch.object(campus, "generate_qr_code"), mock.patch.object(campus, "generate_pdf"), \
+                mock.patch.object(campus, "append_to_csv"):
+            report = self.reconcile(repair=True)
+
+        self.assertEqual([(e["check"], e["payment_id"]) for e in report["repaired"]],
+                         [("missing_student", "pay_lost"), ("refunded_at_razorpay", "pay_ok")])
+        self.assertEqual([e["payment_id"] for e in report["missing_student"]], ["pay_orphan"])
+        self.assertEqual(campus.Student.query.filter_by(transaction_id="pay_lost").one().payment_status, "Paid")
+        ok = campus.Student.query.filter_by(unique_id="OK1").one()
+        self.assertEqual((ok.refunded, ok.refund_id), (True, "rfnd_oob"))
+        # applied now, so it lands in an open time-series bucket rather than a cached closed one
+        self.assertGreater(ok.refunded_at, self.NOW)
+        self.assertEqual(report["repaired"][1]["refunded_at"], "2025-03-01T11:31:00")
+        self.assertEqual(campus.ledger_totals()["collected"], 100.0)
+        self.assertEqual(campus.reconcile_ledger(), [])
+        self.assertEqual(self.reconcile()["refunded_at_razorpay"], [])
+
+    def test_partial_refunds_are_reported_not_repaired(self):
+        created = self.razorpay.payments[0]["created_at"]
+        self.razorpay.refunds.append({"id": "rfnd_part", "payment_id": "pay_ok", "amount": 4000,
+                                      "status": "processed", "created_at": created + 60})
+
+        report = self.reconcile(repair=True)
+        self.assertEqual([(e["refund_id"], e["amount"], e["paid"]) for e in report["partial_refund"]],
+                         [("rfnd_part", 4000, 10000)])
+        self.assertEqual(report["repaired"], [])
+        self.assertFalse(campus.Student.query.filter_by(unique_id="OK1").one().refunded)
+
+        # the rest refunded later: together they are a full refund
+        self.razorpay.refunds.append({"id": "rfnd_rest", "payment_id": "pay_ok", "amount": 6000,
+                                      "status": "processed", "created_at": created + 120})
+        report = self.reconcile(repair=True)
+        self.assertEqual(report["partial_refund"], [])
+        self.assertEqual([(e["check"], e["amount"]) for e in report["repaired"]], [("refunded_at_razorpay", 10000)])
+        self.assertEqual(campus.ledger_totals()["collected"], 0.0)
+        self.assertEqual(campus.reconcile_ledger(), [])
+
+    def test_pages_every_slice_once(self):
+        for i in range(7):
+            self.payment(f"pay_{i}", f"order_{i}", minutes_ago=i * 60)
+        with mock.patch.object(campus, "RAZORPAY_PAGE_SIZE", 2):
+            payments = campus.fetch_razorpay("payment", self.NOW - timedelta(hours=8), self.NOW,
+                                             workers=3, slice_seconds=3 * 3600)
+        self.assertEqual(sorted(p["id"] for p in payments), sorted(["pay_ok"] + [f"pay_{i}" for i in range(7)]))
+        windows = sorted({(c["from"], c["to"]) for c in self.razorpay.list_calls})
+        self.assertEqual(len(windows), 3)
+        self.assertTrue(all(a[1] < b[0] for a, b in zip(windows, windows[1:])))
+
+    def test_cli(self):
+        self.payment("pay_orphan", "order_gone")
+        report_path = os.path.join(_TMP_DIR, "reconcile.json")
+        result = campus.app.test_cli_runner().invoke(args=[
+            "reconcile-razorpay", "--since", "2025-02-28 12:00:00", "--until", "2025-03-01 12:00:00",
+            "--report", report_path])
+        self.assertEqual(result.exit_code, 1, result.output)
+        self.assertIn("missing_student", result.output)
+        with open(report_path) as f:
+            self.assertEqual(json.load(f)["missing_student"][0]["payment_id"], "pay_orphan")
+
+
+# ---------------- Metrics ----------------
+class MetricsTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        shutil.rmtree(campus.metrics.directory, ignore_errors=True)
+        campus.metrics._pid = None
+
+    def scrape(self, **kwargs):
+        resp = campus.app.test_client().get("/metrics", **kwargs)
+        self.assertEqual(resp.status_code, 200)
+        return dict(line.rsplit(" ", 1) for line in resp.get_data(as_text=True).splitlines()
+                    if not line.startswith("#"))
+
+    def test_requests_latency_and_queries(self):
+        self.client.get("/")
+        self.client.get("/")
+        self.client.get("/no-such-page")
+        self.client.get("/check-availability?email=new@example.com")
+        samples = self.scrape()
+
+        self.assertEqual(samples['campusconnect_http_requests_total{endpoint="home",method="GET",status="200"}'], "2")
+        self.assertEqual(samples['campusconnect_http_requests_total{endpoint="none",method="GET",status="404"}'], "1")
+        self.assertEqual(samples['campusconnect_http_request_duration_seconds_bucket{endpoint="home",le="+Inf"}'], "2")
+        self.assertEqual(samples['campusconnect_http_request_duration_seconds_count{endpoint="home"}'], "2")
+        buckets = [int(v) for k, v in samples.items()
+                   if k.startswith('campusconnect_http_request_duration_seconds_bucket{endpoint="home"')]
+        self.assertEqual(len(buckets), len(campus.Metrics.LATENCY_BUCKETS) + 1)
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertGreater(int(samples['campusconnect_db_queries_total{endpoint="check_availability"}']), 0)
+        self.assertEqual(samples["campusconnect_http_requests_in_flight"], "1")  # the scrape itself
+
+    def test_external_calls_are_timed(self):
+        self.register()
+        self.razorpay.order.create = mock.Mock(side_effect=RuntimeError("gateway down"))
+        with self.assertRaises(RuntimeError):
+            self.register(email="b@example.com", mobile_number="9000000001")
+        samples = self.scrape()
+        prefix = 'campusconnect_external_call_duration_seconds_count{service="razorpay",operation="order.create"'
+        self.assertEqual(samples[prefix + ',outcome="ok"}'], "1")
+        self.assertEqual(samples[prefix + ',outcome="error"}'], "1")
+
+    def test_worker_files_are_summed(self):
+        self.client.get("/")
+        for pid in (os.getppid(), 2 ** 22 + 1):  # a live and an exited worker
+            other = campus.MetricsFile(os.path.join(campus.metrics.directory, f"worker_{pid}.db"), size=64)
+            for _ in range(50):  # grows past the initial mapping
+                other.add('campusconnect_http_requests_total{endpoint="home",method="GET",status="200"}', 1)
+            other.add("campusconnect_http_requests_in_flight", 3)
+        samples = self.scrape()
+        self.assertEqual(samples['campusconnect_http_requests_total{endpoint="home",method="GET",status="200"}'], "101")
+        self.assertEqual(samples["campusconnect_http_requests_in_flight"], "4")
+
+    def test_starting_worker_folds_exited_workers_into_merged_file(self):
+        os.makedirs(campus.metrics.directory)
+        # an exited worker, and one from before a restart that had this worker's pid
+        for pid in (2 ** 22 + 1, os.getpid()):
+            other = campus.MetricsFile(os.path.join(campus.metrics.directory, f"worker_{pid}.db"))
+            other.add('campusconnect_db_queries_total{endpoint="home"}', 5)
+            other.add("campusconnect_http_requests_in_flight", 3)
+            other.close()
+
+        samples = self.scrape()
+        self.assertEqual(sorted(os.listdir(campus.metrics.directory)),
+                         [".lock", "merged.db", f"worker_{os.getpid()}.db"])
+        self.assertEqual(samples['campusconnect_db_queries_total{endpoint="home"}'], "10")
+        self.assertEqual(samples["campusconnect_http_requests_in_flight"], "1")  # only the scrape itself
+
+        campus.metrics._pid = None  # the next start merges again without counting anything twice
+        self.assertEqual(self.scrape()['campusconnect_db_queries_total{endpoint="home"}'], "10")
+
+    def test_token(self):
+        campus.app.config["METRICS_TOKEN"] = "s3cret"
+        self.addCleanup(campus.app.config.__setitem__, "METRICS_TOKEN", None)
+        self.assertEqual(campus.app.test_client().get("/metrics").status_code, 401)
+        self.scrape(headers={"Authorization": "Bearer s3cret"})
+
+
+# ---------------- Query diagnostics ----------------
+class QueryDiagnosticsTests(AppTestCase):
+    def configure(self, **values):
+        for key, value in values.items():
+            self.addCleanup(campus.app.config.__setitem__, key, campus.app.config[key])
+            campus.app.config[key] = value
+
+    def test_summary_header_only_in_debug(self):
+        self.assertNotIn("X-Query-Summary", self.client.get("/check-availability?email=a@b.co").headers)
+        self.configure(QUERY_DEBUG=True)
+        summary = self.client.get("/check-availability?email=c@d.co").headers["X-Query-Summary"]
+        self.assertRegex(summary, r"^count=[1-9]\d*; time_ms=[\d.]+; slowest_ms=[\d.]+; repeated=0$")
+
+    def test_repeated_statements_are_flagged(self):
+        self.configure(QUERY_DEBUG=True, NPLUSONE_THRESHOLD=6)
+        with self.assertLogs("campusconnect", "WARNING") as logs:
+            resp = self.client.get("/dashboard_data")
+        self.assertIn("repeated=1", resp.headers["X-Query-Summary"])
+        repeated = [r for r in logs.records if r.msg == "db.repeated_statement"]
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual((repeated[0].path, repeated[0].count), ("/dashboard_data", 6))
+        self.assertTrue(repeated[0].statement.startswith("SELECT count(student.id)"))
+
+    def test_streamed_pages_are_summarized_once_the_body_is_sent(self):
+        for i in range(3):
+            self.add_student(f"S{i}")
+        self.configure(QUERY_DEBUG=True)
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+        with self.assertLogs("campusconnect", "INFO") as logs:
+            resp = self.client.get("/admin")
+            self.assertNotIn("X-Query-Summary", resp.headers)
+            resp.get_data()
+            resp.close()
+
+        summaries = [r for r in logs.records if r.msg == "db.query_summary"]
+        self.assertEqual([r.path for r in summaries], ["/admin"])
+        # logged (and counted in /metrics) once, after the body, with all its queries
+        request_lines = [r for r in logs.records if r.msg == "request"]
+        self.assertEqual(len(request_lines), 1)
+        self.assertIn(f"count={request_lines[0].db_queries};", summaries[0].summary)
+
+    def test_slow_queries_are_logged_with_their_route(self):
+        self.configure(SLOW_QUERY_MS=0)
+        with self.assertLogs("campusconnect", "WARNING") as logs:
+            self.client.get("/check-availability?email=slow@example.com")
+        slow = [r for r in logs.records if r.msg == "db.slow_query"]
+        self.assertTrue(slow)
+        self.assertEqual((slow[0].route, slow[0].path), ("check_availability", "/check-availability"))
+        self.assertTrue(slow[0].statement.startswith("SELECT"))
+        self.assertGreater(slow[0].param_count, 0)
+        self.assertNotIn("slow@example.com", "".join(campus.JsonFormatter().format(r) for r in slow))
+
+    def test_failed_statements_leave_no_timing_behind(self):
+        self.configure(SLOW_QUERY_MS=0)
+        with campus.db.engine.connect() as conn:
+            for _ in range(3):
+                with self.assertRaises(campus.OperationalError):
+                    conn.exec_driver_sql("SELECT * FROM no_such_table")
+            with self.assertLogs("campusconnect", "WARNING") as logs:
+                conn.exec_driver_sql("SELECT 1")
+            self.assertNotIn("query_started", conn.info)
+        slow = [r for r in logs.records if r.msg == "db.slow_query"]
+        self.assertEqual(slow[0].statement, "SELECT 1")
+        self.assertLess(slow[0].duration_ms, 1000)
+
+
+# ---------------- Query plans ----------------
+class QueryPlanTests(AppTestCase):
+    """
+    EXPLAIN QUERY PLAN for every statement the hot routes issue, so a schema
+    or query change can't quietly turn an index lookup into a table scan.
+    """
+    # a bare full scan: "SCAN student" (SQLite < 3.36: "SCAN TABLE student")
+    FULL_SCAN = re.compile(r"SCAN (?:TABLE )?(\w+)$")
+    # one-row tables, always read whole
+    SMALL_TABLES = {"ledger_account", "event_capacity"}
+
+    def setUp(self):
+        super().setUp()
+        for i in range(30):
+            self.add_student(f"QP{i:02d}", name=f"Planned {i}", semester=i % 6 + 1, attended=i % 3 == 0,
+                             refunded=i % 10 == 0, payment_status="Refunded" if i % 10 == 0 else "Paid")
+        self.client = campus.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+    def plans(self, method, url, **kwargs):
+        """{statement: [plan detail, ...]} for each distinct statement the request ran."""
+        statements = {}
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+                statements.setdefault(statement, parameters)
+
+        event.listen(campus.db.engine, "before_cursor_execute", capture)
+        try:
+            resp = self.client.open(url, method=method, **kwargs)
+            resp.get_data()  # streamed pages run their queries while the body is read
+            resp.close()
+        finally:
+            event.remove(campus.db.engine, "before_cursor_execute", capture)
+        self.assertLess(resp.status_code, 500, url)
+        conn = campus.db.session.connection()
+        return {" ".join(statement.split()): [row[-1] for row in conn.exec_driver_sql(
+                    "EXPLAIN QUERY PLAN " + statement, parameters)]
+                for statement, parameters in statements.items()}
+
+    def assertIndexed(self, method, url, **kwargs):
+        plans = self.plans(method, url, **kwargs)
+        self.assertTrue(plans, url)
+        for statement, plan in plans.items():
+            for detail in plan:
+                match = self.FULL_SCAN.match(detail)
+                if match and match.group(1) not in self.SMALL_TABLES:
+                    self.fail(f"{method} {url} scans {match.group(1)}:\n  {statement}\n  {plan}")
+        return plans
+
+    def test_duplicate_check_uses_contact_indexes(self):
+        plans = self.assertIndexed("GET", "/check-availability?email=planned@example.com&mobile_number=9123456789")
+        used = " ".join(" ".join(plan) for plan in plans.values())
+        self.assertIn("ix_student_email_normalized", used)
+        self.assertIn("ix_student_mobile_e164", used)
+        self.assertIndexed("POST", "/pay", data=dict(name="Dup", email="QP01@example.com", semester="2",
+                                                     mobile_number="9123456789", family_members="0"))
+
+    def test_verify_lookup_is_a_unique_index_search(self):
+        plans = self.assertIndexed("GET", "/verify/QP01")
+        self.assertTrue(any("(unique_id=?)" in " ".join(plan) for plan in plans.values()), plans)
+
+    def test_refund_listing_and_processing(self):
+        plans = self.assertIndexed("GET", "/admin/refunds")
+        self.assertIn("ix_student_semester_attended (semester=?)", " ".join(sum(plans.values(), [])))
+        self.assertIndexed("GET", "/admin/refunds?q=planned")
+        student = campus.Student.query.filter_by(unique_id="QP06").one()
+        self.assertIndexed("POST", f"/process_refund/{student.id}")
+
+    def test_dashboard_aggregates(self):
+        for url in ("/dashboard_data", "/admin-dashboard", "/timeseries", "/admin/gates"):
+            self.assertIndexed("GET", url)
+
+    def test_admin_listing_reads_in_id_order(self):
+        # The full list is streamed, so reading every row is expected; sorting them is not.
+        for statement, plan in self.plans("GET", "/admin").items():
+            self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan, statement)
+        self.assertIndexed("GET", "/admin?q=planned")
+        self.assertIndexed("GET", "/admin/search?q=plan&limit=5")
+
+
+# ---------------- On-demand profiling ----------------
+class ProfilerTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        shutil.rmtree(campus.app.config["PROFILE_DIR"], ignore_errors=True)
+        campus.profile_arm._armed, campus.profile_arm._checked = False, 0.0
+        self.admin = campus.app.test_client()
+        with self.admin.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+    def slow_check(self, *args):
+        time.sleep(0.03)
+        return False
+
+    def test_profiles_only_the_armed_requests(self):
+        self.admin.post("/admin/profiles", data={"endpoint": "check_availability", "count": "2"})
+        self.assertEqual(campus.profile_arm.state(), {"endpoint": "check_availability", "remaining": 2})
+
+        with mock.patch.object(campus, "is_contact_taken", side_effect=self.slow_check):
+            self.client.get("/")  # another route doesn't use up the budget
+            for i in range(3):
+                self.client.get(f"/check-availability?email=p{i}@example.com")
+
+        profiles = campus.list_profiles()
+        self.assertEqual([p["endpoint"] for p in profiles], ["check_availability"] * 2)
+        self.assertGreaterEqual(profiles[0]["duration_ms"], 30)
+        self.assertIsNone(campus.profile_arm.state())
+        with open(os.path.join(campus.app.config["PROFILE_DIR"], profiles[0]["name"])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(any("check_availability (app.py:" in line and "slow_check (test.py:" in line
+                            for line in lines))
+
+    def test_unarmed_requests_do_not_touch_the_arm_file(self):
+        with mock.patch.object(campus.ProfileArm, "state") as state:
+            for _ in range(5):
+                self.client.get("/")
+        state.assert_not_called()
+        self.assertEqual(campus.list_profiles(), [])
+
+    def test_arming_reaches_other_workers(self):
+        other_worker = campus.ProfileArm(campus.app.config["PROFILE_DIR"])
+        self.assertFalse(other_worker.claim("home"))
+        campus.profile_arm.arm("home", 1)
+        other_worker._checked = 0.0  # its once-a-second recheck comes round
+        self.assertFalse(other_worker.claim("admin_panel"))
+        self.assertTrue(other_worker.claim("home"))
+        self.assertFalse(campus.profile_arm.claim("home"))
+
+    def test_admin_page_and_download(self):
+        self.assertEqual(self.client.get("/admin/profiles").status_code, 302)
+        self.assertEqual(self.admin.post("/admin/profiles", data={"endpoint": "nope"}).status_code, 302)
+        self.assertIsNone(campus.profile_arm.state())
+
+        self.admin.post("/admin/profiles", data={"endpoint": "home", "count": "999"})
+        self.assertEqual(campus.profile_arm.state()["remaining"], campus.app.config["PROFILE_MAX_REQUESTS"])
+        self.admin.post("/admin/profiles", data={"action": "disarm"})
+        self.assertIsNone(campus.profile_arm.state())
+
+        campus.profile_arm.arm("home", 1)
+        self.client.get("/")
+        name = campus.list_profiles()[0]["name"]
+        self.assertIn(name, self.admin.get("/admin/profiles").get_data(as_text=True))
+        resp = self.admin.get(f"/admin/profiles/{name}")
+        self.assertEqual(resp.status_code, 200)
+        resp.close()
+        self.assertEqual(self.admin.get("/admin/profiles/..%2Farmed.json").status_code, 404)
+
+
+# ---------------- Structured logging ----------------
+class StructuredLoggingTests(AppTestCase):
+    def test_request_lines_carry_request_id_route_latency_and_uid(self):
+        self.add_student("L1")
+        with self.assertLogs("campusconnect", "INFO") as logs, \
+                mock.patch.dict(campus.log.filters[0].sample_rates, clear=True):
+            resp = self.client.get("/verify/L1?gate=North", headers={"X-Request-ID": "edge-42"})
+            other = self.client.get("/", headers={"X-Request-ID": "bad id!"})
+
+        scan, access = [r for r in logs.records if r.request_id == "edge-42"]
+        self.assertEqual(resp.headers["X-Request-ID"], "edge-42")
+        self.assertEqual((scan.msg, scan.result, scan.gate, scan.uid), ("attendance.scan", "success", "North", "L1"))
+        self.assertEqual((access.msg, access.route, access.status, access.uid), ("request", "verify", 200, "L1"))
+        self.assertGreater(access.latency_ms, 0)
+        self.assertRegex(other.headers["X-Request-ID"], r"^[0-9a-f]{16}$")
+
+    def test_sampling_drops_info_but_never_warnings(self):
+        log_filter = campus.log.filters[0]
+        with mock.patch.dict(log_filter.sample_rates, {"attendance.scan": 0.1, "request:home": 0.5}, clear=True), \
+                mock.patch.object(campus.random, "random", return_value=0.3), \
+                self.assertLogs("campusconnect", "INFO") as logs:
+            campus.log.info("attendance.scan")
+            campus.log.warning("attendance.scan")
+            self.client.get("/")
+        self.assertEqual([(r.msg, r.levelname) for r in logs.records],
+                         [("attendance.scan", "WARNING"), ("request", "INFO")])
+        self.assertEqual(logs.records[1].sample_rate, 0.5)
+
+    def test_listener_writes_json_lines_and_full_queue_drops(self):
+        import io
+        out = io.StringIO()
+        stream = logging.StreamHandler(out)
+        stream.setFormatter(campus.JsonFormatter())
+        handler = campus.NonBlockingQueueHandler(campus.queue.Queue(100), stream)
+        logger = logging.getLogger("campusconnect.test-pipeline")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("whatsapp.failed", extra={"uid": "U1"})
+        handler.flush()
+        line = json.loads(out.getvalue())
+        self.assertEqual((line["event"], line["level"], line["uid"]), ("whatsapp.failed", "ERROR", "U1"))
+        self.assertIn("ValueError: boom", line["exc"])
+
+        stalled = campus.NonBlockingQueueHandler(campus.queue.Queue(1), stream)
+        stalled._listener_pid = os.getpid()  # a listener that never drains
+        for _ in range(3):
+            stalled.handle(logging.makeLogRecord({"msg": "attendance.scan"}))
+        self.assertEqual(stalled.dropped, 2)
+
+
+
+# ---------------- Analytics snapshot ----------------
+class AnalyticsSnapshotTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(_TMP_DIR, "analytics.db")
+        for key, value in {"ANALYTICS_SNAPSHOT": True, "ANALYTICS_SNAPSHOT_PATH": self.path}.items():
+            self.addCleanup(campus.app.config.__setitem__, key, campus.app.config[key])
+            campus.app.config[key] = value
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+        self.client = campus.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["admin_logged_in"] = True
+
+    def test_dashboards_read_the_snapshot_until_the_next_refresh(self):
+        self.add_student("A1")
+        self.assertTrue(campus.refresh_analytics_snapshot(force=True))
+        self.add_student("A2", semester=4)
+
+        resp = self.client.get("/dashboard_data")
+        self.assertEqual(resp.get_json()["total_students"], 1)
+        self.assertIn("X-Snapshot-Age", resp.headers)
+        self.assertEqual(self.client.get("/chart_data").get_json()["students"], [1])
+        with mock.patch.object(campus.app, "root_path", _TMP_DIR):
+            export = self.client.get("/export/csv")
+        self.assertEqual(len(export.get_data(as_text=True).splitlines()), 2)
+        export.close()
+        self.assertEqual(self.client.get("/admin/gates").status_code, 200)  # not a snapshot route
+        self.assertNotIn("X-Snapshot-Age", self.client.get("/admin/gates").headers)
+
+        self.assertFalse(campus.refresh_analytics_snapshot())  # still fresh
+        self.assertTrue(campus.refresh_analytics_snapshot(force=True))
+        self.assertEqual(self.client.get("/dashboard_data").get_json()["total_students"], 2)
+
+    def test_stale_or_missing_snapshot_falls_back_to_the_primary(self):
+        self.add_student("A1")
+        with mock.patch.object(campus.refresh_analytics_snapshot.task, "wake") as wake:
+            resp = self.client.get("/dashboard_data")
+            self.assertEqual(resp.get_json()["total_students"], 1)
+            self.assertNotIn("X-Snapshot-Age", resp.headers)
+            self.assertEqual(wake.call_count, 1)
+
+            campus.refresh_analytics_snapshot(force=True)
+            self.add_student("A2")
+            old = time.time() - campus.app.config["ANALYTICS_MAX_STALENESS"] - 5
+            os.utime(self.path, (old, old))
+            self.assertEqual(self.client.get("/dashboard_data").get_json()["total_students"], 2)
+            self.assertEqual(wake.call_count, 2)
+
+    def test_writes_go_to_the_primary_while_reads_use_the_snapshot(self):
+        self.add_student("A1")
+        campus.refresh_analytics_snapshot(force=True)
+        with campus.app.test_request_context():
+            campus.g.analytics_engine = campus.snapshot_engine(self.path)
+            self.add_student("A2")  # the snapshot is read-only; this would fail there
+            self.assertEqual(campus.Student.query.count(), 1)
+            campus.db.session.remove()
+        self.assertEqual(campus.Student.query.count(), 2)
+
+    def test_a_long_read_on_the_primary_does_not_block_gate_writes(self):
+        self.add_student("A1")
+        self.assertEqual(campus.db.session.execute(campus.db.text("PRAGMA journal_mode")).scalar(), "wal")
+        reader = campus.db.engine.raw_connection()
+        self.addCleanup(reader.close)
+        cursor = reader.cursor()
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT count(*) FROM student").fetchone()  # e.g. the snapshot copy mid-way
+
+        started = time.perf_counter()
+        self.add_student("A2")
+        self.assertLess(time.perf_counter() - started, 1)
+        reader.rollback()
+
+        campus.refresh_analytics_snapshot(force=True)
+        copy = sqlite3.connect(self.path)
+        self.addCleanup(copy.close)
+        self.assertEqual(copy.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+
+    def test_timeseries_only_caches_buckets_closed_before_the_snapshot(self):
+        t0 = datetime(2025, 3, 1, 9, 0)
+        with campus.app.test_request_context():
+            campus.g.snapshot_taken_at = t0 + timedelta(minutes=90)
+            campus.timeseries("hour", t0, t0 + timedelta(hours=3))
+        self.assertIsNotNone(campus.timeseries_cache.get(("hour", t0)))
+        self.assertIsNone(campus.timeseries_cache.get(("hour", t0 + timedelta(hours=1))))
+
+
+if __name__ == "__main__":
+    unittest.main()